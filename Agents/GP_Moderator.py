@@ -1,8 +1,16 @@
+import os
 import re
 import time
 import sys
 import json
+import threading
+from collections import Counter
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from Utils.API_utils import call_gpt35Turbo_api,gpt4_vision_caption
+from Utils.Cache_utils import bypass_response_cache
+from Utils.Concurrency_utils import run_parallel, run_captured
+from Utils.Results_utils import mark_stage
 from Agents.Agent4_InstrumentIdentification import Instrument_Recognition_Agent
 from Agents.Agent1_ActionRecognition import Action_Recognition_Agent
 from Utils.Debate_utils import (
@@ -10,13 +18,218 @@ from Utils.Debate_utils import (
     parse_instrument_response,
     parse_action_response,
     instrument_action_consistency_check,
+    extract_answer,
     evaluate_consensus,
     select_best_action_output,
-    save_candidates_to_file,
+    meets_quality_thresholds,
     Instrument_Recognition_Agent,
     Action_Recognition_Agent
 )
+from Utils.Trace_utils import traced
+from Utils.Prompt_utils import render_prompt
+from Utils.Stream_utils import stream_events, streaming_enabled, get_stream_listener
 
+MAX_REFINEMENTS = 3
+# Number of refinement candidates launched concurrently when the initial answers
+# are rejected; 0 keeps the sequential refinement loop. The first candidate
+# that meets the thresholds cancels the others.
+SPECULATIVE_REFINEMENTS = int(os.environ.get("SURGRAW_SPECULATIVE_REFINEMENTS", "0"))
+# Number of sampled completions (API `n`) requested per refinement agent call;
+# values > 1 replace the refinement rounds with one multi-sample round.
+REFINEMENT_SAMPLES = int(os.environ.get("SURGRAW_REFINEMENT_SAMPLES", "1"))
+
+
+@traced("stage")
+def refine_once(iteration, question, instrument_question, image_path, cancel_event=None):
+    """
+    Runs one refinement round (instrument rerun -> guided action rerun -> metrics)
+    and returns the candidate dict, or None if cancel_event was set in between.
+    """
+    print(f"\n[Moderator] Refinement iteration {iteration} ...")
+    # Rerun Instrument Identification Agent (Optional, if we want updated reasoning)
+    # Reruns are meant to re-sample, so they bypass the response cache
+    with bypass_response_cache():
+        refined_instrument_answer = Instrument_Recognition_Agent(instrument_question, image_path)
+    refined_instrument_name = parse_instrument_response(refined_instrument_answer)
+    print("=====================================================================================================")
+    print("\n[Debate_Agent] Rerun: Instrument_Recognition_Agent Response:\n", refined_instrument_answer)
+    print("[Debate_Agent] Rerun: Parsed Instrument Name:", refined_instrument_name)
+
+    if cancel_event is not None and cancel_event.is_set():
+        print(f"[Moderator] Refinement iteration {iteration} cancelled.")
+        return None
+
+    # Rerun Action Recognition Agent with instrument information explicitly fed in
+    refined_action_prompt_as_question_input = render_prompt("guided_action_question", instrument_name=refined_instrument_name, question=question)
+    # Run ActionRecognition_Agent again with guided input
+    with bypass_response_cache():
+        refined_action_answer = Action_Recognition_Agent(refined_action_prompt_as_question_input, image_path)
+    refined_action_name = parse_action_response(refined_action_answer)
+    print("=====================================================================================================")
+    print("\n[Debate_Agent] Rerun: Action_Recognition_Agent Response:\n", refined_action_answer)
+    print("[Debate_Agent] Rerun: Parsed Action Name:", refined_action_name)
+
+    if cancel_event is not None and cancel_event.is_set():
+        print(f"[Moderator] Refinement iteration {iteration} cancelled.")
+        return None
+
+    candidate = {
+        "instrument_answer": refined_instrument_answer,
+        "parsed_instrument_name": refined_instrument_name,
+        "action_answer": refined_action_answer,
+        "parsed_action_name": refined_action_name
+    }
+    # Re-evaluate the new candidate with our metrics
+    candidate["metrics"] = evaluate_consensus(refined_instrument_name, refined_action_name, refined_instrument_answer, refined_action_answer, question)
+    return candidate
+
+
+@traced("stage")
+def refine_with_samples(num_samples, question, instrument_question, image_path):
+    """
+    Builds the refinement candidate pool from sampled completions: one instrument
+    request and one guided action request, each returning `num_samples` answers,
+    instead of one request pair per refinement round. The action samples are all
+    guided by the instrument most instrument samples agree on, so every candidate
+    pairs an action sample with that instrument (and an instrument sample naming
+    it). Candidates are evaluated in order until one meets the quality thresholds.
+    """
+    print(f"\n[Moderator] Multi-sample refinement with {num_samples} samples per agent ...")
+    # The instrument prompt does not change between rounds, so one request yields every sample
+    with bypass_response_cache():
+        instrument_samples = Instrument_Recognition_Agent(instrument_question, image_path, num_samples=num_samples)
+    instrument_names = [parse_instrument_response(sample) for sample in instrument_samples]
+    for index, (sample, name) in enumerate(zip(instrument_samples, instrument_names), 1):
+        print("=====================================================================================================")
+        print(f"\n[Debate_Agent] Sample {index}: Instrument_Recognition_Agent Response:\n", sample)
+        print(f"[Debate_Agent] Sample {index}: Parsed Instrument Name:", name)
+
+    # Guide the action agent with the instrument most samples agree on
+    consensus_instrument = Counter(instrument_names).most_common(1)[0][0]
+    consensus_instrument_answer = instrument_samples[instrument_names.index(consensus_instrument)]
+    print(f"[Moderator] Guiding the action samples with the consensus instrument: {consensus_instrument}")
+    refined_action_prompt_as_question_input = render_prompt("guided_action_question", instrument_name=consensus_instrument, question=question)
+    with bypass_response_cache():
+        action_samples = Action_Recognition_Agent(refined_action_prompt_as_question_input, image_path, num_samples=num_samples)
+
+    candidates = []
+    for index, action_answer in enumerate(action_samples, 1):
+        action_name = parse_action_response(action_answer)
+        print("=====================================================================================================")
+        print(f"\n[Debate_Agent] Sample {index}: Action_Recognition_Agent Response:\n", action_answer)
+        print(f"[Debate_Agent] Sample {index}: Parsed Action Name:", action_name)
+        candidate = {
+            "instrument_answer": consensus_instrument_answer,
+            "parsed_instrument_name": consensus_instrument,
+            "action_answer": action_answer,
+            "parsed_action_name": action_name
+        }
+        candidate["metrics"] = evaluate_consensus(consensus_instrument, action_name, consensus_instrument_answer, action_answer, question)
+        candidates.append(candidate)
+        if meets_quality_thresholds(candidate["metrics"]):
+            print(f"[Moderator] Sample {index} meets our quality thresholds. Skipping the remaining samples.")
+            break
+    return candidates
+
+
+@traced("stage")
+def refine_speculatively(num_candidates, question, instrument_question, image_path):
+    """
+    Launches `num_candidates` refinement rounds concurrently. As soon as one meets
+    the quality thresholds, the rounds that have not started are cancelled and
+    the running ones stop at their next stage. Cancellation is only checked
+    between stages: an agent request already in flight still completes (and is
+    billed). Returns every finished candidate (in iteration order); each round's
+    output is replayed in iteration order. A BatchPending (or interrupt) from
+    any round cancels the others and propagates, so the row is staged.
+    """
+    cancel_event = threading.Event()
+    finished = {}
+    outputs = {}
+
+    with ThreadPoolExecutor(max_workers=num_candidates) as executor:
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run, run_captured,
+                lambda i=i: refine_once(i, question, instrument_question, image_path, cancel_event)
+            ): i
+            for i in range(1, num_candidates + 1)
+        }
+        for future in as_completed(futures):
+            iteration = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                candidate, error, buffer = future.result()
+            except BaseException:
+                cancel_event.set()
+                for other in futures:
+                    other.cancel()
+                raise
+            outputs[iteration] = buffer.getvalue()
+            if error is not None:
+                outputs[iteration] += f"[Moderator] Refinement iteration {iteration} failed: {error}\n"
+            elif candidate is not None:
+                finished[iteration] = candidate
+                if meets_quality_thresholds(candidate["metrics"]) and not cancel_event.is_set():
+                    outputs[iteration] += "[Moderator] This refinement meets our quality thresholds. Cancelling the other candidates.\n"
+                    cancel_event.set()
+                    for other in futures:
+                        other.cancel()
+
+    for iteration in sorted(outputs):
+        sys.stdout.write(outputs[iteration])
+    print(f"[Moderator] Speculative refinement finished {len(finished)}/{num_candidates} candidates.")
+    return [finished[iteration] for iteration in sorted(finished)]
+
+
+def _early_consensus_listener(on_consensus):
+    """
+    Stream listener that, as soon as both agents' final options have arrived,
+    parses them and runs the knowledge-graph consistency check - while the
+    rest of the answers may still be streaming. Calls on_consensus(result) once.
+    """
+    answers = {}
+    lock = threading.Lock()
+
+    def on_event(event):
+        if event["type"] != "answer" or event["source"] not in ("instrument_recognition", "action_recognition"):
+            return
+        with lock:
+            if event["source"] in answers:
+                return
+            answers[event["source"]] = event["text"]
+            if len(answers) < 2:
+                return
+        instrument_name = extract_answer(answers["instrument_recognition"], "instrument")
+        action_name = extract_answer(answers["action_recognition"], "action")
+        if instrument_name is None or action_name is None:
+            return
+        kg_consistency = instrument_action_consistency_check(instrument_name, action_name)
+        print(f"[Moderator] Early answers: instrument={instrument_name}, action={action_name}, "
+              f"kg_consistency={kg_consistency}")
+        on_consensus({"instrument_name": instrument_name, "action_name": action_name,
+                      "kg_consistency": kg_consistency})
+
+    return on_event
+
+
+def check_early_consensus(early, instrument_name, action_name):
+    """
+    Compares the consensus reported while the answers were streaming with the
+    parse of the complete answers, logs a mismatch and records both.
+    Returns True if they agree.
+    """
+    matches = (str(early["instrument_name"]).lower() == str(instrument_name).lower().strip()
+               and str(early["action_name"]).lower() == str(action_name).lower().strip())
+    if not matches:
+        print(f"[Moderator] Early consensus (instrument={early['instrument_name']}, action={early['action_name']}) "
+              f"differs from the final parse (instrument={instrument_name}, action={action_name}).")
+    mark_stage("early_consensus", {**early, "matches_final": matches})
+    return matches
+
+
+@traced("agent")
 def multi_agent_debate(question, image_path):
     """
     Orchestrates the multi-agent collaboration to ultimately recognize the surgical action.
@@ -41,18 +254,40 @@ def multi_agent_debate(question, image_path):
     print("=====================================================================================================")
 
     # 2) Get the instrument guess from the instrument identification agent
-    instrument_answer = Instrument_Recognition_Agent(instrument_question, image_path)
-    print("\n[Debate_Agent] Instrument_Recognition_Agent response:")
-    print(instrument_answer)
-    print("=====================================================================================================")
-    print("=====================================================================================================")
+    def get_instrument_answer():
+        answer = Instrument_Recognition_Agent(instrument_question, image_path)
+        print("\n[Debate_Agent] Instrument_Recognition_Agent response:")
+        print(answer)
+        print("=====================================================================================================")
+        print("=====================================================================================================")
+        return answer
 
     # 3) Get the action guess from the action recognition agent
-    action_answer = Action_Recognition_Agent(question, image_path)
-    print("\n[Debate_Agent] Action_Recognition_Agent response:")
-    print(action_answer)
-    print("=====================================================================================================")
-    print("=====================================================================================================")
+    def get_action_answer():
+        answer = Action_Recognition_Agent(question, image_path)
+        print("\n[Debate_Agent] Action_Recognition_Agent response:")
+        print(answer)
+        print("=====================================================================================================")
+        print("=====================================================================================================")
+        return answer
+
+    # Steps 2 and 3 are independent, so both agents run concurrently (log order is kept)
+    if streaming_enabled():
+        # Streamed answers: parse and check consistency once both final options are in
+        early = {}
+        outer = get_stream_listener()
+
+        def on_consensus(result):
+            early.update(result)
+            if outer is not None:
+                outer.emit({"type": "consensus", "source": "multi_agent_debate", **result})
+
+        with stream_events(_early_consensus_listener(on_consensus)):
+            instrument_answer, action_answer = run_parallel(get_instrument_answer, get_action_answer)
+    else:
+        early = {}
+        instrument_answer, action_answer = run_parallel(get_instrument_answer, get_action_answer)
+    mark_stage("agent_answers", {"instrument_answer": instrument_answer, "action_answer": action_answer})
 
     # 4) Parse the final answers from both
     instrument_name = parse_instrument_response(instrument_answer)
@@ -60,9 +295,13 @@ def multi_agent_debate(question, image_path):
     action_name = parse_action_response(action_answer)
     print("[Debate_Agent] Parsed action name:", action_name)
     print("=====================================================================================================")
+    mark_stage("parsed", {"instrument_name": instrument_name, "action_name": action_name})
+    if early:
+        check_early_consensus(early, instrument_name, action_name)
 
     # 5) Evaluate with our chosen metrics
     metrics = evaluate_consensus(instrument_name, action_name, instrument_answer, action_answer, question)
+    mark_stage("metrics", metrics)
 
     # 6) Extract individual metric values
     kg_consistency = metrics["kg_consistency"]
@@ -84,7 +323,7 @@ def multi_agent_debate(question, image_path):
     refined_candidates.append(initial_candidate)
 
     # 6) If coherence, collaboration, or consistency is poor, refine action recognition
-    if kg_consistency and cot_coherence > 3 and collab_synergy > 3:
+    if meets_quality_thresholds(metrics):
         print("\n[Moderator] Initial responses are acceptable. No refinement needed.")
         final_instrument = instrument_answer
         final_action = action_answer
@@ -93,51 +332,24 @@ def multi_agent_debate(question, image_path):
         print("=====================================================================================================")
         print("\n[Moderator] Detected inconsistency or weak collaboration. Triggering action refinement...")
 
-        max_refinements = 3
-        # Perform up to max_refinements reruns
-        for i in range(max_refinements):
-            print(f"\n[Moderator] Refinement iteration {i+1} ...")
-            # Rerun Instrument Identification Agent (Optional, if we want updated reasoning)
-            refined_instrument_answer = Instrument_Recognition_Agent(instrument_question, image_path)
-            refined_instrument_name = parse_instrument_response(refined_instrument_answer)
-            print("=====================================================================================================")
-            print("\n[Debate_Agent] Rerun: Instrument_Recognition_Agent Response:\n", refined_instrument_answer)
-            print("[Debate_Agent] Rerun: Parsed Instrument Name:", refined_instrument_name)
-
-            # Rerun Action Recognition Agent with instrument information explicitly fed in
-            refined_action_prompt_as_question_input = f"""
-            The Instrument Identification Agent has identified the instrument in question to be: {refined_instrument_name}.
-            Validate and confirm if you agree that instrument in question is {refined_instrument_name}. 
-            If you agree with the Instrument Identification Agent and the identity of the instrument in question, determine the most appropriate ongoing surgical action using the Action Recognition Chain of Thought Process.
-
-            {question}
-            """
-            # Run ActionRecognition_Agent again with guided input
-            refined_action_answer = Action_Recognition_Agent(refined_action_prompt_as_question_input, image_path)
-            refined_action_name = parse_action_response(refined_action_answer)
-            print("=====================================================================================================")
-            print("\n[Debate_Agent] Rerun: Action_Recognition_Agent Response:\n", refined_action_answer)
-            print("[Debate_Agent] Rerun: Parsed Action Name:", refined_action_name)
-
-            candidate = {
-                "instrument_answer": refined_instrument_answer,
-                "parsed_instrument_name": refined_instrument_name,
-                "action_answer": refined_action_answer,
-                "parsed_action_name": refined_action_name
-            }
-            refined_candidates.append(candidate)
-            # Re-evaluate the new candidate with our metrics
-            new_metrics = evaluate_consensus(refined_instrument_name, refined_action_name, refined_instrument_answer, refined_action_answer, question)
-            candidate["metrics"] = new_metrics
-
-            if new_metrics["kg_consistency"] and new_metrics["Coherence"] > 3 and new_metrics["Collaborative_Synergy"] > 3:
-                print("[Moderator] This refinement meets our quality thresholds. Exiting refinement loop early.")
-                break  # Accept this candidate and exit the loop
-            else:
-                print("[Moderator] This refinement did not meet the thresholds. Continuing to next iteration if available...")
-
-        # Save all refined candidates to a file
-        save_candidates_to_file(refined_candidates)
+        if REFINEMENT_SAMPLES > 1:
+            refined_candidates.extend(refine_with_samples(REFINEMENT_SAMPLES, question, instrument_question, image_path))
+        elif SPECULATIVE_REFINEMENTS > 0:
+            refined_candidates.extend(refine_speculatively(SPECULATIVE_REFINEMENTS, question, instrument_question, image_path))
+        else:
+            # Perform up to MAX_REFINEMENTS reruns
+            for i in range(MAX_REFINEMENTS):
+                candidate = refine_once(i + 1, question, instrument_question, image_path)
+                refined_candidates.append(candidate)
+
+                if meets_quality_thresholds(candidate["metrics"]):
+                    print("[Moderator] This refinement meets our quality thresholds. Exiting refinement loop early.")
+                    break  # Accept this candidate and exit the loop
+                else:
+                    print("[Moderator] This refinement did not meet the thresholds. Continuing to next iteration if available...")
+
+        # Recorded per row; Main.py saves them next to the row's log file
+        mark_stage("candidates", refined_candidates)
 
         # After up to 3 refinements, use GPT-3.5 to select the candidate with the highest confidence.
         selected_candidate = select_best_action_output(refined_candidates)
@@ -4,24 +4,31 @@ from langchain_community.document_loaders import UnstructuredHTMLLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_community.chat_models import ChatOpenAI
-from langchain.chains import RetrievalQA
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain.schema import Document
 import os
+import math
+import json
+import time
+import pickle
+import hashlib
+import threading
+import faiss
 from bs4 import BeautifulSoup
 import requests
-from langchain.prompts import PromptTemplate
+import re
 import warnings
+from Utils.API_utils import call_gpt35Turbo_api
+from Utils.Embedding_utils import get_embedding_backend, CachedEmbeddings
+from Utils.BM25_utils import BM25Index
+from Utils.Trace_utils import traced
+from Utils.Token_utils import fit_blocks_to_budget
 
 # Suppress LangChainDeprecationWarnings
 warnings.filterwarnings("ignore", category=UserWarning, module="langchain")
 warnings.filterwarnings("ignore", category=UserWarning, module="langchain_community")
 
-OPENAI_API_KEY = ''
-
-CUSTOM_QA_PROMPT = PromptTemplate(
-    input_variables=["context", "question"],
-    template="""
+CUSTOM_QA_PROMPT = """
     You are a trusted medical and surgical Retrieval-Augmented Generation expert. Below is some context from your knowledge base, followed by a multiple-choice question.
 
     Context:
@@ -37,29 +44,25 @@ CUSTOM_QA_PROMPT = PromptTemplate(
     4. If the context does not allow you to determine an answer, respond with "No relevant data found."
 
     Answer:
-    """,
-)
-
-def build_qa_chain(retriever, openai_api_key):
     """
-    Builds a RetrievalQA chain using a custom prompt that ensures
-    the final answer does not merely repeat the question.
+
+MERGED_QA_PROMPT = """
+    You are a trusted medical and surgical Retrieval-Augmented Generation expert. Below are context passages from your knowledge base, each labelled with the source it came from, followed by a multiple-choice question.
+
+    Context:
+    {context}
+
+    Question:
+    {question}
+
+    Instructions:
+    1. Do NOT repeat or restate the ANY part question or multiple-choice answer in your answer.
+    2. If the questions require the image to be analyzed to determine the answer (e.g. questions on surgical phase or surgical step), respond with "No relevant data found." for every source.
+    3. Do NOT provide the letter of the correct answer. Just return relevant information and the context.
+    4. If the passages of a source do not allow you to determine an answer, respond with "No relevant data found." for that source.
+
+    Return a JSON object that maps each source label (e.g. "S1") to your answer based only on that source's passages.
     """
-    llm = ChatOpenAI(
-        model="gpt-3.5-turbo",
-        openai_api_key=openai_api_key,
-        temperature=0
-    )
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        return_source_documents=False,  # or True if you still want them, but not printed
-        chain_type_kwargs={
-            "prompt": CUSTOM_QA_PROMPT
-        }
-    )
-    return qa_chain
 
 # URLs to fetch knowledge from (This list is non-exhaustive. Feel free to add more links.)
 # The links are just some example html pages which we used
@@ -85,49 +88,338 @@ def fetch_raw_text(url):
     except Exception as e:
         print(f"[ERROR] Error fetching {url}: {e}")
         return None
-def query_rag(query):
+# =============================================================================
+# Persisted knowledge index
+# =============================================================================
+# The index is built once by RAG_Ingest.py and saved to RAG_INDEX_DIR:
+#   index.faiss   - FAISS vectors for every chunk of every URL
+#   index.pkl     - LangChain docstore (chunk text + {"source": url} metadata)
+#   sources.json  - one record per source (url, chunks, content hash, fetch time)
+#                   plus the embedding backend the index was built with
+#   embedding_cache/ - chunk embeddings keyed by text hash, reused by later ingestions
+RAG_INDEX_DIR = os.environ.get("SURGRAW_RAG_INDEX_DIR", "rag_index")
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 50
+# Relevance threshold; defaults to the embedding backend's own threshold
+SCORE_THRESHOLD = float(os.environ["SURGRAW_RAG_SCORE_THRESHOLD"]) if os.environ.get("SURGRAW_RAG_SCORE_THRESHOLD") else None
+TOP_K = 4
+# "merged": one global top-k search and a single LLM call for all sources
+# "per_source": one search and one LLM call per URL (original behaviour)
+RAG_RETRIEVAL_MODE = os.environ.get("SURGRAW_RAG_MODE", "merged")
+MERGED_TOP_K = 8
+# Hybrid retrieval: BM25 hits above LEXICAL_THRESHOLD are fused with the dense
+# hits (reciprocal rank fusion). If neither passes, no LLM call is made.
+RAG_HYBRID = os.environ.get("SURGRAW_RAG_HYBRID", "1") != "0"
+LEXICAL_THRESHOLD = float(os.environ.get("SURGRAW_RAG_LEXICAL_THRESHOLD", "0.35"))
+RRF_K = 60
+NO_RELEVANT_DATA = "No relevant data found."
+
+_rag_store = None
+_rag_sources = None
+_rag_store_lock = threading.Lock()
+_lexical_index = None
+
+
+def get_embeddings(backend=None):
     """
-    Queries each URL separately and extracts unique, source-specific answers.
+    Returns the configured embedding backend (see Utils/Embedding_utils.py).
     """
-    results = {}
+    return get_embedding_backend(backend)
 
-    for url in URL_LIST:
-        raw_text = fetch_raw_text(url)
 
+def build_rag_index(index_dir=RAG_INDEX_DIR, urls=None, backend=None):
+    """
+    Fetches, splits and embeds every source once and saves the FAISS index
+    together with per-source metadata to index_dir. Chunk embeddings are cached
+    by text hash, so re-ingesting unchanged pages costs no embedding calls.
+    """
+    urls = urls or URL_LIST
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    documents = []
+    sources = []
+
+    for url in urls:
+        raw_text = fetch_raw_text(url)
         if raw_text is None:
-            results[url] = "No relevant data found."
             continue
-
-        # Text Splitting
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=50)
         split_docs = text_splitter.split_text(raw_text)
+        documents.extend(Document(page_content=chunk, metadata={"source": url}) for chunk in split_docs)
+        sources.append({
+            "url": url,
+            "chunks": len(split_docs),
+            "sha256": hashlib.sha256(raw_text.encode("utf-8")).hexdigest(),
+            "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+        print(f"[RAG] {url}: {len(split_docs)} chunks")
+
+    if not documents:
+        raise RuntimeError("No documents could be fetched; the RAG index was not built.")
+
+    embeddings = CachedEmbeddings(get_embeddings(backend), os.path.join(index_dir, "embedding_cache"))
+    vector_store = FAISS.from_documents(documents, embeddings)
+    print(f"[RAG] Embedded {embeddings.misses} new chunks ({embeddings.hits} from cache) with {embeddings.backend_id}")
+    os.makedirs(index_dir, exist_ok=True)
+    vector_store.save_local(index_dir)
+    with open(os.path.join(index_dir, "sources.json"), "w") as f:
+        json.dump({
+            "embedding_backend": embeddings.backend_id,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "sources": sources,
+        }, f, indent=4)
+    print(f"[RAG] Saved index with {len(documents)} chunks from {len(sources)} sources to {index_dir}")
+    return vector_store
+
+
+def _read_faiss_index(path):
+    """
+    Reads a FAISS index memory-mapped where the index type supports it.
+    """
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def load_rag_index(index_dir=RAG_INDEX_DIR):
+    """
+    Loads a prebuilt index from index_dir, with the embedding backend it was built with.
+    """
+    index = _read_faiss_index(os.path.join(index_dir, "index.faiss"))
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    backend = None
+    sources_path = os.path.join(index_dir, "sources.json")
+    if os.path.exists(sources_path):
+        with open(sources_path, "r") as f:
+            backend = json.load(f).get("embedding_backend")
+    return FAISS(get_embeddings(backend), index, docstore, index_to_docstore_id)
+
+
+def load_rag_sources(index_dir=RAG_INDEX_DIR):
+    """
+    Returns the source URLs recorded in index_dir/sources.json, in ingestion
+    order, or None for an index saved without it.
+    """
+    sources_path = os.path.join(index_dir, "sources.json")
+    if not os.path.exists(sources_path):
+        return None
+    with open(sources_path, "r") as f:
+        return [source["url"] for source in json.load(f).get("sources", [])]
+
+
+def get_rag_store(index_dir=RAG_INDEX_DIR):
+    """
+    Returns the process-wide vector store, loading it once. If no prebuilt index
+    exists yet, it is built and saved first.
+    """
+    global _rag_store, _rag_sources
+    if _rag_store is None:
+        with _rag_store_lock:
+            if _rag_store is None:
+                if os.path.exists(os.path.join(index_dir, "index.faiss")):
+                    store = load_rag_index(index_dir)
+                    print(f"[RAG] Loaded prebuilt index from {index_dir}")
+                else:
+                    print(f"[RAG] No prebuilt index at {index_dir}; building it now (see RAG_Ingest.py).")
+                    build_rag_index(index_dir)
+                    store = load_rag_index(index_dir)
+                _rag_sources = load_rag_sources(index_dir) or URL_LIST
+                _rag_store = store
+    return _rag_store
+
+
+def get_rag_sources():
+    """
+    Returns the source URLs of the loaded index (URL_LIST for an index saved
+    without sources.json).
+    """
+    get_rag_store()
+    return _rag_sources
+
+
+def get_lexical_index():
+    """
+    Returns (BM25Index, documents) over every chunk of the loaded vector store,
+    built once per process.
+    """
+    global _lexical_index
+    if _lexical_index is None:
+        vector_store = get_rag_store()
+        with _rag_store_lock:
+            if _lexical_index is None:
+                documents = [vector_store.docstore.search(doc_id) for doc_id in vector_store.index_to_docstore_id.values()]
+                _lexical_index = (BM25Index([doc.page_content for doc in documents]), documents)
+    return _lexical_index
+
+
+@traced("agent")
+def query_rag(query, mode=None, max_tokens=None):
+    """
+    Retrieves knowledge for `query` from the prebuilt index and returns one
+    "url:\nanswer" block per source of the index, most relevant source first.
+    With max_tokens, the blocks are fit into that many tokens (lower-ranked
+    sources are truncated or dropped first).
+    """
+    mode = mode or RAG_RETRIEVAL_MODE
+    if mode == "per_source":
+        return query_rag_per_source(query, max_tokens)
+    return query_rag_merged(query, max_tokens)
+
+
+def _relevance(distance_strategy, score):
+    """
+    Maps a FAISS score to a relevance in [0, 1], on the scale the embedding
+    backends' default_score_threshold values were chosen for.
+    """
+    if distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        # Inner product of unit-length embeddings is the cosine similarity
+        return score
+    if distance_strategy == DistanceStrategy.COSINE:
+        return 1.0 - score
+    # Euclidean distance of unit-length embeddings: 0 (identical) to sqrt(2) (orthogonal)
+    return 1.0 - score / math.sqrt(2)
 
-        # Convert to LangChain Document format
-        documents = [Document(page_content=chunk, metadata={"source": url}) for chunk in split_docs]
 
-        # Embedding and FAISS vector storage (URL-specific)
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-        vector_store = FAISS.from_documents(documents, embeddings)
-        retriever = vector_store.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={'score_threshold': 0.50}
-        )
+def _search(vector_store, query_embedding, k, filter=None):
+    """
+    Returns [(doc, relevance)] above the relevance threshold, best first.
+    """
+    threshold = SCORE_THRESHOLD
+    if threshold is None:
+        threshold = getattr(vector_store.embedding_function, "default_score_threshold", 0.50)
+    docs_and_scores = vector_store.similarity_search_with_score_by_vector(
+        query_embedding, k=k, filter=filter, fetch_k=max(50, k)
+    )
+    scored = [(doc, _relevance(vector_store.distance_strategy, score)) for doc, score in docs_and_scores]
+    return [(doc, relevance) for doc, relevance in scored if relevance >= threshold]
+
+
+def _lexical_search(query, k, source=None):
+    """
+    Returns [(doc, relevance)] of BM25 hits above LEXICAL_THRESHOLD, best first.
+    """
+    bm25, documents = get_lexical_index()
+    candidates = None
+    if source is not None:
+        candidates = {i for i, doc in enumerate(documents) if doc.metadata.get("source") == source}
+    return [(documents[i], relevance) for i, relevance in bm25.search(query, k=k, candidates=candidates)
+            if relevance >= LEXICAL_THRESHOLD]
+
+
+@traced("stage")
+def hybrid_search(query, k, source=None, query_embedding=None):
+    """
+    Combines dense and BM25 hits with reciprocal rank fusion.
+    Pass query_embedding to reuse an already embedded query.
+    Returns [(doc, {"dense": relevance or None, "lexical": relevance or None})],
+    best first; an empty list means neither signal found anything relevant.
+    """
+    vector_store = get_rag_store()
+    filter = {"source": source} if source is not None else None
+    lexical = _lexical_search(query, k, source) if RAG_HYBRID else []
+    if query_embedding is None:
+        query_embedding = vector_store.embedding_function.embed_query(query)
+    dense = _search(vector_store, query_embedding, k, filter=filter)
+
+    fused = {}
+    for signal, hits in (("dense", dense), ("lexical", lexical)):
+        for rank, (doc, relevance) in enumerate(hits):
+            key = (doc.metadata.get("source"), doc.page_content)
+            entry = fused.setdefault(key, {"doc": doc, "rrf": 0.0, "dense": None, "lexical": None})
+            entry["rrf"] += 1.0 / (RRF_K + rank + 1)
+            entry[signal] = relevance
 
-        # Retrieve relevant documents
-        retrieved_docs = retriever.get_relevant_documents(query)
+    ranked = sorted(fused.values(), key=lambda entry: entry["rrf"], reverse=True)[:k]
+    return [(entry["doc"], {"dense": entry["dense"], "lexical": entry["lexical"]}) for entry in ranked]
+
+
+def _describe_scores(scores):
+    return ", ".join(f"{signal} {value:.2f}" for signal, value in scores.items() if value is not None)
+
+
+def _format_results(results, ranked=(), max_tokens=None):
+    """
+    Joins {url: answer} into "url:\nanswer" blocks: the sources in `ranked`
+    (best first) lead, sources without relevant data come last.
+    """
+    relevant = [url for url in results if results[url] != NO_RELEVANT_DATA]
+    order = [url for url in ranked if url in relevant]
+    order += [url for url in relevant if url not in order]
+    order += [url for url in results if url not in order]
+    blocks = [f"{url}:\n{results[url]}" for url in order]
+    return "\n\n".join(fit_blocks_to_budget("rag_context", blocks, max_tokens, model="gpt-4o-latest"))
+
+
+@traced("stage")
+def query_rag_merged(query, max_tokens=None):
+    """
+    Searches the combined index once, keeps the global top-k chunks with their
+    source attribution and answers for every source in a single LLM call.
+    """
+    results = {url: NO_RELEVANT_DATA for url in get_rag_sources()}
+    retrieved = hybrid_search(query, MERGED_TOP_K)
+    print(f"Retrieved {[doc for doc, _ in retrieved]} ")
+
+    if not retrieved:
+        # Neither the dense nor the lexical signal found anything: skip the LLM call
+        print("[RAG] No chunk passed the dense or lexical threshold; skipping the LLM call.")
+        return _format_results(results, max_tokens=max_tokens)
+
+    # Label each source that contributed at least one chunk
+    labels = {}
+    context_blocks = []
+    for doc, scores in retrieved:
+        url = doc.metadata.get("source", "unknown")
+        label = labels.setdefault(url, f"S{len(labels) + 1}")
+        context_blocks.append(f"[{label}] ({url}, {_describe_scores(scores)})\n{doc.page_content}")
+
+    prompt = MERGED_QA_PROMPT.format(context="\n\n".join(context_blocks), question=query)
+    response = call_gpt35Turbo_api(prompt, temperature=0, response_format={"type": "json_object"})
+
+    try:
+        answers = json.loads(re.search(r"\{.*\}", response, re.DOTALL).group(0))
+    except (AttributeError, TypeError, ValueError):
+        # Unstructured (or empty) reply: attribute it to the best matching source
+        answers = {labels[retrieved[0][0].metadata.get("source", "unknown")]: response or ""}
+    if not isinstance(answers, dict):
+        answers = {}
+
+    for url, label in labels.items():
+        answer = answers.get(label)
+        if isinstance(answer, str) and answer.strip():
+            results[url] = answer.strip()
+
+    # Labels were assigned in retrieval rank order
+    return _format_results(results, ranked=list(labels), max_tokens=max_tokens)
+
+
+@traced("stage")
+def query_rag_per_source(query, max_tokens=None):
+    """
+    Queries each URL separately and extracts unique, source-specific answers
+    from the prebuilt index.
+    """
+    results = {}
+    best_relevance = {}
+    query_embedding = get_rag_store().embedding_function.embed_query(query)
+
+    for url in get_rag_sources():
+        # Retrieve relevant documents of this source only
+        retrieved = hybrid_search(query, TOP_K, source=url, query_embedding=query_embedding)
+        retrieved_docs = [doc for doc, _ in retrieved]
         print(f"Retrieved {retrieved_docs} ")
 
         if not retrieved_docs:  # No relevant documents retrieved
-            results[url] = "No relevant data found."
+            results[url] = NO_RELEVANT_DATA
             continue
 
-        # Query each document separately
-        qa_chain = build_qa_chain(retriever, OPENAI_API_KEY)
-
-        # Retrieve answer
-        result = qa_chain.invoke({"query": query})  # Use `.invoke()` instead of `__call__`
-        results[url] = result["result"]
+        # Answer from this source's documents
+        context = "\n\n".join(doc.page_content for doc in retrieved_docs)
+        response = call_gpt35Turbo_api(CUSTOM_QA_PROMPT.format(context=context, question=query), temperature=0)
+        results[url] = (response or "").strip() or NO_RELEVANT_DATA
+        best_relevance[url] = max(value for value in retrieved[0][1].values() if value is not None)
 
-    # Format and return results
-    formatted_results = "\n\n".join([f"{url}:\n{answer}" for url, answer in results.items()])
-    return formatted_results
+    # Format and return results, best matching source first
+    return _format_results(results, ranked=sorted(best_relevance, key=best_relevance.get, reverse=True),
+                           max_tokens=max_tokens)
@@ -0,0 +1,401 @@
+import re
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# =============================================================================
+# Local OpenAI-compatible stand-in server
+# =============================================================================
+# Answers POST /v1/chat/completions without any network access, so the whole
+# pipeline can be benchmarked offline. For each request the server
+#   - sleeps for a latency drawn from a configurable distribution (per model),
+#   - optionally answers 429 with a Retry-After header instead,
+#   - returns a scripted reply that the pipeline's parsers accept: agent prompts
+#     get a short chain of thought ending in "The answer is: Option (X)",
+#     classifiers get a category, rubric prompts get ratings, RAG prompts get
+#     one answer per source label.
+# Requests with "stream": true get the reply as server-sent events, word by
+# word, with a fifth of the latency before the first chunk and the rest spread
+# over the chunks. GET /stats returns the request counters, POST /reset clears them, and
+# GET /docs/<name> serves small HTML pages to build an offline RAG index from.
+#
+# Latency specs:
+#   fixed:S               always S seconds
+#   uniform:A,B           uniform between A and B seconds
+#   lognormal:MEDIAN,SIGMA  log-normal with the given median (seconds) and sigma
+#   exp:MEAN              exponential with the given mean (seconds)
+
+OPTION_LETTERS = "ABCDEFG"
+# Share of the latency spent before the first chunk of a streamed reply
+TIME_TO_FIRST_CHUNK = 0.2
+INSTRUMENT_NAMES = {
+    "A": "stapler", "B": "monopolar curved scissors", "C": "needle driver", "D": "forceps",
+    "E": "permanent cautery hook", "F": "clip applier", "G": "grasper",
+}
+
+DOCUMENTS = {
+    "prostatectomy": (
+        "Robotic-assisted radical prostatectomy removes the prostate gland and seminal vesicles. "
+        "After the bladder neck is divided, the surgeon dissects the seminal vesicles and the vas deferens. "
+        "The next step after dissection of the prostatic pedicles is the apical dissection and division of the urethra. "
+        "The vesicourethral anastomosis is then sutured with a needle driver. "
+        "Nerve sparing improves the outcome for continence and erectile function. "
+        "A significant complication of the procedure is urinary incontinence."
+    ),
+    "lung_cancer": (
+        "Lung and bronchus cancer is most often diagnosed in patients aged 65 to 74. "
+        "The median age of a patient at diagnosis is 71 years. "
+        "Lobectomy is the standard surgical treatment of early stage non-small cell lung cancer. "
+        "The expected outcome after complete resection is a five-year survival above sixty percent. "
+        "Smoking history is the main risk factor reported in the patient history."
+    ),
+    "prostate_cancer": (
+        "Prostate cancer is the most common cancer in men; the median age of the patient at diagnosis is 67. "
+        "Localized disease has a five-year relative survival close to one hundred percent. "
+        "Radical prostatectomy is recommended for patients with localized disease and a long life expectancy. "
+        "The purpose of lymph node dissection is accurate staging of the disease."
+    ),
+}
+
+
+def parse_latency(spec):
+    """
+    Returns a zero-argument sampler (seconds) for a latency spec such as "uniform:0.2,0.8".
+    """
+    kind, _, args = spec.strip().partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def parse_model_latencies(specs):
+    """
+    Parses ["model=spec", "spec", ...] into {model or "*": sampler}.
+    """
+    latencies = {"*": parse_latency("fixed:0")}
+    for item in specs or []:
+        model, _, spec = item.rpartition("=")
+        latencies[model.strip() or "*"] = parse_latency(spec)
+    return latencies
+
+
+# =============================================================================
+# Scripted answers
+# =============================================================================
+def _prompt_text(messages):
+    """
+    Returns the text parts of the last user message and whether it carries an image.
+    """
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content, False
+        texts = [part.get("text", "") for part in content if part.get("type") == "text"]
+        has_image = any(part.get("type") == "image_url" for part in content)
+        return "\n".join(texts), has_image
+    return "", False
+
+
+def _guess_category(question):
+    question = question.lower()
+    if "instrument" in question and "action" not in question:
+        return "instrument recognition"
+    if "ongoing action" in question or "action of" in question:
+        return "action recognition"
+    if "next" in question or "plan" in question:
+        return "action prediction"
+    if "patient" in question:
+        return "patient detail"
+    return "outcome"
+
+
+class AnswerScript:
+    """
+    Builds the reply for a prompt. `answer` is a fixed option letter, or
+    "random" for a letter drawn per prompt and sample (deterministic for a
+    given seed, so repeated runs make the same number of calls).
+    """
+
+    def __init__(self, answer="D", seed=0):
+        self.answer = answer
+        self.seed = seed
+
+    def option(self, prompt, index):
+        if self.answer != "random":
+            return self.answer
+        digest = hashlib.sha256(f"{self.seed}:{index}:{prompt}".encode("utf-8")).digest()
+        return OPTION_LETTERS[digest[0] % len(OPTION_LETTERS)]
+
+    def reply(self, messages, json_mode, index=0):
+        prompt, has_image = _prompt_text(messages)
+
+        if json_mode:
+            if "maps every question number" in prompt:
+                questions = re.findall(r'^\s*(\d+)\.\s*"(.*)"\s*$', prompt, re.MULTILINE)
+                return json.dumps({number: _guess_category(question) for number, question in questions})
+            if '"category"' in prompt:
+                question = re.search(r'Question:\s*"(.*)"', prompt, re.DOTALL)
+                return json.dumps({"category": _guess_category(question.group(1) if question else prompt)})
+            if "<integer 1-5>" in prompt:
+                return json.dumps({name: 4 for name in re.findall(r'"([^"]+)":\s*<integer 1-5>', prompt)})
+            if "source label" in prompt:
+                labels = sorted(set(re.findall(r"\[(S\d+)\]", prompt)))
+                return json.dumps({label: f"The passages of {label} describe the relevant surgical context." for label in labels})
+            return "{}"
+
+        if "integer rating between 1" in prompt:
+            return "4"
+        if "best candidate number" in prompt:
+            return "1"
+        if '"vision-based" or "knowledge-based"' in prompt:
+            question = re.search(r'Question:\s*"(.*)"', prompt, re.DOTALL)
+            category = _guess_category(question.group(1) if question else prompt)
+            return "vision-based" if category in ("instrument recognition", "action recognition") else "knowledge-based"
+        if "Answer with exactly one of the following terms" in prompt:
+            question = re.search(r'Question:\s*"(.*)"', prompt, re.DOTALL)
+            return _guess_category(question.group(1) if question else prompt)
+        if "Return only the extracted" in prompt:
+            return INSTRUMENT_NAMES[self.option(prompt, index)]
+
+        letter = self.option(prompt, index)
+        observation = "The image shows the tip of the instrument in contact with tissue." if has_image else \
+            "The question concerns the current stage of the procedure."
+        return (
+            f"Step 1: {observation}\n"
+            "Step 2: The shape of the jaws and the visible motion narrow the options.\n"
+            "Step 3: The remaining options are inconsistent with the scene.\n"
+            f"The answer is: Option ({letter})"
+        )
+
+
+# =============================================================================
+# Server
+# =============================================================================
+class MockState:
+    """
+    Configuration and counters shared by all request handler threads.
+    """
+
+    def __init__(self, latencies, error_rate=0.0, retry_after=1.0, answer="D", seed=0):
+        self.latencies = latencies
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.script = AnswerScript(answer, seed)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.rate_limited = Counter()
+            self.completions = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.latency_s = 0.0
+
+    def should_rate_limit(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def latency(self, model):
+        sampler = self.latencies.get(model, self.latencies["*"])
+        return max(0.0, sampler())
+
+    def record(self, model, rate_limited=False, latency=0.0, completions=0, prompt_tokens=0, completion_tokens=0):
+        with self._lock:
+            self.requests[model] += 1
+            if rate_limited:
+                self.rate_limited[model] += 1
+            self.latency_s += latency
+            self.completions += completions
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "rate_limited": sum(self.rate_limited.values()),
+                "requests_per_model": dict(self.requests),
+                "rate_limited_per_model": dict(self.rate_limited),
+                "completions": self.completions,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latency_s": round(self.latency_s, 3),
+            }
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.state.stats())
+        elif self.path.startswith("/docs/") and self.path[len("/docs/"):] in DOCUMENTS:
+            text = DOCUMENTS[self.path[len("/docs/"):]]
+            body = f"<html><body><p>{text}</p></body></html>".encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/reset":
+            self.state.reset()
+            self._send_json(200, {"reset": True})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        self._chat_completion(payload)
+
+    def _chat_completion(self, payload):
+        state = self.state
+        model = payload.get("model", "unknown")
+        if state.should_rate_limit():
+            state.record(model, rate_limited=True)
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                            headers={"Retry-After": f"{state.retry_after:g}"})
+            return
+
+        latency = state.latency(model)
+        streaming = bool(payload.get("stream"))
+        time.sleep(latency * TIME_TO_FIRST_CHUNK if streaming else latency)
+
+        messages = payload.get("messages", [])
+        json_mode = (payload.get("response_format") or {}).get("type") == "json_object"
+        texts = [state.script.reply(messages, json_mode, index) for index in range(int(payload.get("n") or 1))]
+        prompt_tokens = sum(_count_tokens(json.dumps(message.get("content"))) for message in messages)
+        completion_tokens = sum(_count_tokens(text) for text in texts)
+        state.record(model, latency=latency, completions=len(texts),
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+        completion_id = f"chatcmpl-mock-{hashlib.sha256(repr(payload).encode('utf-8')).hexdigest()[:12]}"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if streaming:
+            self._stream_chat_completion(completion_id, model, texts[0], usage, latency * (1 - TIME_TO_FIRST_CHUNK))
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {"index": index, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                for index, text in enumerate(texts)
+            ],
+            "usage": usage,
+        })
+
+    def _stream_chat_completion(self, completion_id, model, text, usage, duration):
+        """
+        Sends `text` as chat.completion.chunk events (chunked transfer encoding),
+        followed by a usage chunk and [DONE].
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data):
+            body = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(choices, usage=None):
+            return json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                               "model": model, "choices": choices, "usage": usage})
+
+        pieces = re.findall(r"\S*\s*", text)[:-1] or [text]
+        for piece in pieces:
+            send_event(chunk([{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+            time.sleep(duration / len(pieces))
+        send_event(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        send_event(chunk([], usage=usage))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_server(state, host="127.0.0.1", port=0):
+    """
+    Starts the server on a background thread. Returns the ThreadingHTTPServer
+    (its port is server.server_address[1]).
+    """
+    handler = type("BoundMockOpenAIHandler", (MockOpenAIHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server for offline benchmarks.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (0 picks a free port).")
+    parser.add_argument("--latency", type=str, action="append", default=None,
+                        help='Latency spec, optionally per model: "lognormal:0.8,0.4" or "gpt-4o-latest=uniform:1,3". Repeatable.')
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After (seconds) sent with injected 429s.")
+    parser.add_argument("--answer", type=str, default="D", help='Option letter of every scripted answer, or "random".')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mock_state = MockState(parse_model_latencies(args.latency), args.error_rate, args.retry_after, args.answer, args.seed)
+    mock_server = start_server(mock_state, args.host, args.port)
+    host, port = mock_server.server_address[:2]
+    # The benchmark runner reads this line to find the port
+    print(f"[Mock] Listening on http://{host}:{port}/v1", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock_server.shutdown()
+        sys.exit(0)
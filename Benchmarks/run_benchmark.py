@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# =============================================================================
+# Offline throughput benchmark
+# =============================================================================
+# Starts Benchmarks/mock_openai_server.py in a subprocess, points the OpenAI
+# client at it and drives final_orchestrator, multi_agent_debate and query_rag
+# over a synthetic dataset at several concurrency levels. No real API calls and
+# no network access are made: the RAG index is built with the hashing embedding
+# backend from pages served by the mock server.
+#
+# One record per (target, concurrency) goes to the output JSON:
+#   rows_per_s, p50/p95 row latency, LLM calls per row (client side), server
+#   requests per row (incl. injected 429s), retries, tokens per row, and the
+#   Python-side overhead as CPU time of this process per row and per call
+#   (the mock server runs in its own process, so its CPU time is excluded).
+#
+# Usage:
+#   python -m Benchmarks.run_benchmark --rows 24 --concurrency 1,4,16 \
+#       --latency "lognormal:0.3,0.4" --error_rate 0.02 --output benchmark_results.json
+
+TARGETS = ["final_orchestrator", "multi_agent_debate", "query_rag"]
+
+OPTIONS_INSTRUMENT = "(A) Stapler\n(B) Monopolar Curved Scissors\n(C) Needle Driver\n(D) Forceps\n(E) Permanent Cautery Hook\n(F) Clip Applier\n(G) Grasper"
+OPTIONS_ACTION = "(A) Retraction\n(B) Suturing\n(C) Cauterization\n(D) Grasping\n(E) Cutting\n(F) Tool Manipulation\n(G) Applying Clip"
+
+# (route, question) templates of the synthetic dataset, one per leaf route
+QUESTIONS = [
+    ("instrument recognition", f"What is the most likely surgical instrument visible in the image?\n{OPTIONS_INSTRUMENT}"),
+    ("action recognition", f"What is the most likely ongoing action of the surgical instrument in the image?\n{OPTIONS_ACTION}"),
+    ("action prediction", "What is the next step of the procedure after the dissection of the prostatic pedicles?\n"
+                          "(A) Apical dissection\n(B) Bladder neck division\n(C) Lymph node dissection\n(D) Port placement"),
+    ("outcome", "What is the significance of nerve sparing for the outcome of the procedure?\n"
+                "(A) Better continence and erectile function\n(B) Shorter operating time\n(C) Less bleeding\n(D) No significance"),
+    ("patient detail", "What is the most likely age of the patient at diagnosis of the disease?\n"
+                       "(A) Under 40\n(B) 40 to 54\n(C) 55 to 64\n(D) 65 to 74"),
+]
+
+# 1x1 PNG used as the surgical frame of every row
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+def start_mock_server(args):
+    """
+    Starts the mock server subprocess and returns (process, base_url).
+    """
+    command = [sys.executable, "-m", "Benchmarks.mock_openai_server", "--port", "0",
+               "--error_rate", str(args.error_rate), "--retry_after", str(args.retry_after),
+               "--answer", args.answer, "--seed", str(args.seed)]
+    for spec in args.latency:
+        command += ["--latency", spec]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(command, cwd=root, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if "Listening on" not in line:
+        process.kill()
+        raise RuntimeError(f"Mock server did not start: {line!r}")
+    base_url = line.split("Listening on", 1)[1].strip()
+    print(f"[Benchmark] Mock server at {base_url}")
+    return process, base_url
+
+
+def _server_call(base_url, path, method="GET"):
+    root = base_url[:-len("/v1")] if base_url.endswith("/v1") else base_url
+    request = urllib.request.Request(root + path, data=b"{}" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def build_dataset(work_dir, rows, target):
+    """
+    Returns [(route, question, image_path)] for `target`, cycling through the
+    question templates the target accepts.
+    """
+    image_path = os.path.join(work_dir, "frame.png")
+    if not os.path.exists(image_path):
+        with open(image_path, "wb") as f:
+            f.write(PIXEL_PNG)
+    if target == "multi_agent_debate":
+        templates = [item for item in QUESTIONS if item[0] == "action recognition"]
+    elif target == "query_rag":
+        templates = [item for item in QUESTIONS if item[0] in ("action prediction", "outcome", "patient detail")]
+    else:
+        templates = QUESTIONS
+    return [(*templates[i % len(templates)], image_path) for i in range(rows)]
+
+
+def _scheduler_totals(stats):
+    return {
+        "retries": sum(model["retries"] for model in stats.values()),
+        "rate_limited": sum(model["rate_limited"] for model in stats.values()),
+    }
+
+
+def run_level(target, dataset, concurrency, base_url):
+    """
+    Runs every row of `dataset` through `target` with `concurrency` worker
+    threads and returns the measurements of this level.
+    """
+    from Orchestrators import final_orchestrator
+    from Agents.GP_Moderator import multi_agent_debate
+    from Agents.RAG_module import query_rag
+    from Utils.API_utils import get_scheduler_stats
+    from Utils.Concurrency_utils import capture_output
+    from Utils.Results_utils import row_result
+    from Utils.Trace_utils import percentile
+    from Utils.Batch_utils import BatchPending
+
+    functions = {
+        "final_orchestrator": lambda question, image_path: final_orchestrator(question, image_path),
+        "multi_agent_debate": multi_agent_debate,
+        "query_rag": lambda question, image_path: query_rag(question),
+    }
+    function = functions[target]
+
+    def run_row(item):
+        _, question, image_path = item
+        error = None
+        with row_result() as result, capture_output():
+            try:
+                function(question, image_path)
+            except (Exception, BatchPending) as e:
+                # A failed row must not stop the other rows of the level
+                error = e
+        return result.finished - result.started, result.llm_calls, result.prompt_tokens, result.completion_tokens, error
+
+    _server_call(base_url, "/reset", "POST")
+    scheduler_before = _scheduler_totals(get_scheduler_stats())
+    cpu_start = time.process_time()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(run_row, dataset))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_start
+    scheduler_after = _scheduler_totals(get_scheduler_stats())
+    server = _server_call(base_url, "/stats")
+
+    rows = len(dataset)
+    latencies = sorted(outcome[0] for outcome in outcomes)
+    calls = sum(outcome[1] for outcome in outcomes)
+    errors = [outcome[4] for outcome in outcomes if outcome[4] is not None]
+    if errors:
+        print(f"[Benchmark] {target} @ {concurrency}: {len(errors)} row(s) failed, e.g. {errors[0]!r}")
+    return {
+        "target": target,
+        "concurrency": concurrency,
+        "rows": rows,
+        "failed_rows": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 3) if elapsed else None,
+        "row_latency_p50_s": round(percentile(latencies, 0.50), 3),
+        "row_latency_p95_s": round(percentile(latencies, 0.95), 3),
+        "llm_calls_per_row": round(calls / rows, 3),
+        "server_requests_per_row": round(server["requests"] / rows, 3),
+        "server_requests_per_model": server["requests_per_model"],
+        "rate_limited": server["rate_limited"],
+        "retries": scheduler_after["retries"] - scheduler_before["retries"],
+        "prompt_tokens_per_row": round(sum(outcome[2] for outcome in outcomes) / rows, 1),
+        "completion_tokens_per_row": round(sum(outcome[3] for outcome in outcomes) / rows, 1),
+        "server_latency_s_per_row": round(server["latency_s"] / rows, 3),
+        "python_cpu_s_per_row": round(cpu / rows, 4),
+        "python_cpu_ms_per_call": round(1000 * cpu / calls, 3) if calls else None,
+    }
+
+
+def print_summary(records):
+    header = f"{'target':<20} {'conc':>5} {'rows/s':>8} {'p50 s':>7} {'p95 s':>7} {'calls/row':>10} {'429s':>5} {'retries':>7} {'cpu ms/call':>11} {'failed':>6}"
+    print(header)
+    print("-" * len(header))
+    for record in records:
+        cpu_per_call = record["python_cpu_ms_per_call"]
+        print(f"{record['target']:<20} {record['concurrency']:>5} {record['rows_per_s']:>8.2f} "
+              f"{record['row_latency_p50_s']:>7.2f} {record['row_latency_p95_s']:>7.2f} {record['llm_calls_per_row']:>10.2f} "
+              f"{record['rate_limited']:>5} {record['retries']:>7} "
+              f"{(cpu_per_call if cpu_per_call is not None else 0.0):>11.2f} {record['failed_rows']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark against a local OpenAI-compatible mock server.")
+    parser.add_argument("--targets", type=str, default=",".join(TARGETS),
+                        help=f"Comma-separated functions to drive ({', '.join(TARGETS)}).")
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--rows", type=int, default=20, help="Rows per target and concurrency level.")
+    parser.add_argument("--latency", type=str, action="append", default=None,
+                        help='Mock latency spec, optionally per model (repeatable), e.g. "uniform:0.05,0.15" '
+                             'or "gpt-4o-latest=lognormal:0.8,0.4". Use "fixed:0" to measure pure overhead.')
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of mock requests answered with 429.")
+    parser.add_argument("--retry_after", type=float, default=0.2, help="Retry-After (seconds) of injected 429s.")
+    parser.add_argument("--answer", type=str, default="D", help='Scripted option letter, or "random" to exercise refinements.')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Machine-readable results (JSON).")
+    args = parser.parse_args()
+    args.latency = args.latency or ["uniform:0.05,0.15"]
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown = [target for target in targets if target not in TARGETS]
+    if unknown:
+        parser.error(f"Unknown target(s): {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    process, base_url = start_mock_server(args)
+    work_dir = tempfile.mkdtemp(prefix="surgraw_benchmark_")
+    try:
+        # API_utils and RAG_module read their configuration at import time, so
+        # the environment has to point at the mock server before the first import
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["SURGRAW_RAG_INDEX_DIR"] = os.path.join(work_dir, "rag_index")
+        os.environ["SURGRAW_BACKOFF_BASE"] = os.environ.get("SURGRAW_BACKOFF_BASE", "0.1")
+        os.environ.pop("SURGRAW_CACHE_DIR", None)
+        os.environ.pop("SURGRAW_TRACE_FILE", None)
+        # No inherited batch or journal settings either: rows are measured as plain synchronous calls
+        for name in [name for name in os.environ if name.startswith(("SURGRAW_BATCH", "SURGRAW_JOURNAL"))]:
+            os.environ.pop(name)
+
+        from Benchmarks.mock_openai_server import DOCUMENTS
+        from Agents.RAG_module import build_rag_index
+        from Utils.Concurrency_utils import capture_output
+
+        root = base_url[:-len("/v1")]
+        with capture_output():
+            build_rag_index(os.environ["SURGRAW_RAG_INDEX_DIR"], urls=[f"{root}/docs/{name}" for name in DOCUMENTS], backend="hashing")
+
+        records = []
+        for target in targets:
+            dataset = build_dataset(work_dir, args.rows, target)
+            for concurrency in levels:
+                print(f"[Benchmark] {target}: {args.rows} rows at concurrency {concurrency}")
+                records.append(run_level(target, dataset, concurrency, base_url))
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_summary(records)
+    report = {
+        "config": {
+            "rows": args.rows,
+            "concurrency": levels,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "retry_after": args.retry_after,
+            "answer": args.answer,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": records,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    print(f"[Benchmark] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
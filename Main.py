@@ -2,10 +2,271 @@ import argparse
 import os
 import sys
 import io
-from contextlib import redirect_stdout, redirect_stderr
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
-from tqdm import tqdm  
-from Orchestrators import final_orchestrator
+from tqdm import tqdm
+from Orchestrators import final_orchestrator, plan_routes, ESTIMATED_LLM_CALLS, CLASSIFIER_BATCH_SIZE
+from Utils.Router_utils import LEAF_ROUTES, ROUTE_DEPARTMENT, enable_router_model
+from Utils.Concurrency_utils import capture_output, install_thread_local_streams
+from Utils.Cache_utils import enable_response_cache, get_response_cache
+from Utils.Debate_utils import get_extraction_stats, save_candidates_to_file
+from Utils.API_utils import get_scheduler_stats
+from Utils.Token_utils import get_budget_stats
+from Utils.Batch_utils import (
+    BatchSession,
+    batch_row,
+    submit_openai_batches,
+    poll_openai_batches,
+    complete_batches_locally,
+    wait_for_batches,
+)
+from Utils.Journal_utils import RunJournal, journal_row
+from Utils.Results_utils import ResultsSink, row_result, build_record
+from Utils.Trace_utils import enable_tracing, get_tracer, span
+
+
+def process_row(index, row, log_dir, echo=print, batch_session=None, journal=None, results=None):
+    """
+    Runs the orchestrator on a single row and writes its captured output to
+    <image_name>_<COT_FileNamingConvention>_SurgCOT.txt inside log_dir (debate
+    refinement candidates go to ..._candidates.json next to it).
+    Output is captured per thread, so this is safe to call from worker threads.
+    With a batch_session, API calls are answered from batch results; if the row
+    still needs responses nothing is written and None is returned.
+    With a journal, the row's lifecycle and LLM responses are journaled, and
+    responses journaled by an earlier (interrupted) run are replayed.
+    With a results sink, one structured record is written per finished row.
+    """
+    image_path = row["image_path"]
+    cot_process = row["COT_Process"]
+    question = row["question_mcq"]
+    # Route decided by the planning stage, if any
+    route = row.get("route", None)
+    if not isinstance(route, str):
+        route = None
+
+    # Derive image_name from image_path (remove directory and extension)
+    base_name = os.path.basename(image_path)
+    image_name, _ = os.path.splitext(base_name)
+    # Sanitize the COT_Process string (e.g., replace spaces with underscores)
+    COT_FileNamingConvention = str(cot_process).replace(" ", "_")
+    # Create the log file name as specified
+    log_file_name = f"{image_name}_{COT_FileNamingConvention}_SurgCOT.txt"
+    log_file_path = os.path.join(log_dir, log_file_name)
+    # Refinement candidates of the debate, if any, are saved next to the log
+    candidates_path = os.path.join(log_dir, f"{image_name}_{COT_FileNamingConvention}_candidates.json")
+
+    echo(f"\n[INFO] Processing row {index+1}:")
+    echo(f"       Image: {image_path}")
+    echo(f"       COT_Process: {cot_process}")
+    echo(f"       Question: {question}")
+    echo(f"       Log file will be saved to: {log_file_path}")
+
+    # Capture all print output for this orchestration run
+    log_buffer = io.StringIO()
+    final_answer, error = None, None
+    with batch_row(batch_session, int(index)) as pending_row, \
+            journal_row(journal, int(index)) as journaled_row, \
+            row_result() as result, \
+            span("row", "row", row=int(index), cot_process=str(cot_process)), \
+            capture_output(log_buffer):
+        if journal is not None:
+            journal.append(int(index), "started", {"image_path": image_path, "question": question})
+        try:
+            # Run the final orchestrator (passing question and image_path)
+            # This call will print various messages as defined in your orchestrator
+            final_answer = final_orchestrator(question, image_path, route=route)
+            print("\nFinal Answer:")
+            print(final_answer)
+            candidates = result.stage_data("candidates")
+            if candidates:
+                save_candidates_to_file(candidates, candidates_path)
+        except Exception as e:
+            error = e
+            print(f"[ERROR] Exception occurred during orchestration: {e}")
+
+    if pending_row is not None and pending_row.pending:
+        echo(f"[Batch] Row {index+1} is waiting for {pending_row.pending} batch response(s).")
+        return None
+    if journaled_row is not None and journaled_row.replayed:
+        echo(f"[Journal] Row {index+1}: replayed {journaled_row.replayed} journaled LLM response(s).")
+
+    # Write the captured output to the log file
+    output = log_buffer.getvalue()
+    with open(log_file_path, "w") as log_file:
+        log_file.write(output)
+
+    if results is not None:
+        results.write(build_record(index, row, final_answer, error, result))
+
+    if journal is not None:
+        if error is None:
+            journal.append(int(index), "done", {"log_file": log_file_path, "final_answer": final_answer})
+        else:
+            journal.append(int(index), "failed", {"log_file": log_file_path, "error": str(error)})
+
+    echo(f"[INFO] Finished processing. Log saved to: {log_file_path}")
+    return log_file_path
+
+
+def plan_dataset(df, use_llm):
+    """
+    Routes every row up front and returns a copy of df with route,
+    route_confidence and route_method columns.
+    """
+    plan = plan_routes([str(question) for question in df["question_mcq"]], use_llm=use_llm)
+    planned = df.copy()
+    planned["route"] = [entry["route"] for entry in plan]
+    planned["route_confidence"] = [entry["confidence"] for entry in plan]
+    planned["route_method"] = [entry["method"] for entry in plan]
+    return planned
+
+
+def summarize_plan(planned):
+    """
+    Row counts per agent route and estimated LLM calls (best/worst case).
+    Unrouted rows are counted with one extra classification call and the
+    cheapest/most expensive route.
+    """
+    summary = {"rows": len(planned), "routes": {}, "estimated_llm_calls": {"min": 0, "max": 0}}
+    for route in LEAF_ROUTES:
+        count = int((planned["route"] == route).sum())
+        if not count:
+            continue
+        calls_min, calls_max = ESTIMATED_LLM_CALLS[route]
+        summary["routes"][route] = {
+            "rows": count,
+            "estimated_llm_calls": {"min": count * calls_min, "max": count * calls_max},
+        }
+        summary["estimated_llm_calls"]["min"] += count * calls_min
+        summary["estimated_llm_calls"]["max"] += count * calls_max
+
+    unrouted = int(planned["route"].isna().sum())
+    if unrouted:
+        cheapest = min(calls for calls, _ in ESTIMATED_LLM_CALLS.values())
+        priciest = max(calls for _, calls in ESTIMATED_LLM_CALLS.values())
+        summary["routes"]["unrouted"] = {
+            "rows": unrouted,
+            "estimated_llm_calls": {"min": unrouted * (cheapest + 1), "max": unrouted * (priciest + 2)},
+        }
+        summary["estimated_llm_calls"]["min"] += unrouted * (cheapest + 1)
+        summary["estimated_llm_calls"]["max"] += unrouted * (priciest + 2)
+        summary["batched_classification_calls_if_preclassified"] = -(-unrouted // CLASSIFIER_BATCH_SIZE)
+    return summary
+
+
+def print_plan(summary):
+    print(f"[PLAN] {summary['rows']} rows")
+    for route, info in summary["routes"].items():
+        calls = info["estimated_llm_calls"]
+        print(f"[PLAN]   {route:<24} {info['rows']:>6} rows   ~{calls['min']}-{calls['max']} LLM calls")
+    total = summary["estimated_llm_calls"]
+    print(f"[PLAN] Estimated LLM calls: {total['min']}-{total['max']}")
+
+
+def group_by_agent(planned):
+    """
+    Orders rows so that rows for the same agent run together (routes in
+    LEAF_ROUTES order, unrouted rows last). The original index is kept.
+    """
+    order = {route: position for position, route in enumerate(LEAF_ROUTES)}
+    rank = planned["route"].map(lambda route: order.get(route, len(order)))
+    return planned.assign(_route_rank=rank).sort_values("_route_rank", kind="stable").drop(columns="_route_rank")
+
+
+def run_serial(df, log_dir, journal=None, results=None):
+    """
+    Processes rows one at a time (original behaviour).
+    """
+    for index, row in tqdm(df.iterrows(), total=len(df), desc="Processing rows",
+                           unit="row", smoothing=0):
+        process_row(index, row, log_dir, journal=journal, results=results)
+
+
+def run_concurrent(df, log_dir, concurrency, journal=None, results=None):
+    """
+    Processes rows with a bounded worker pool. At most `concurrency` rows are in
+    flight at any time; the progress bar reports the aggregate rows/sec.
+    """
+    install_thread_local_streams()
+    rows = df.iterrows()
+    progress = tqdm(total=len(df), desc=f"Processing rows (x{concurrency})",
+                    unit="row", smoothing=0)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+
+        def submit_next():
+            try:
+                index, row = next(rows)
+            except StopIteration:
+                return False
+            future = executor.submit(process_row, index, row, log_dir, tqdm.write,
+                                     journal=journal, results=results)
+            in_flight[future] = index
+            return True
+
+        for _ in range(concurrency):
+            if not submit_next():
+                break
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    tqdm.write(f"[ERROR] Row {index+1} failed: {e}")
+                progress.update(1)
+                submit_next()
+
+    progress.close()
+
+
+def run_batch(df, log_dir, batch_dir, submit="openai", wait=False, poll_interval=60, results=None):
+    """
+    Processes the dataset through the Batch API, one pipeline stage per batch.
+    Each pass replays every unfinished row against the responses received so
+    far; the requests they still need are written as the next stage and
+    submitted. Rerunning with the same batch_dir resumes where it stopped.
+    Returns True when every row is finished.
+    """
+    session = BatchSession(batch_dir)
+    print(f"[Batch] {len(session.completed_rows)}/{len(df)} rows already finished in {batch_dir}")
+
+    while True:
+        if session.outstanding():
+            if submit == "openai":
+                poll_openai_batches(session)
+            if session.outstanding():
+                if not wait or submit == "none":
+                    print(f"[Batch] {len(session.outstanding())} request file(s) awaiting results; rerun with the same --batch_dir to continue.")
+                    return False
+                wait_for_batches(session, submit, poll_interval)
+
+        remaining = [(index, row) for index, row in df.iterrows() if int(index) not in session.completed_rows]
+        if not remaining:
+            print("[Batch] All rows finished.")
+            return True
+
+        for index, row in tqdm(remaining, desc=f"Batch pass {len(session.stage_dirs()) + 1}",
+                               unit="row", smoothing=0):
+            if process_row(index, row, log_dir, echo=lambda *_: None, batch_session=session, results=results) is not None:
+                session.mark_completed(int(index))
+
+        stage_dir = session.write_stage()
+        if stage_dir is None:
+            print("[Batch] All rows finished.")
+            return True
+        if submit == "openai":
+            submit_openai_batches(session)
+        elif submit == "local":
+            complete_batches_locally(session)
+        else:
+            print(f"[Batch] Submit the request files in {stage_dir}, save each output as results_NNN.jsonl next to its requests_NNN.jsonl, then rerun.")
+            return False
 
 
 def main():
@@ -25,13 +286,104 @@ def main():
         required=True,
         help="Directory to save the log text files.",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of rows processed at the same time (default: 1, i.e. serial).",
+    )
+    parser.add_argument(
+        "--router_model",
+        type=str,
+        default=None,
+        help="Trained local router model (see python -m Utils.Router_utils). Only load files you trust: it is a pickle. Default: SURGRAW_ROUTER_MODEL, else rules only.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Optional directory for the persistent LLM response cache (reused across runs).",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Route every row with the local router only, print the plan (rows and estimated LLM calls per agent), write run_plan.json to log_dir and exit without any API call.",
+    )
+    parser.add_argument(
+        "--group_by_agent",
+        action="store_true",
+        help="Route the whole dataset up front (local router + batched GPT classification) and run rows grouped by target agent.",
+    )
+    parser.add_argument(
+        "--batch_dir",
+        type=str,
+        default=None,
+        help="Run through the Batch API instead of synchronous calls, keeping the per-stage request/result files in this directory. Rerun with the same directory to resume.",
+    )
+    parser.add_argument(
+        "--batch_submit",
+        type=str,
+        choices=["openai", "local", "none"],
+        default="openai",
+        help="How batch files are completed: openai (Batch API), local (answered synchronously by a local stand-in, e.g. a mock server) or none (only write the files).",
+    )
+    parser.add_argument(
+        "--batch_wait",
+        action="store_true",
+        help="Keep polling submitted batches and run every stage to the end instead of exiting after a submission.",
+    )
+    parser.add_argument(
+        "--batch_poll_interval",
+        type=float,
+        default=60,
+        help="Seconds between batch status checks with --batch_wait (default: 60).",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="Journal the run to this append-only file so it can be resumed with --resume (default with --resume: <log_dir>/run_journal.jsonl).",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume from the run journal: skip finished rows and replay the journaled LLM responses of interrupted rows. Without it, --journal moves an existing journal aside.",
+    )
+    parser.add_argument(
+        "--retry_failed", "--retry-failed",
+        dest="retry_failed",
+        action="store_true",
+        help="With --resume, also rerun rows that failed (their successful LLM calls are replayed).",
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        default=None,
+        help="Structured per-row results file, .jsonl or .parquet (default: <log_dir>/results.jsonl). Summarize with: python -m Utils.Results_utils <file>.",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write a span per row, stage, agent and LLM call to this JSONL file. Summarize with: python -m Utils.Trace_utils <file>.",
+    )
     args = parser.parse_args()
 
+    if args.concurrency < 1:
+        parser.error("--concurrency must be >= 1")
+
     # Ensure the log directory exists
     if not os.path.exists(args.log_dir):
         os.makedirs(args.log_dir)
         print(f"[INFO] Created log directory: {args.log_dir}")
 
+    if args.cache_dir:
+        enable_response_cache(args.cache_dir)
+    if args.trace:
+        enable_tracing(args.trace)
+    if args.router_model:
+        enable_router_model(args.router_model)
+
     # Load the XLSX file
     try:
         df = pd.read_excel(args.xlsx_file)
@@ -40,47 +392,69 @@ def main():
         print(f"[ERROR] Failed to load XLSX file: {e}")
         sys.exit(1)
 
+    if args.dry_run:
+        planned = plan_dataset(df, use_llm=False)
+        summary = summarize_plan(planned)
+        print_plan(summary)
+        plan_path = os.path.join(args.log_dir, "run_plan.json")
+        with open(plan_path, "w") as f:
+            json.dump({
+                "summary": summary,
+                "rows": [
+                    {"index": int(index), "image_path": str(row["image_path"]), "route": row["route"],
+                     "confidence": row["route_confidence"], "method": row["route_method"]}
+                    for index, row in planned.iterrows()
+                ],
+            }, f, indent=4)
+        print(f"[PLAN] Plan saved to: {plan_path}")
+        return
+
+    if args.group_by_agent:
+        df = group_by_agent(plan_dataset(df, use_llm=True))
+        print_plan(summarize_plan(df))
+        # Only pay for loading the RAG index if knowledge rows exist
+        if any(ROUTE_DEPARTMENT.get(route) == "knowledge-based" for route in df["route"].dropna()):
+            from Agents.RAG_module import get_rag_store
+            get_rag_store()
+
+    # Resumed runs (journal or an existing batch_dir) add to their earlier results
+    resuming = args.resume or bool(args.batch_dir and os.path.isdir(args.batch_dir) and os.listdir(args.batch_dir))
+    results = ResultsSink(args.results or os.path.join(args.log_dir, "results.jsonl"), resume=resuming)
+
     # Iterate over each row in the DataFrame with a progress bar
-    for index, row in tqdm(df.iterrows(), total=len(df), desc="Processing rows"):
-        image_path = row["image_path"]
-        cot_process = row["COT_Process"]
-        question = row["question_mcq"]
-        # ground_truth is available if you want to use it later:
-        ground_truth = row.get("ground_truth", None)
-
-        # Derive image_name from image_path (remove directory and extension)
-        base_name = os.path.basename(image_path)
-        image_name, _ = os.path.splitext(base_name)
-        # Sanitize the COT_Process string (e.g., replace spaces with underscores)
-        COT_FileNamingConvention = str(cot_process).replace(" ", "_")
-        # Create the log file name as specified
-        log_file_name = f"{image_name}_{COT_FileNamingConvention}_SurgCOT.txt"
-        log_file_path = os.path.join(args.log_dir, log_file_name)
-
-        print(f"\n[INFO] Processing row {index+1}:")
-        print(f"       Image: {image_path}")
-        print(f"       COT_Process: {cot_process}")
-        print(f"       Question: {question}")
-        print(f"       Log file will be saved to: {log_file_path}")
-
-        # Capture all print output for this orchestration run
-        log_buffer = io.StringIO()
-        with redirect_stdout(log_buffer), redirect_stderr(log_buffer):
-            try:
-                # Run the final orchestrator (passing question and image_path)
-                # This call will print various messages as defined in your orchestrator
-                final_answer = final_orchestrator(question, image_path)
-                print("\nFinal Answer:")
-                print(final_answer)
-            except Exception as e:
-                print(f"[ERROR] Exception occurred during orchestration: {e}")
-
-        # Write the captured output to the log file
-        output = log_buffer.getvalue()
-        with open(log_file_path, "w") as log_file:
-            log_file.write(output)
-
-        print(f"[INFO] Finished processing. Log saved to: {log_file_path}")
+    if args.batch_dir:
+        # Batch runs resume from their own intermediate files
+        run_batch(df, args.log_dir, args.batch_dir, args.batch_submit, args.batch_wait, args.batch_poll_interval, results)
+    else:
+        journal = None
+        if args.journal or args.resume:
+            journal = RunJournal(args.journal or os.path.join(args.log_dir, "run_journal.jsonl"), resume=args.resume)
+        if args.resume:
+            print(f"[Journal] {journal.summary()}")
+            keep = [not journal.should_skip(int(index), args.retry_failed) for index in df.index]
+            print(f"[Journal] Skipping {keep.count(False)} finished row(s).")
+            df = df[keep]
+        if args.concurrency == 1:
+            run_serial(df, args.log_dir, journal, results)
+        else:
+            run_concurrent(df, args.log_dir, args.concurrency, journal, results)
+        if journal is not None:
+            journal.close()
+    results.close()
+    print(f"[Results] {results.records} record(s) written to {results.path}")
+
+    print(f"[Parsing] {get_extraction_stats()}")
+    print(f"[Budget] {get_budget_stats()}")
+    print(f"[RateLimit] {get_scheduler_stats()}")
+
+    cache = get_response_cache()
+    if cache is not None:
+        print(f"[Cache] {cache.stats()}")
+
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.close()
+        print(f"[Trace] {tracer.spans} span(s) written to {tracer.path}; summarize with: python -m Utils.Trace_utils {tracer.path}")
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
+import os
 import re
 import sys
+import json
 import logging
 from Utils.API_utils import call_gpt35Turbo_api
 from Agents.Agent1_ActionRecognition import Action_Recognition_Agent
@@ -10,7 +12,59 @@ from Agents.Agent5_SurgicalOutcome import Surgical_Outcome_Agent
 from Agents.Agent6_PatientDetail import Patient_Detail_Agent
 from Agents.RAG_module import query_rag
 from Agents.GP_Moderator import multi_agent_debate
+from Utils.Router_utils import route_question_locally, ROUTE_DEPARTMENT, LEAF_ROUTES
+from Utils.Results_utils import mark_stage
+from Utils.Trace_utils import traced
+from Utils.Stream_utils import stream_events
 
+# "local": try the rule/model router first and only call the GPT classifiers
+#          when it is not confident; "llm": always use the GPT classifiers
+ROUTER_MODE = os.environ.get("SURGRAW_ROUTER", "local")
+# How the GPT classifiers route: "single" classifies straight to the leaf route
+# in one JSON call; "hierarchical" uses the original two dependent calls
+LLM_ROUTER_MODE = os.environ.get("SURGRAW_LLM_ROUTER", "single")
+CLASSIFIER_BATCH_SIZE = 25
+
+
+def _parse_token_budgets(value):
+    """
+    Parses "N" (every agent) or "Agent_Name=N,*=N" into {agent name or "*": N}.
+    """
+    budgets = {}
+    for item in value.split(","):
+        agent, _, budget = item.strip().rpartition("=")
+        if budget:
+            budgets[agent.strip() or "*"] = int(budget)
+    return budgets
+
+
+# Token budget of the retrieved knowledge pasted into each knowledge agent's
+# prompt (most relevant sources are kept first); 0 disables the budget
+RAG_CONTEXT_TOKENS = _parse_token_budgets(os.environ.get("SURGRAW_RAG_CONTEXT_TOKENS", "1500"))
+
+# Estimated LLM calls per row for each route: (best case, worst case).
+# Action recognition runs the multi-agent debate (2 vision calls + 1 combined
+# rubric call per round, up to 3 refinements and a selection call; answers are
+# parsed locally);
+# knowledge routes add at most one RAG answer call.
+ESTIMATED_LLM_CALLS = {
+    "instrument recognition": (1, 1),
+    "action recognition": (3, 13),
+    "action prediction": (1, 2),
+    "outcome": (1, 2),
+    "patient detail": (1, 2),
+}
+
+LEAF_CLASSIFIER_INSTRUCTIONS = """
+    You are an expert surgical question classifier. Classify each question into exactly one of the following categories:
+    "instrument recognition" - vision-based: identifying the surgical tool(s) visible in the image.
+    "action recognition"     - vision-based: understanding what surgical action is being performed in the image (e.g. the ongoing action of an instrument).
+    "action prediction"      - knowledge-based: what the surgeon plans to do next.
+    "outcome"                - knowledge-based: the expected surgical result or the significance of a step.
+    "patient detail"         - knowledge-based: patient characteristics or demographics.
+"""
+
+@traced("stage")
 def classify_overall_question(question):
     """
     Classify the question as 'vision-based' or 'knowledge-based' using GPT-3.5
@@ -27,6 +81,7 @@ def classify_overall_question(question):
     result = call_gpt35Turbo_api(prompt).strip().lower()
     return result
 
+@traced("stage")
 def classify_vision_question(question):
     """
     If vision-based, classify as:
@@ -44,6 +99,7 @@ def classify_vision_question(question):
     result = call_gpt35Turbo_api(prompt).strip().lower()
     return result
 
+@traced("stage")
 def classify_knowledge_question(question):
     """
     If knowledge-based, classify as:
@@ -62,9 +118,95 @@ def classify_knowledge_question(question):
     result = call_gpt35Turbo_api(prompt).strip().lower()
     return result
 
-def final_orchestrator(question, image_path):
+def _parse_leaf_category(value):
+    """
+    Returns value as a leaf route if it is one of LEAF_ROUTES, else None.
+    """
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    return value if value in LEAF_ROUTES else None
+
+@traced("stage")
+def classify_leaf_question(question):
+    """
+    Classify the question straight into one of LEAF_ROUTES with a single
+    JSON-constrained GPT-3.5 call. Returns None if the reply is not a valid category.
+    """
+    prompt = f"""{LEAF_CLASSIFIER_INSTRUCTIONS}
+    Question: "{question}"
+
+    Return a JSON object of the form {{"category": "<one of the categories above, all lower case>"}}.
+    """
+    response = call_gpt35Turbo_api(prompt, temperature=0, response_format={"type": "json_object"})
+    try:
+        return _parse_leaf_category(json.loads(response).get("category"))
+    except (TypeError, ValueError, AttributeError):
+        # Also covers an empty (None) reply
+        return None
+
+@traced("stage")
+def classify_questions_batch(questions, batch_size=CLASSIFIER_BATCH_SIZE):
+    """
+    Classify many questions into LEAF_ROUTES, `batch_size` questions per GPT-3.5
+    call, so the classifier instructions are paid once per batch.
+    Returns a list aligned with `questions`; entries are None where the reply
+    was missing or invalid.
+    """
+    routes = []
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start:start + batch_size]
+        numbered = "\n\n".join(f'{i}. "{question}"' for i, question in enumerate(batch, 1))
+        prompt = f"""{LEAF_CLASSIFIER_INSTRUCTIONS}
+    Questions:
+    {numbered}
+
+    Return a JSON object that maps every question number (as a string) to its category, e.g. {{"1": "outcome", "2": "action recognition"}}.
+    """
+        response = call_gpt35Turbo_api(prompt, temperature=0, response_format={"type": "json_object"})
+        try:
+            answers = json.loads(response)
+        except (TypeError, ValueError):
+            answers = {}
+        if not isinstance(answers, dict):
+            answers = {}
+        routes.extend(_parse_leaf_category(answers.get(str(i))) for i in range(1, len(batch) + 1))
+    return routes
+
+def plan_routes(questions, use_llm=True):
+    """
+    Routes a whole dataset up front. Every question is first routed locally;
+    if use_llm is set, the remaining ones are classified with batched GPT calls.
+    Returns one {"route", "confidence", "method"} dict per question; "route" is
+    None for questions that are still unrouted.
+    """
+    plan = []
+    unresolved = []
+    for index, question in enumerate(questions):
+        if ROUTER_MODE == "local":
+            route, confidence, method = route_question_locally(question)
+        else:
+            route, confidence, method = None, 0.0, "none"
+        plan.append({"route": route, "confidence": confidence, "method": method})
+        if route is None:
+            unresolved.append(index)
+
+    if use_llm and unresolved:
+        routes = classify_questions_batch([questions[index] for index in unresolved])
+        for index, route in zip(unresolved, routes):
+            if route is not None:
+                plan[index] = {"route": route, "confidence": None, "method": "llm-batch"}
+    return plan
+
+@traced("stage")
+def final_orchestrator(question, image_path, route=None, on_event=None):
     """
     Collect each step in a list of conversation steps.
+    `route` may carry a leaf route decided beforehand (see plan_routes), in which
+    case no classification is done here.
+    With `on_event`, the agents' answers are streamed to on_event(event) while they
+    are generated (token/answer/done events, plus the debate's early "consensus";
+    see Utils/Stream_utils.py), so a UI can render the chains progressively.
     Returns:
       {
         "steps": List[ (role: str, text: str), ... ],
@@ -77,7 +219,30 @@ def final_orchestrator(question, image_path):
     steps.append(("dept_coordinator",
                   f"Department Coordinator: Received question: '{question}'."))
 
-    overall_class = classify_overall_question(question)
+    leaf_route = route if route in LEAF_ROUTES else None
+    if leaf_route is not None:
+        steps.append(("dept_coordinator", f"Pre-classified route: question → **{leaf_route}**."))
+    elif ROUTER_MODE == "local":
+        leaf_route, confidence, method = route_question_locally(question)
+        if leaf_route is not None:
+            steps.append(("dept_coordinator",
+                          f"Local router ({method}, confidence {confidence:.2f}): question → **{leaf_route}**."))
+        else:
+            steps.append(("dept_coordinator",
+                          f"Local router not confident ({confidence:.2f}); using GPT classifiers."))
+
+    if leaf_route is None and LLM_ROUTER_MODE == "single":
+        leaf_route = classify_leaf_question(question)
+        if leaf_route is not None:
+            steps.append(("dept_coordinator", f"Single-call classifier: question → **{leaf_route}**."))
+        else:
+            steps.append(("dept_coordinator",
+                          "[WARNING] Single-call classifier returned no valid category; using hierarchical classifiers."))
+
+    if leaf_route is not None:
+        overall_class = ROUTE_DEPARTMENT[leaf_route]
+    else:
+        overall_class = classify_overall_question(question)
     steps.append(("dept_coordinator",
                   f"Classified task as: **{overall_class}**."))
 
@@ -92,7 +257,7 @@ def final_orchestrator(question, image_path):
     # 2) Department Heads
     if overall_class == "vision-based":
         # Vision Dept Head
-        vision_class = classify_vision_question(question)
+        vision_class = leaf_route or classify_vision_question(question)
         steps.append(("vision_dept_head", f"Vision Dept Head: question → **{vision_class}**."))
 
         if vision_class == "instrument recognition":
@@ -107,7 +272,7 @@ def final_orchestrator(question, image_path):
 
     else:
         # Knowledge Dept Head
-        knowledge_class = classify_knowledge_question(question)
+        knowledge_class = leaf_route or classify_knowledge_question(question)
         steps.append(("knowledge_dept_head", f"Knowledge Dept Head: question → **{knowledge_class}**."))
 
         if knowledge_class == "action prediction":
@@ -123,19 +288,30 @@ def final_orchestrator(question, image_path):
             # steps.append(("knowledge_dept_head", f"[ERROR] Unrecognized: {knowledge_class}, fallback to SurgicalPlan_Agent."))
             agent_function = Action_Prediction_Agent
 
+    mark_stage("route", {
+        "department": overall_class,
+        "route": vision_class if overall_class == "vision-based" else knowledge_class,
+        "agent": agent_function.__name__,
+    })
+
+    if overall_class == "knowledge-based":
         # Query RAG
         steps.append(("knowledge_dept_head", "[INFO] Querying RAG for external knowledge..."))
-        retrieved_content = query_rag(question)
+        rag_budget = RAG_CONTEXT_TOKENS.get(agent_function.__name__, RAG_CONTEXT_TOKENS.get("*"))
+        retrieved_content = query_rag(question, max_tokens=rag_budget)
         snippet = retrieved_content[:300] + "..." if retrieved_content else "No data."
         steps.append(("knowledge_dept_head", f"RAG snippet:\n{snippet}"))
+        mark_stage("rag")
 
     # 3) Execute Agent
     steps.append(("agent", f"Executing **{agent_function.__name__}**..."))
 
-    if overall_class == "knowledge-based":
-        final_answer = agent_function(question, image_path, retrieved_content)
+    agent_args = (question, image_path, retrieved_content) if overall_class == "knowledge-based" else (question, image_path)
+    if on_event is not None:
+        with stream_events(on_event):
+            final_answer = agent_function(*agent_args)
     else:
-        final_answer = agent_function(question, image_path)
+        final_answer = agent_function(*agent_args)
 
     # 4) Add the agent's final answer as a step
     if isinstance(final_answer, dict):
@@ -0,0 +1,35 @@
+import argparse
+from Agents.RAG_module import build_rag_index, RAG_INDEX_DIR, URL_LIST
+
+
+def main():
+    # Setup command-line arguments
+    parser = argparse.ArgumentParser(
+        description="Fetch, split and embed the RAG knowledge sources once and save the FAISS index."
+    )
+    parser.add_argument(
+        "--index_dir",
+        type=str,
+        default=RAG_INDEX_DIR,
+        help=f"Directory to save the index to (default: {RAG_INDEX_DIR}, or SURGRAW_RAG_INDEX_DIR).",
+    )
+    parser.add_argument(
+        "--urls",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Source URLs to ingest (default: URL_LIST in Agents/RAG_module.py).",
+    )
+    parser.add_argument(
+        "--embedding_backend",
+        type=str,
+        default=None,
+        help="Embedding backend: openai, hashing, sentence-transformers or local (default: SURGRAW_EMBEDDING_BACKEND or openai).",
+    )
+    args = parser.parse_args()
+
+    build_rag_index(args.index_dir, args.urls or URL_LIST, backend=args.embedding_backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,58 +3,795 @@ import os
 import base64
 import argparse
 import json
+import time
+import random
+import asyncio
+import threading
+import mimetypes
+import queue
+import contextvars
+from types import SimpleNamespace
+from collections import OrderedDict, defaultdict, deque
+from email.utils import parsedate_to_datetime
 import pandas as pd
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
 import google.generativeai as genai
 import re
 from tqdm import tqdm
 import logging
+from Utils.Cache_utils import get_response_cache
+from Utils.Batch_utils import get_active_batch_row
+from Utils.Journal_utils import get_active_journal_row
+from Utils.Results_utils import record_usage
+from Utils.Trace_utils import span, set_span_attributes, get_tracer
+from Utils.Token_utils import estimate_request_tokens
+from Utils.Prompt_utils import Prompt
+from Utils.Stream_utils import streaming_enabled, stream_handlers
 
 # Suppress gRPC and absl-py warnings
 os.environ["GRPC_VERBOSITY"] = "ERROR"
 os.environ["GLOG_minloglevel"] = "2"
 
-def encode_image(image_path: str) -> str:
+# ============================================================
+# Configuration (read once at import time)
+# ============================================================
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
+
+# Default per-call timeout (seconds) and retry count of the OpenAI SDK.
+# Retries are handled by the rate-limit scheduler below, so the SDK's own
+# (unscheduled) retries are off by default.
+OPENAI_TIMEOUT = float(os.environ.get("SURGRAW_OPENAI_TIMEOUT", "120"))
+OPENAI_MAX_RETRIES = int(os.environ.get("SURGRAW_OPENAI_MAX_RETRIES", "0"))
+
+# Keep-alive connection pool limits shared by every call in the process
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("SURGRAW_OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("SURGRAW_OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("SURGRAW_OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Upper bound (bytes of base64 text) kept by the in-memory image encoding cache
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("SURGRAW_IMAGE_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+
+
+def _parse_model_limits(value):
+    """
+    Parses "model=limit,model=limit" (use "*" for every other model) into a dict.
+    """
+    limits = {}
+    for item in value.split(","):
+        model, _, limit = item.strip().rpartition("=")
+        if model and limit:
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+# Per-model requests-per-minute and tokens-per-minute budgets; unset = unlimited
+RPM_LIMITS = _parse_model_limits(os.environ.get("SURGRAW_RPM_LIMITS", ""))
+TPM_LIMITS = _parse_model_limits(os.environ.get("SURGRAW_TPM_LIMITS", ""))
+# Retries of rate-limited / transient failures, with jittered exponential backoff
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("SURGRAW_RATE_LIMIT_RETRIES", "6"))
+BACKOFF_BASE_SECONDS = float(os.environ.get("SURGRAW_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.environ.get("SURGRAW_BACKOFF_MAX", "60"))
+
+# ============================================================
+# Shared OpenAI clients
+# ============================================================
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Returns the process-wide OpenAI client. The underlying httpx connection pool
+    is reused across calls, so TLS handshakes are only paid once per connection.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=OPENAI_BASE_URL,
+                    timeout=OPENAI_TIMEOUT,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=httpx.Client(limits=_pool_limits(), timeout=OPENAI_TIMEOUT),
+                )
+    return _client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Async twin of get_openai_client(), sharing the same configuration and pool limits.
+    """
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncOpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=OPENAI_BASE_URL,
+                    timeout=OPENAI_TIMEOUT,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=httpx.AsyncClient(limits=_pool_limits(), timeout=OPENAI_TIMEOUT),
+                )
+    return _async_client
+
+
+# ============================================================
+# Rate-limit-aware scheduler
+# ============================================================
+# Every OpenAI call reserves its requests/tokens in a sliding one-minute window
+# of its model before it is sent, and waits (queued) while the budget is spent.
+# A 429 puts the whole model on cooldown for its Retry-After, so concurrent rows
+# back off together instead of each hammering the API.
+_RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RateLimitScheduler:
+    """
+    Process-wide RPM/TPM budget per model, with queue depth and wait-time metrics.
+    """
+
+    def __init__(self, rpm_limits=None, tpm_limits=None, window_seconds=60.0):
+        self.rpm_limits = rpm_limits or {}
+        self.tpm_limits = tpm_limits or {}
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._usage = defaultdict(deque)  # model -> deque of [timestamp, tokens]
+        self._cooldown_until = {}
+        self._stats = defaultdict(lambda: {
+            "requests": 0, "queued": 0, "max_queue_depth": 0, "waited": 0,
+            "total_wait_s": 0.0, "max_wait_s": 0.0, "retries": 0, "rate_limited": 0,
+        })
+
+    def _limit(self, limits, model):
+        return limits.get(model, limits.get("*"))
+
+    def try_acquire(self, model, tokens):
+        """
+        Reserves one request and `tokens` tokens for `model` if the budget allows.
+        Returns (reservation, 0.0) on success, or (None, seconds to wait).
+        """
+        now = time.monotonic()
+        with self._lock:
+            usage = self._usage[model]
+            while usage and usage[0][0] <= now - self.window_seconds:
+                usage.popleft()
+
+            wait = max(0.0, self._cooldown_until.get(model, 0.0) - now)
+            rpm = self._limit(self.rpm_limits, model)
+            if rpm and len(usage) >= rpm:
+                wait = max(wait, usage[len(usage) - rpm][0] + self.window_seconds - now)
+            tpm = self._limit(self.tpm_limits, model)
+            if tpm and usage:
+                excess = sum(used for _, used in usage) + tokens - tpm
+                freed = 0
+                for timestamp, used in usage:
+                    if excess <= 0:
+                        break
+                    freed += used
+                    if freed >= excess:
+                        wait = max(wait, timestamp + self.window_seconds - now)
+                        break
+                else:
+                    if excess > 0:
+                        # Larger than the whole budget: wait for the window to drain
+                        wait = max(wait, usage[-1][0] + self.window_seconds - now)
+
+            if wait > 0:
+                return None, wait
+            reservation = [now, tokens]
+            usage.append(reservation)
+            self._stats[model]["requests"] += 1
+            return reservation, 0.0
+
+    def _enter_queue(self, model):
+        with self._lock:
+            stats = self._stats[model]
+            stats["queued"] += 1
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], stats["queued"])
+
+    def _leave_queue(self, model, waited):
+        with self._lock:
+            stats = self._stats[model]
+            stats["queued"] -= 1
+            if waited > 0.001:
+                stats["waited"] += 1
+                stats["total_wait_s"] += waited
+                stats["max_wait_s"] = max(stats["max_wait_s"], waited)
+
+    def acquire(self, model, tokens):
+        """
+        Blocks until the request fits in the model's budget and returns its reservation.
+        """
+        start = time.monotonic()
+        self._enter_queue(model)
+        try:
+            while True:
+                reservation, wait = self.try_acquire(model, tokens)
+                if reservation is not None:
+                    return reservation
+                time.sleep(wait + random.uniform(0, 0.05))
+        finally:
+            self._leave_queue(model, time.monotonic() - start)
+
+    async def acquire_async(self, model, tokens):
+        start = time.monotonic()
+        self._enter_queue(model)
+        try:
+            while True:
+                reservation, wait = self.try_acquire(model, tokens)
+                if reservation is not None:
+                    return reservation
+                await asyncio.sleep(wait + random.uniform(0, 0.05))
+        finally:
+            self._leave_queue(model, time.monotonic() - start)
+
+    def settle(self, reservation, response):
+        """
+        Replaces the estimated token count with the usage reported by the API.
+        """
+        usage = getattr(response, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        if total_tokens is not None:
+            with self._lock:
+                reservation[1] = total_tokens
+
+    def record_retry(self, model, retry_after=None, rate_limited=False):
+        with self._lock:
+            stats = self._stats[model]
+            stats["retries"] += 1
+            if rate_limited:
+                stats["rate_limited"] += 1
+                if retry_after:
+                    until = time.monotonic() + retry_after
+                    self._cooldown_until[model] = max(self._cooldown_until.get(model, 0.0), until)
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for model, stats in self._stats.items():
+                result[model] = dict(stats)
+                result[model]["total_wait_s"] = round(stats["total_wait_s"], 3)
+                result[model]["max_wait_s"] = round(stats["max_wait_s"], 3)
+                result[model]["mean_wait_s"] = round(stats["total_wait_s"] / stats["requests"], 3) if stats["requests"] else 0.0
+            return result
+
+
+_scheduler = RateLimitScheduler(RPM_LIMITS, TPM_LIMITS)
+
+
+def get_rate_limit_scheduler() -> RateLimitScheduler:
+    return _scheduler
+
+
+def get_scheduler_stats() -> dict:
+    return _scheduler.stats()
+
+
+def _retry_after_seconds(error):
+    """
+    Reads the server's retry hint (retry-after-ms / retry-after) from an API error.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _retry_delay(model, error, attempt):
+    """
+    Returns the delay before retrying `error`, or None if it should not be retried.
+    Uses full-jitter exponential backoff, never shorter than the server's Retry-After.
+    """
+    if attempt >= RATE_LIMIT_MAX_RETRIES:
+        return None
+    status_code = getattr(error, "status_code", None)
+    if isinstance(error, APIStatusError) and status_code not in _RETRYABLE_STATUS_CODES:
+        return None
+    if not isinstance(error, (APIStatusError, APIConnectionError)):
+        return None
+
+    retry_after = _retry_after_seconds(error)
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    _scheduler.record_retry(model, retry_after=delay, rate_limited=status_code == 429)
+    print(f"[RateLimit] {model}: {type(error).__name__} ({status_code}); retrying in {delay:.1f}s "
+          f"(attempt {attempt + 1}/{RATE_LIMIT_MAX_RETRIES})")
+    return delay
+
+
+def _cached_prompt_tokens(usage):
+    """
+    Prompt tokens the provider served from its prefix cache (0 if not reported).
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def _create_chat_completion(model, messages, timeout, params):
+    """
+    Sends a chat completion through the scheduler, retrying rate-limited and
+    transient failures.
+    """
+    tokens = estimate_request_tokens(model, messages, params)
+    attempt = 0
+    while True:
+        reservation = _scheduler.acquire(model, tokens)
+        try:
+            response = get_openai_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout if timeout is not None else OPENAI_TIMEOUT,
+                **params,
+            )
+        except Exception as e:
+            delay = _retry_delay(model, e, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        _scheduler.settle(reservation, response)
+        record_usage(response)
+        usage = getattr(response, "usage", None)
+        set_span_attributes(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            cached_tokens=_cached_prompt_tokens(usage),
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            retries=attempt,
+        )
+        return response
+
+
+async def _async_create_chat_completion(model, messages, timeout, params):
+    """
+    Async version of _create_chat_completion().
+    """
+    tokens = estimate_request_tokens(model, messages, params)
+    attempt = 0
+    while True:
+        reservation = await _scheduler.acquire_async(model, tokens)
+        try:
+            response = await get_async_openai_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout if timeout is not None else OPENAI_TIMEOUT,
+                **params,
+            )
+        except Exception as e:
+            delay = _retry_delay(model, e, attempt)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        _scheduler.settle(reservation, response)
+        record_usage(response)
+        usage = getattr(response, "usage", None)
+        set_span_attributes(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            cached_tokens=_cached_prompt_tokens(usage),
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            retries=attempt,
+        )
+        return response
+
+
+def _create_chat_completion_stream(model, messages, timeout, params, on_delta):
+    """
+    Streaming version of _create_chat_completion(): passes every text delta to
+    `on_delta` as it arrives and returns the full text. Failures are retried
+    only until the first delta has been delivered, so no text is repeated.
+    """
+    tokens = estimate_request_tokens(model, messages, params)
+    attempt = 0
+    while True:
+        reservation = _scheduler.acquire(model, tokens)
+        parts = []
+        final = SimpleNamespace(usage=None)
+        try:
+            stream = get_openai_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout if timeout is not None else OPENAI_TIMEOUT,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params,
+            )
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    final = chunk
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+        except Exception as e:
+            delay = _retry_delay(model, e, attempt) if not parts else None
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        _scheduler.settle(reservation, final)
+        record_usage(final)
+        usage = final.usage
+        set_span_attributes(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            cached_tokens=_cached_prompt_tokens(usage),
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            retries=attempt,
+            streamed=True,
+        )
+        return "".join(parts)
+
+
+def _request_bytes(messages):
+    """
+    Approximate request payload size: text and (base64) image URL characters.
+    """
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                total += len(part.get("text", "")) + len(part.get("image_url", {}).get("url", ""))
+        else:
+            total += len(content or "")
+    return total
+
+
+def _llm_span_attributes(model, messages, params):
+    if get_tracer() is None:
+        return {}
+    return {"model": model, "n": params.get("n", 1), "bytes_uploaded": _request_bytes(messages)}
+
+
+def _resolve(model, messages, params, send):
+    """
+    Returns the completion texts of a request: from the batch results in batch
+    mode, from the run journal if this call was journaled before, otherwise from
+    `send()` (cache or API), journaling the result.
+    """
+    batch_row = get_active_batch_row()
+    if batch_row is not None:
+        set_span_attributes(cache="batch")
+        return batch_row.resolve(model, messages, params)
+    journal_row = get_active_journal_row()
+    if journal_row is None:
+        return send()
+    response_id, texts = journal_row.replay(model, messages, params)
+    if texts is not None:
+        set_span_attributes(cache="journal")
+    else:
+        texts = send()
+        if all(text is not None for text in texts):
+            journal_row.record_response(response_id, texts)
+    return texts
+
+
+def _cached_chat_completion(model, messages, timeout, use_cache, params):
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = cache.make_key(model, messages, params)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            set_span_attributes(cache="hit")
+            return cached
+    set_span_attributes(cache="miss" if cache is not None else "off")
+
+    response = _create_chat_completion(model, messages, timeout, params)
+    text_response = response.choices[0].message.content
+
+    if cache is not None and text_response is not None:
+        cache.put(cache_key, text_response, model=model)
+    return text_response
+
+
+def chat_completion(model, messages, timeout=None, use_cache=True, **params):
+    """
+    Sends a chat completion request through the shared client and returns the text.
+    Extra keyword arguments (temperature, ...) are passed to the API and are part of
+    the response cache key. Set use_cache=False for calls that must re-sample.
+    In batch mode the response comes from the batch results (see Utils.Batch_utils),
+    and inside a journaled row it may be replayed from the run journal.
+    """
+    with span(f"llm {model}", "llm", **_llm_span_attributes(model, messages, params)):
+        return _resolve(model, messages, params,
+                        lambda: [_cached_chat_completion(model, messages, timeout, use_cache, params)])[0]
+
+
+def _cached_chat_completion_stream(model, messages, timeout, use_cache, params, on_delta):
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = cache.make_key(model, messages, params)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            set_span_attributes(cache="hit")
+            on_delta(cached)
+            return cached
+    set_span_attributes(cache="miss" if cache is not None else "off")
+
+    text_response = _create_chat_completion_stream(model, messages, timeout, params, on_delta)
+
+    if cache is not None and text_response:
+        cache.put(cache_key, text_response, model=model)
+    return text_response
+
+
+def chat_completion_stream(model, messages, on_delta, timeout=None, use_cache=True, **params):
+    """
+    Streaming twin of chat_completion(): calls on_delta(text) for every piece of
+    the completion as it arrives and returns the full text. Streamed and regular
+    calls share cache and journal entries; answers that come from the batch
+    results, the run journal or the cache are delivered as a single piece.
+    """
+    streamed = []
+
+    def send():
+        streamed.append(True)
+        return [_cached_chat_completion_stream(model, messages, timeout, use_cache, params, on_delta)]
+
+    with span(f"llm {model}", "llm", **_llm_span_attributes(model, messages, params)):
+        text_response = _resolve(model, messages, params, send)[0]
+    if not streamed and text_response:
+        on_delta(text_response)
+    return text_response
+
+
+def _cached_chat_completion_samples(model, messages, timeout, use_cache, params):
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = cache.make_key(model, messages, params)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            set_span_attributes(cache="hit")
+            return cached
+    set_span_attributes(cache="miss" if cache is not None else "off")
+
+    response = _create_chat_completion(model, messages, timeout, params)
+    samples = [choice.message.content for choice in sorted(response.choices, key=lambda choice: choice.index)]
+
+    if cache is not None and all(sample is not None for sample in samples):
+        cache.put(cache_key, samples, model=model)
+    return samples
+
+
+def chat_completion_samples(model, messages, n, timeout=None, use_cache=True, **params):
+    """
+    Requests `n` sampled completions in a single call (the API's `n` parameter), so
+    the prompt and any image are uploaded once. Returns a list of n texts.
+    """
+    params = {**params, "n": n}
+    with span(f"llm {model}", "llm", **_llm_span_attributes(model, messages, params)):
+        return _resolve(model, messages, params,
+                        lambda: _cached_chat_completion_samples(model, messages, timeout, use_cache, params))
+
+
+async def async_chat_completion(model, messages, timeout=None, use_cache=True, **params):
+    """
+    Async version of chat_completion() using the shared AsyncOpenAI client.
+    """
+    with span(f"llm {model}", "llm", **_llm_span_attributes(model, messages, params)):
+        batch_row = get_active_batch_row()
+        if batch_row is not None:
+            set_span_attributes(cache="batch")
+            return batch_row.resolve(model, messages, params)[0]
+        journal_row = get_active_journal_row()
+        if journal_row is not None:
+            response_id, texts = journal_row.replay(model, messages, params)
+            if texts is not None:
+                set_span_attributes(cache="journal")
+                return texts[0]
+
+        cache = get_response_cache() if use_cache else None
+        text_response = cache.get(cache.make_key(model, messages, params)) if cache is not None else None
+        set_span_attributes(cache="hit" if text_response is not None else "miss" if cache is not None else "off")
+        if text_response is None:
+            response = await _async_create_chat_completion(model, messages, timeout, params)
+            text_response = response.choices[0].message.content
+            if cache is not None and text_response is not None:
+                cache.put(cache.make_key(model, messages, params), text_response, model=model)
+
+        if journal_row is not None and text_response is not None:
+            journal_row.record_response(response_id, [text_response])
+        return text_response
+
+
+# ============================================================
+# Image encoding (memoized per process)
+# ============================================================
+# A single debate sends the same frame several times, so the base64 payload is
+# built once per (path, mtime, size) and kept in a bounded LRU cache.
+_image_cache = OrderedDict()
+_image_cache_bytes = 0
+_image_cache_lock = threading.Lock()
+
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def _detect_mime_type(image_path, header: bytes) -> str:
+    """
+    Detects the image MIME type from its magic bytes, falling back to the file extension.
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    guessed, _ = mimetypes.guess_type(image_path)
+    return guessed or "image/jpeg"
+
+
+def _load_image(image_path):
+    """
+    Returns (mime_type, base64_image) for image_path, reading the file only when
+    it is not cached or has changed on disk.
+    """
+    global _image_cache_bytes
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+    with _image_cache_lock:
+        entry = _image_cache.get(key)
+        if entry is not None:
+            _image_cache.move_to_end(key)
+            return entry
+
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+        raw = image_file.read()
+    entry = (_detect_mime_type(image_path, raw[:16]), base64.b64encode(raw).decode("utf-8"))
+
+    with _image_cache_lock:
+        if key not in _image_cache:
+            _image_cache[key] = entry
+            _image_cache_bytes += len(entry[1])
+        while _image_cache_bytes > IMAGE_CACHE_MAX_BYTES and len(_image_cache) > 1:
+            _, (_, evicted) = _image_cache.popitem(last=False)
+            _image_cache_bytes -= len(evicted)
+    return entry
+
+
+def encode_image(image_path: str) -> str:
+    return _load_image(image_path)[1]
+
+
+def get_image_mime_type(image_path: str) -> str:
+    return _load_image(image_path)[0]
+
+
+def encode_image_data_url(image_path: str) -> str:
+    """
+    Returns the image as a data URL with its detected MIME type.
+    """
+    mime_type, base64_image = _load_image(image_path)
+    return f"data:{mime_type};base64,{base64_image}"
 
 # ============================================================
 # GPT-4 Vision for Image Captioning
 # ============================================================
-def gpt4_vision_caption(image_path, prompt):
-    OPENAI_API_KEY = ''
-    client = OpenAI(api_key=OPENAI_API_KEY)
+def _vision_messages(image_path, prompt):
     messages = []
-    base64_image = encode_image(image_path)
-    user_content = [
-        {
-            "type": "text",
-            "text": prompt,
-        },  
-        {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}"
+    image_url = encode_image_data_url(image_path)
+    image_part = {
+        "type": "image_url",
+        "image_url": {
+            "url": image_url
+        },
+    }
+    if isinstance(prompt, Prompt) and prompt.prefix:
+        # Static instructions, then the image, then the per-row text: reruns on
+        # the same frame share prefix + image, which the provider can cache
+        user_content = [
+            {"type": "text", "text": prompt.prefix},
+            image_part,
+            {"type": "text", "text": prompt.suffix},
+        ]
+    else:
+        user_content = [
+            {
+                "type": "text",
+                "text": prompt,
             },
-        }
-    ]
+            image_part,
+        ]
     messages.append({"role": "user", "content": user_content})
+    return messages
 
-    response = client.chat.completions.create(
-        model="gpt-4o-latest",
-        messages=messages
-    )
+def gpt4_vision_caption(image_path, prompt, timeout=None, use_cache=True):
+    if streaming_enabled():
+        # Inside stream_events() (or with SURGRAW_STREAM=1) the answer is streamed
+        return gpt4_vision_caption_stream(image_path, prompt, timeout=timeout, use_cache=use_cache)
+
+    messages = _vision_messages(image_path, prompt)
 
-    image_caption = response.choices[0].message.content
+    image_caption = chat_completion("gpt-4o-latest", messages, timeout=timeout, use_cache=use_cache)
 
     return image_caption
 
+def gpt4_vision_caption_stream(image_path, prompt, on_token=None, on_answer=None, timeout=None, use_cache=True):
+    """
+    Streams the answer for one image + prompt and returns the full text.
+    on_token(delta) gets every piece as it arrives; on_answer(option, text_so_far)
+    fires once the line stating the final answer is complete (or at the end of
+    the stream). Events also go to the
+    active stream_events() listener (see Utils.Stream_utils).
+    """
+    messages = _vision_messages(image_path, prompt)
+    on_delta, finish = stream_handlers(getattr(prompt, "name", None) or "vision", on_token, on_answer)
+    image_caption = chat_completion_stream("gpt-4o-latest", messages, on_delta, timeout=timeout, use_cache=use_cache)
+    finish(image_caption)
+    return image_caption
+
+def gpt4_vision_stream(image_path, prompt, on_answer=None, timeout=None, use_cache=True):
+    """
+    Generator over the streamed answer pieces of gpt4_vision_caption_stream().
+    The request runs on a worker thread (with the caller's context); its errors
+    are re-raised here.
+    """
+    pieces = queue.Queue()
+    done = object()
+    outcome = {}
+
+    def produce():
+        try:
+            gpt4_vision_caption_stream(image_path, prompt, on_token=pieces.put, on_answer=on_answer,
+                                       timeout=timeout, use_cache=use_cache)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            pieces.put(done)
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    worker.start()
+    while True:
+        piece = pieces.get()
+        if piece is done:
+            break
+        yield piece
+    worker.join()
+    if "error" in outcome:
+        raise outcome["error"]
+
+def gpt4_vision_samples(image_path, prompt, n, timeout=None, use_cache=True, **params):
+    """
+    Returns `n` sampled answers for one image + prompt from a single request.
+    """
+    messages = _vision_messages(image_path, prompt)
+    return chat_completion_samples("gpt-4o-latest", messages, n, timeout=timeout, use_cache=use_cache, **params)
+
 # ============================================================
 # GPT-4 API for TEXT Input
 # ============================================================
-def call_gpt4o_api(prompt):
-    OPENAI_API_KEY = ''
-    client = OpenAI(api_key=OPENAI_API_KEY)
+def call_gpt4o_api(prompt, timeout=None, use_cache=True, **params):
     messages = []
     # Add text-only prompt
     user_content = {
@@ -63,20 +800,13 @@ def call_gpt4o_api(prompt):
     }
     messages.append(user_content)
     # Send request to GPT-4 API
-    response = client.chat.completions.create(
-        model="gpt-4o-latest",
-        messages=messages
-    )
-    # Extract the text response
-    text_response = response.choices[0].message.content
+    text_response = chat_completion("gpt-4o-latest", messages, timeout=timeout, use_cache=use_cache, **params)
     return text_response
 
 # ============================================================
 # GPT-3.5 Turbo API for TEXT Input 
 # ============================================================
-def call_gpt35Turbo_api(prompt):
-    OPENAI_API_KEY = ''
-    client = OpenAI(api_key=OPENAI_API_KEY)
+def call_gpt35Turbo_api(prompt, timeout=None, use_cache=True, **params):
     messages = []
     # Add text-only prompt
     user_content = {
@@ -85,20 +815,13 @@ def call_gpt35Turbo_api(prompt):
     }
     messages.append(user_content)
     # Send request to GPT-4 API
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages
-    )
-    # Extract the text response
-    text_response = response.choices[0].message.content
+    text_response = chat_completion("gpt-3.5-turbo", messages, timeout=timeout, use_cache=use_cache, **params)
     return text_response
 
 # ============================================================
 # GPT-4o mini API for TEXT Input
 # ============================================================
-def call_gpt4omini_api(prompt):
-    OPENAI_API_KEY = ''
-    client = OpenAI(api_key=OPENAI_API_KEY)
+def call_gpt4omini_api(prompt, timeout=None, use_cache=True, **params):
     messages = []
     # Add text-only prompt
     user_content = {
@@ -107,10 +830,21 @@ def call_gpt4omini_api(prompt):
     }
     messages.append(user_content)
     # Send request to GPT-4 API
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages
-    )
-    # Extract the text response
-    text_response = response.choices[0].message.content
+    text_response = chat_completion("gpt-4o-mini", messages, timeout=timeout, use_cache=use_cache, **params)
     return text_response
+
+# ============================================================
+# Gemini Vision for Image Captioning
+# ============================================================
+_gemini_configured = False
+
+def gemini_vision_caption(image_path, prompt, model_name="gemini-1.5-pro"):
+    global _gemini_configured
+    if not _gemini_configured:
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _gemini_configured = True
+    model = genai.GenerativeModel(model_name)
+    mime_type, base64_image = _load_image(image_path)
+    image_part = {"mime_type": mime_type, "data": base64.b64decode(base64_image)}
+    response = model.generate_content([prompt, image_part])
+    return response.text
@@ -0,0 +1,76 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+# =============================================================================
+# In-memory BM25 lexical index
+# =============================================================================
+# Dense embeddings often miss exact drug names and anatomy terms; a lexical
+# index catches them and, together with the vector search, tells us when the
+# corpus has nothing relevant so the LLM call can be skipped.
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "how", "in", "is", "it", "its", "of", "on", "or", "that", "the", "this", "to",
+    "was", "what", "when", "which", "who", "why", "will", "with", "most", "likely",
+    "option", "following", "surgical", "surgery", "image",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of texts.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = []
+        self.postings = defaultdict(list)  # term -> [(doc_index, term_frequency)]
+        for doc_index, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_index, tf))
+        self.num_docs = len(self.doc_lengths)
+        self.avg_doc_length = (sum(self.doc_lengths) / self.num_docs) if self.num_docs else 0.0
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=10, candidates=None):
+        """
+        Returns [(doc_index, relevance)] for the top-k documents, best first.
+        relevance is the BM25 score divided by the score of a document of average
+        length containing every query term once (capped at 1.0), i.e. roughly the
+        idf-weighted share of the query found in the document. Terms that never
+        occur in the corpus count with the highest idf, so an off-topic query that
+        shares one common word with a document stays well below 1.0.
+        `candidates` optionally restricts the search to a set of doc indices.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.num_docs:
+            return []
+
+        scores = defaultdict(float)
+        max_score = 0.0
+        for term in terms:
+            idf = self.idf(term)
+            max_score += idf
+            for doc_index, tf in self.postings.get(term, ()):
+                if candidates is not None and doc_index not in candidates:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_doc_length)
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if max_score <= 0:
+            return []
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(doc_index, min(1.0, score / max_score)) for doc_index, score in ranked]
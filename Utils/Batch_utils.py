@@ -0,0 +1,389 @@
+import os
+import json
+import glob
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from Utils.Cache_utils import ResponseCache
+
+# =============================================================================
+# Offline Batch API execution
+# =============================================================================
+# Batch mode runs the normal pipeline for every row, but the calls made through
+# Utils.API_utils are not sent. A call whose response is already known returns
+# it. Otherwise the request is written to a JSONL file in the provider's batch
+# format and the row is paused. Each pass over the dataset therefore advances
+# every row to its next LLM call (routing -> agents -> parsing -> rubric ->
+# refinement), and that stage's requests for all rows go out as one batch.
+#
+# Layout of the batch directory (everything needed to resume a run):
+#   completed.json                     rows that have finished
+#   stage_001/requests_000.jsonl       requests of a stage (split by size)
+#   stage_001/batches.json             submitted batch ids and their status
+#   stage_001/results_000.jsonl        provider output for requests_000.jsonl
+#   stage_001/errors_000.jsonl         provider errors for requests_000.jsonl
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_MAX_REQUESTS = int(os.environ.get("SURGRAW_BATCH_MAX_REQUESTS", "50000"))
+BATCH_MAX_BYTES = int(os.environ.get("SURGRAW_BATCH_MAX_BYTES", str(190 * 1024 ** 2)))
+# A request that failed this many times fails its row like an API error would
+BATCH_MAX_ATTEMPTS = int(os.environ.get("SURGRAW_BATCH_MAX_ATTEMPTS", "3"))
+BATCH_TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+_active_row = ContextVar("active_batch_row", default=None)
+
+
+class BatchPending(BaseException):
+    """
+    Raised when a row needs a response that is not available yet. It derives
+    from BaseException so the pipeline's `except Exception` retry loops do not
+    swallow it.
+    """
+
+
+class BatchRow:
+    """
+    Per-row state of one pass. Occurrences of the same request are numbered,
+    so a deliberate re-sample (e.g. a debate refinement) gets its own response.
+    """
+
+    def __init__(self, session, row_id):
+        self.session = session
+        self.row_id = row_id
+        self.pending = 0
+        self._occurrences = Counter()
+        self._lock = threading.Lock()
+
+    def resolve(self, model, messages, params):
+        """
+        Returns the list of completion texts for this request, or records the
+        request for the next batch and raises BatchPending.
+        """
+        key = ResponseCache.make_key(model, messages, params)
+        with self._lock:
+            occurrence = self._occurrences[key]
+            self._occurrences[key] += 1
+        custom_id = f"r{self.row_id}-{key[:24]}-{occurrence}"
+
+        texts = self.session.result(custom_id)
+        if texts is not None:
+            return texts
+        with self._lock:
+            self.pending += 1
+        self.session.add_request(custom_id, model, messages, params)
+        raise BatchPending(custom_id)
+
+
+def get_active_batch_row():
+    return _active_row.get()
+
+
+@contextmanager
+def batch_row(session, row_id):
+    """
+    Routes the API calls of the current context through `session` for `row_id`.
+    Yields the BatchRow (None when session is None). A BatchPending raised
+    inside the block is absorbed; check `.pending` afterwards.
+    """
+    if session is None:
+        yield None
+        return
+    row = BatchRow(session, row_id)
+    token = _active_row.set(row)
+    try:
+        yield row
+    except BatchPending:
+        pass
+    finally:
+        _active_row.reset(token)
+
+
+def _texts_from_body(body):
+    choices = sorted(body.get("choices", []), key=lambda choice: choice.get("index", 0))
+    return [(choice.get("message") or {}).get("content") for choice in choices]
+
+
+def _results_path(request_path):
+    stage_dir, name = os.path.split(request_path)
+    return os.path.join(stage_dir, name.replace("requests_", "results_"))
+
+
+class BatchSession:
+    """
+    Intermediate files of one batch run: known responses, failures, pending
+    requests and completed rows.
+    """
+
+    def __init__(self, batch_dir):
+        self.batch_dir = batch_dir
+        os.makedirs(batch_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._results = {}
+        self._failures = Counter()
+        self._last_errors = {}
+        self._pending = {}
+        self.completed_rows = set()
+
+        completed_path = os.path.join(batch_dir, "completed.json")
+        if os.path.exists(completed_path):
+            with open(completed_path, "r") as f:
+                self.completed_rows = set(json.load(f))
+        self._ingested = set()
+        self.ingest()
+
+    # ------------------------------------------------------------------
+    # Results
+    # ------------------------------------------------------------------
+    def ingest(self):
+        """
+        Loads every result/error file that has not been read yet.
+        """
+        paths = sorted(glob.glob(os.path.join(self.batch_dir, "stage_*", "results_*.jsonl")) +
+                       glob.glob(os.path.join(self.batch_dir, "stage_*", "errors_*.jsonl")))
+        for path in paths:
+            if path in self._ingested:
+                continue
+            self._ingested.add(path)
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._ingest_record(record)
+
+    def _ingest_record(self, record):
+        custom_id = record.get("custom_id")
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        texts = _texts_from_body(body) if response.get("status_code") == 200 else []
+        with self._lock:
+            if texts and all(text is not None for text in texts):
+                self._results[custom_id] = texts
+            else:
+                self._failures[custom_id] += 1
+                self._last_errors[custom_id] = record.get("error") or body.get("error") or "no completion"
+
+    def result(self, custom_id):
+        with self._lock:
+            texts = self._results.get(custom_id)
+            failures = self._failures[custom_id]
+        if texts is None and failures >= BATCH_MAX_ATTEMPTS:
+            raise RuntimeError(f"Batch request {custom_id} failed {failures} times: {self._last_errors[custom_id]}")
+        return texts
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+    def add_request(self, custom_id, model, messages, params):
+        with self._lock:
+            self._pending[custom_id] = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {"model": model, "messages": messages, **params},
+            }
+
+    def mark_completed(self, row_id):
+        self.completed_rows.add(row_id)
+        path = os.path.join(self.batch_dir, "completed.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(sorted(self.completed_rows), f)
+        os.replace(f"{path}.tmp", path)
+
+    def stage_dirs(self):
+        return sorted(glob.glob(os.path.join(self.batch_dir, "stage_*")))
+
+    def write_stage(self):
+        """
+        Writes the pending requests to a new stage directory, split into files of
+        at most BATCH_MAX_REQUESTS lines / BATCH_MAX_BYTES. Returns the stage
+        directory, or None if nothing is pending.
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+        if not pending:
+            return None
+
+        stage_dir = os.path.join(self.batch_dir, f"stage_{len(self.stage_dirs()) + 1:03d}")
+        os.makedirs(stage_dir)
+        part, lines, size = 0, 0, 0
+        f = open(os.path.join(stage_dir, f"requests_{part:03d}.jsonl"), "w", encoding="utf-8")
+        for request in pending:
+            line = json.dumps(request, ensure_ascii=False) + "\n"
+            line_size = len(line.encode("utf-8"))
+            if lines and (lines >= BATCH_MAX_REQUESTS or size + line_size > BATCH_MAX_BYTES):
+                f.close()
+                part, lines, size = part + 1, 0, 0
+                f = open(os.path.join(stage_dir, f"requests_{part:03d}.jsonl"), "w", encoding="utf-8")
+            f.write(line)
+            lines += 1
+            size += line_size
+        f.close()
+        print(f"[Batch] Wrote {len(pending)} requests to {stage_dir} ({part + 1} file(s))")
+        return stage_dir
+
+    def outstanding(self):
+        """
+        Request files whose results have not arrived yet.
+        """
+        waiting = []
+        for stage_dir in self.stage_dirs():
+            for request_path in sorted(glob.glob(os.path.join(stage_dir, "requests_*.jsonl"))):
+                if not os.path.exists(_results_path(request_path)):
+                    waiting.append(request_path)
+        return waiting
+
+
+# =============================================================================
+# Submission
+# =============================================================================
+def _load_batches(stage_dir):
+    path = os.path.join(stage_dir, "batches.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_batches(stage_dir, batches):
+    path = os.path.join(stage_dir, "batches.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(batches, f, indent=4)
+    os.replace(f"{path}.tmp", path)
+
+
+def submit_openai_batches(session):
+    """
+    Uploads every outstanding request file that has not been submitted yet and
+    creates a Batch API job for it.
+    """
+    from Utils.API_utils import get_openai_client
+    client = get_openai_client()
+    for request_path in session.outstanding():
+        stage_dir, name = os.path.split(request_path)
+        batches = _load_batches(stage_dir)
+        if name in batches:
+            continue
+        with open(request_path, "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+        )
+        batches[name] = {"batch_id": batch.id, "input_file_id": uploaded.id, "status": batch.status}
+        _save_batches(stage_dir, batches)
+        print(f"[Batch] Submitted {request_path} as {batch.id}")
+
+
+def _batch_error(batch):
+    """
+    Error record for requests a finished job returned nothing for.
+    """
+    details = [f"{getattr(error, 'code', None) or 'error'}: {getattr(error, 'message', error)}"
+               for error in (getattr(getattr(batch, "errors", None), "data", None) or [])]
+    message = f"batch {batch.id} {batch.status}" + (f" ({'; '.join(details)})" if details else "")
+    return {"message": message}
+
+
+def _custom_ids(text):
+    custom_ids = set()
+    for line in text.splitlines():
+        try:
+            custom_ids.add(json.loads(line).get("custom_id"))
+        except (ValueError, AttributeError):
+            continue
+    return custom_ids
+
+
+def poll_openai_batches(session):
+    """
+    Checks submitted jobs and downloads the output/error files of finished ones.
+    Requests a finished job returned nothing for (e.g. a failed or expired job
+    without output) get an error record, so they count towards
+    BATCH_MAX_ATTEMPTS and are recorded again (and retried) on the next pass.
+    """
+    from Utils.API_utils import get_openai_client
+    client = get_openai_client()
+    for request_path in session.outstanding():
+        stage_dir, name = os.path.split(request_path)
+        batches = _load_batches(stage_dir)
+        if name not in batches:
+            continue
+        batch = client.batches.retrieve(batches[name]["batch_id"])
+        batches[name]["status"] = batch.status
+        _save_batches(stage_dir, batches)
+        if batch.status not in BATCH_TERMINAL_STATES:
+            continue
+        errors = ""
+        if batch.error_file_id:
+            errors = client.files.content(batch.error_file_id).text
+            with open(os.path.join(stage_dir, name.replace("requests_", "errors_")), "w", encoding="utf-8") as f:
+                f.write(errors)
+        results_path = _results_path(request_path)
+        output = client.files.content(batch.output_file_id).text if batch.output_file_id else ""
+        with open(request_path, "r", encoding="utf-8") as f:
+            unanswered = _custom_ids(f.read()) - _custom_ids(output) - _custom_ids(errors)
+        with open(f"{results_path}.tmp", "w", encoding="utf-8") as f:
+            f.write(output)
+            if output and not output.endswith("\n"):
+                f.write("\n")
+            error = _batch_error(batch)
+            for custom_id in sorted(unanswered):
+                f.write(json.dumps({"custom_id": custom_id, "response": None, "error": error}) + "\n")
+        os.replace(f"{results_path}.tmp", results_path)
+        print(f"[Batch] {batch.id} {batch.status}; results saved to {results_path}"
+              + (f" ({len(unanswered)} request(s) without a response)" if unanswered else ""))
+    session.ingest()
+
+
+def complete_batch_file(request_path, results_path, responder=None):
+    """
+    Local stand-in for the Batch API: answers every request of `request_path`
+    and writes the result file in the provider's output format.
+    `responder(body)` returns a chat completion dict; by default each request is
+    sent synchronously through Utils.API_utils (e.g. to a local mock server).
+    """
+    if responder is None:
+        from Utils.API_utils import _create_chat_completion
+
+        def responder(body):
+            params = {name: value for name, value in body.items() if name not in ("model", "messages")}
+            return _create_chat_completion(body["model"], body["messages"], None, params).model_dump()
+
+    with open(request_path, "r", encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    with open(f"{results_path}.tmp", "w", encoding="utf-8") as out:
+        for number, request in enumerate(requests):
+            record = {"id": f"batch_req_{number}", "custom_id": request["custom_id"], "response": None, "error": None}
+            try:
+                record["response"] = {"status_code": 200, "body": responder(request["body"])}
+            except Exception as e:
+                record["error"] = {"message": str(e)}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(f"{results_path}.tmp", results_path)
+
+
+def complete_batches_locally(session, responder=None):
+    for request_path in session.outstanding():
+        complete_batch_file(request_path, _results_path(request_path), responder)
+    session.ingest()
+
+
+def wait_for_batches(session, submit, poll_interval):
+    """
+    Polls submitted jobs until no request file is outstanding.
+    """
+    while session.outstanding():
+        if submit == "openai":
+            poll_openai_batches(session)
+        if session.outstanding():
+            print(f"[Batch] {len(session.outstanding())} request file(s) still running; checking again in {poll_interval:.0f}s")
+            time.sleep(poll_interval)
+            session.ingest()
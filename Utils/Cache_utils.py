@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# =============================================================================
+# Persistent, content-addressed LLM response cache
+# =============================================================================
+# Each entry is a small JSON file named after the SHA-256 of the request
+# (model + messages + sampling parameters). Inline base64 images are replaced
+# by the hash of their content before hashing, so the key stays short and the
+# same frame always maps to the same entry.
+
+_bypass_cache = ContextVar("bypass_response_cache", default=False)
+
+
+class ResponseCache:
+    """
+    On-disk cache of chat completion responses with size/age based eviction.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, max_age_seconds=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = 0
+        self.evict()
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    @staticmethod
+    def make_key(model, messages, params=None) -> str:
+        """
+        Builds the content-addressed key for a request.
+        """
+        normalized = json.dumps(
+            {
+                "model": model,
+                "messages": _hash_inline_images(messages),
+                "params": params or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    # ------------------------------------------------------------------
+    # Get / put
+    # ------------------------------------------------------------------
+    def get(self, key):
+        """
+        Returns the cached value for `key`, or None on a miss or expired entry.
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.max_age_seconds and time.time() - stat.st_mtime > self.max_age_seconds:
+                self._remove(path, stat.st_size)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["value"]
+            # Touch the entry so eviction is least-recently-used
+            os.utime(path, None)
+        except (FileNotFoundError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value, model=None):
+        """
+        Stores `value` under `key` and evicts old entries if the cache is too large.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = json.dumps({"model": model, "created": time.time(), "value": value}, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        with self._lock:
+            # Overwriting an entry replaces its bytes rather than adding to them
+            try:
+                previous_size = os.path.getsize(path)
+            except FileNotFoundError:
+                previous_size = 0
+            os.replace(tmp_path, path)
+            self.writes += 1
+            self._total_bytes += len(payload.encode("utf-8")) - previous_size
+            over_budget = self.max_bytes and self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    # ------------------------------------------------------------------
+    # Eviction
+    # ------------------------------------------------------------------
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.evictions += 1
+            self._total_bytes -= size
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the
+        cache fits in max_bytes.
+        """
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        with self._lock:
+            self._total_bytes = sum(size for _, size, _ in entries)
+
+        entries.sort()
+        for mtime, size, path in entries:
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            if not expired and (not self.max_bytes or self._total_bytes <= self.max_bytes):
+                break
+            self._remove(path, size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "bytes": self._total_bytes,
+            }
+
+
+def _hash_inline_images(messages):
+    """
+    Returns a copy of `messages` where every data: URL is replaced by the
+    SHA-256 of its content.
+    """
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                url = part.get("image_url", {}).get("url", "") if part.get("type") == "image_url" else ""
+                if url.startswith("data:"):
+                    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+                    part = {"type": "image_url", "image_url": {"sha256": digest}}
+                parts.append(part)
+            content = parts
+        normalized.append({**message, "content": content})
+    return normalized
+
+
+# =============================================================================
+# Process-wide cache instance
+# =============================================================================
+_response_cache = None
+
+
+def enable_response_cache(cache_dir, max_bytes=None, max_age_seconds=None):
+    """
+    Turns on the on-disk response cache for every call made through Utils.API_utils.
+    """
+    global _response_cache
+    kwargs = {}
+    if max_bytes is not None:
+        kwargs["max_bytes"] = max_bytes
+    if max_age_seconds is not None:
+        kwargs["max_age_seconds"] = max_age_seconds
+    _response_cache = ResponseCache(cache_dir, **kwargs)
+    print(f"[Cache] Response cache enabled at {cache_dir}")
+    return _response_cache
+
+
+def get_response_cache():
+    """
+    Returns the active ResponseCache, or None if caching is off or bypassed
+    for the current thread.
+    """
+    if _bypass_cache.get():
+        return None
+    return _response_cache
+
+
+@contextmanager
+def bypass_response_cache():
+    """
+    Calls made inside this block neither read from nor write to the cache.
+    Use it for calls that are meant to re-sample (e.g. debate refinements).
+    """
+    token = _bypass_cache.set(True)
+    try:
+        yield
+    finally:
+        _bypass_cache.reset(token)
+
+
+if os.environ.get("SURGRAW_CACHE_DIR"):
+    enable_response_cache(
+        os.environ["SURGRAW_CACHE_DIR"],
+        max_bytes=int(os.environ.get("SURGRAW_CACHE_MAX_BYTES", 2 * 1024 ** 3)),
+        max_age_seconds=float(os.environ.get("SURGRAW_CACHE_MAX_AGE", 30 * 24 * 3600)),
+    )
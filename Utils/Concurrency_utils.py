@@ -0,0 +1,130 @@
+import io
+import os
+import sys
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# =============================================================================
+# Per-thread output capture
+# =============================================================================
+# contextlib.redirect_stdout swaps sys.stdout for the whole process, so two rows
+# running at the same time would write into each other's log buffers. Instead we
+# install one proxy for stdout/stderr that looks up the active buffer of the
+# calling thread and falls back to the real stream when nothing is captured.
+
+_thread_state = threading.local()
+_install_lock = threading.Lock()
+
+
+class ThreadLocalStream(io.TextIOBase):
+    """
+    File-like proxy that forwards writes to the calling thread's capture buffer,
+    or to the original stream if the thread is not capturing.
+    """
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def _target(self):
+        buffer = getattr(_thread_state, "buffer", None)
+        return buffer if buffer is not None else self._fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        target = self._target()
+        return target.isatty() if hasattr(target, "isatty") else False
+
+    @property
+    def encoding(self):
+        return getattr(self._fallback, "encoding", "utf-8")
+
+
+def install_thread_local_streams():
+    """
+    Replace sys.stdout and sys.stderr with ThreadLocalStream proxies (idempotent).
+    """
+    with _install_lock:
+        if not isinstance(sys.stdout, ThreadLocalStream):
+            sys.stdout = ThreadLocalStream(sys.stdout)
+        if not isinstance(sys.stderr, ThreadLocalStream):
+            sys.stderr = ThreadLocalStream(sys.stderr)
+
+
+@contextmanager
+def capture_output(buffer=None):
+    """
+    Capture everything the current thread prints (stdout and stderr) into `buffer`.
+    Other threads are unaffected. Yields the buffer.
+    """
+    install_thread_local_streams()
+    if buffer is None:
+        buffer = io.StringIO()
+    previous = getattr(_thread_state, "buffer", None)
+    _thread_state.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _thread_state.buffer = previous
+
+
+# =============================================================================
+# Parallel fan-out with deterministic log order
+# =============================================================================
+PARALLEL_FANOUT = os.environ.get("SURGRAW_PARALLEL_FANOUT", "1") != "0"
+
+
+def run_captured(call):
+    """
+    Runs `call` with its output captured. Returns (result, exception, buffer);
+    exceptions are returned instead of raised. BaseExceptions that are not
+    errors (BatchPending, KeyboardInterrupt, SystemExit) propagate.
+    """
+    buffer = io.StringIO()
+    with capture_output(buffer):
+        try:
+            return call(), None, buffer
+        except Exception as e:
+            return None, e, buffer
+
+
+def run_parallel(*calls):
+    """
+    Runs independent zero-argument callables concurrently and returns their
+    results in the given order. Each call's printed output is captured and then
+    replayed in call order, so logs read exactly as if the calls ran serially.
+    Context variables (e.g. a cache bypass) are propagated to every call.
+    If a call raises, its exception is re-raised after all output is replayed
+    (a BatchPending or interrupt is re-raised without its call's output).
+    """
+    if not PARALLEL_FANOUT or len(calls) < 2:
+        return [call() for call in calls]
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, run_captured, call) for call in calls]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except BaseException as e:
+                outcomes.append((None, e, io.StringIO()))
+
+    results = []
+    error = None
+    for result, exception, buffer in outcomes:
+        sys.stdout.write(buffer.getvalue())
+        if exception is None:
+            pass
+        elif error is None or (isinstance(error, Exception) and not isinstance(exception, Exception)):
+            # A BatchPending or interrupt wins over ordinary errors
+            error = exception
+        results.append(result)
+    if error is not None:
+        raise error
+    return results
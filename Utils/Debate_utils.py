@@ -1,10 +1,15 @@
 import re
-import time
 import sys
+import os
 import json
+import threading
 from Utils.API_utils import call_gpt35Turbo_api,gpt4_vision_caption
+from Utils.Concurrency_utils import run_parallel
 from Agents.Agent4_InstrumentIdentification import Instrument_Recognition_Agent
 from Agents.Agent1_ActionRecognition import Action_Recognition_Agent
+from Utils.Trace_utils import traced
+from Utils.Prompt_utils import render_prompt
+from Utils.Token_utils import count_tokens, truncate_to_tokens, fit_blocks_to_budget
 
 # =============================================================================
 # Knowledge Graph and Mappings
@@ -75,6 +80,7 @@ action_map = {
 }
 
 
+@traced("stage")
 def transform_action_to_instrument_question(action_question: str) -> str:
     
     instrument_question = action_question.replace(
@@ -137,18 +143,8 @@ def summarize_with_gpt(response: str, task: str) -> str:
     mapping = instrument_map if task == "instrument" else action_map
     mapping_text = "\n".join([f"{key} → {value}" for key, value in mapping.items()])
 
-    prompt = f"""
-    Please analyze the following response from a surgical AI agent and extract only the final {task} prediction.
-    If the answer is unclear, return "unknown". If the response specifies an option (e.g., "Option (D)"), use the mapping below:
-
-    {task.capitalize()} Mapping:
-    {mapping_text}
-
-    Response:
-    {response}
-
-    Return only the extracted {task} name as the output, without any extra text.
-    """
+    prompt = render_prompt("summarize_response", task=task, task_title=task.capitalize(),
+                           mapping_text=mapping_text, response=response)
 
     try:
         print(f"Extracting {task} with GPT-3.5...")
@@ -162,19 +158,98 @@ def summarize_with_gpt(response: str, task: str) -> str:
 
     return extracted_result
 
+# =============================================================================
+# Deterministic answer extraction
+# =============================================================================
+# Every agent prompt requires the final line "The answer is: Option (X)", so the
+# option letter can almost always be read locally. GPT-3.5 is only asked when
+# none of the patterns below match.
+
+_FINAL_ANSWER_PATTERNS = [
+    # The answer is: Option (D) / **The answer is: Option D** / answer is option (d)
+    re.compile(r"answer\s+is\s*[:\-]?\s*[*_\s]*option\s*[*_\s]*\(?\s*([a-g])\s*\)?(?![a-z])", re.IGNORECASE),
+    # The answer is: (D) / The answer is: D)
+    re.compile(r"answer\s+is\s*[:\-]?\s*[*_\s]*\(\s*([a-g])\s*\)", re.IGNORECASE),
+    re.compile(r"answer\s+is\s*[:\-]?\s*[*_\s]*([a-g])\s*[).:]", re.IGNORECASE),
+    # Final answer: Option (D)
+    re.compile(r"final\s+answer\s*[:\-]?\s*[*_\s]*(?:option\s*)?\(?\s*([a-g])\s*\)", re.IGNORECASE),
+]
+_ANSWER_IS = re.compile(r"answer\s+is\s*[:\-]?(.*)", re.IGNORECASE)
+
+_extraction_lock = threading.Lock()
+extraction_stats = {"local": 0, "gpt_fallback": 0}
+
+
+def extract_option_letter(agent_response: str):
+    """
+    Returns the upper-case option letter of the agent's final answer, or None.
+    The last match in the text wins, whichever pattern it comes from, since the
+    conclusion comes at the end of the CoT (ties go to the earlier pattern).
+    """
+    best = None
+    for priority, pattern in enumerate(_FINAL_ANSWER_PATTERNS):
+        for match in pattern.finditer(agent_response or ""):
+            position = (match.start(), -priority)
+            if best is None or position > best[0]:
+                best = (position, match.group(1))
+    return best[1].upper() if best is not None else None
+
+
+def extract_answer(agent_response: str, task: str):
+    """
+    Extracts the instrument/action name from the agent response without an LLM
+    call, via the option letter or a name written after "The answer is".
+    Returns None if neither is found.
+    """
+    mapping = instrument_map if task == "instrument" else action_map
+    letter = extract_option_letter(agent_response)
+    if letter in mapping:
+        return mapping[letter].title()
+
+    final_lines = _ANSWER_IS.findall(agent_response or "")
+    if final_lines:
+        final_line = final_lines[-1].lower()
+        for name in sorted(mapping.values(), key=len, reverse=True):
+            if name in final_line:
+                return name.title()
+    return None
+
+
+def _parse_response(agent_response: str, task: str) -> str:
+    name = extract_answer(agent_response, task)
+    with _extraction_lock:
+        extraction_stats["local" if name is not None else "gpt_fallback"] += 1
+    if name is not None:
+        print(f"Extracted {task} locally: {name}")
+        return name
+    print(f"Local {task} extraction failed; falling back to GPT-3.5.")
+    return summarize_with_gpt(agent_response, task)
+
+
+def get_extraction_stats() -> dict:
+    """
+    Counts of local extractions vs GPT fallbacks, and the fallback rate.
+    """
+    with _extraction_lock:
+        total = extraction_stats["local"] + extraction_stats["gpt_fallback"]
+        return {**extraction_stats, "fallback_rate": round(extraction_stats["gpt_fallback"] / total, 3) if total else 0.0}
+
+
+@traced("stage")
 def parse_instrument_response(agent_response: str) -> str:
     """
-    Uses GPT-3.5 to extract the instrument from the agent response.
+    Extracts the instrument from the agent response (locally, GPT-3.5 as fallback).
     """
-    instrument_name = summarize_with_gpt(agent_response, "instrument")
+    instrument_name = _parse_response(agent_response, "instrument")
     print("parse_instrument_response_instrument_name: ", instrument_name)
     return instrument_name
 
+@traced("stage")
 def parse_action_response(agent_response: str) -> str:
     """
-    Uses GPT-3.5 to extract the action from the agent response.
+    Extracts the action from the agent response (locally, GPT-3.5 as fallback).
     """
-    action_name = summarize_with_gpt(agent_response, "action")
+    action_name = _parse_response(agent_response, "action")
     print("parse_action_response_action_name: ", action_name)
     return action_name
 
@@ -194,53 +269,127 @@ def instrument_action_consistency_check(instrument_name, action_name) -> bool:
     return action_key in valid_actions
     
 
-def gpt_evaluate_metric(metric_name, instrument_agent, action_agent, rubric, max_retries=3) -> int:
+def _retry_prompt(prompt, previous_reply, instruction):
     """
-    Asks GPT-3.5 to evaluate the given response_text based on a provided rubric
-    for the metric 'metric_name' and return an integer rating between 1 and 5.
+    The prompt for a retry: the original prompt plus a corrective note on the
+    reply that could not be used, so the retry is not the identical request.
     """
-    prompt = f"""
-    You are an expert evaluator of a multi-agent collaboration in an agentic system called Surg-CoT, which is a Chain-of-Thought embedded knowledge-based surgical agent which provide chain-of-thought reasoning for surgical image analysis. 
-    Surg-CoT is designed to be trustworthy, accurate, and explainable in high-stakes medical contexts. 
-    The ultimate goal of the system is to correctly identify the surgical action.
-    
-    To enhance the accuracy of action recognition, two agents collaborate:
-      1. The action recognition agent provides an initial prediction of the surgical action.
-      2. The instrument identification agent supplements this prediction by accurately identifying the surgical instrument,
-         thereby reinforcing the action prediction.
-    
-    Evaluate the following agent response based on the metric "{metric_name}".
-    {rubric}
+    return prompt + f"""
+    Your previous reply could not be used:
+    {previous_reply}
 
-    Response from the instrument_identification_agent:
-    {instrument_agent}
+    {instruction}
+    """
 
-    Response from the action_recognition_agent:
-    {action_agent}
 
-    Please provide only an integer rating between 1 (Very Poor) and 5 (Excellent) as your output.
+@traced("stage")
+def gpt_evaluate_metric(metric_name, instrument_agent, action_agent, rubric, max_retries=3) -> int:
     """
+    Asks GPT-3.5 to evaluate the given response_text based on a provided rubric
+    for the metric 'metric_name' and return an integer rating between 1 and 5.
+    Retries bypass the response cache, which may hold the unusable reply.
+    """
+    prompt = render_prompt("evaluate_metric", metric_name=metric_name, rubric=rubric,
+                           instrument_agent=instrument_agent, action_agent=action_agent)
+    request = prompt
     for attempt in range(1, max_retries + 1):
         try:
             print(f"GPT rating attempt {attempt} for {metric_name}...")
-            rating_str = call_gpt35Turbo_api(prompt).strip()
+            rating_str = call_gpt35Turbo_api(request, use_cache=attempt == 1).strip()
             print(f"Rating extracted: {rating_str}")
             match = re.search(r'\b([1-5])\b', rating_str)
-            print(match)
             if match:
                 return int(match.group(1))  # Extract valid rating
-                print(f"Rating extracted: {rating_str}")
-            else:
-                print(f"Attempt {attempt}: Failed to extract valid rating. Retrying...")
-                time.sleep(1)  # Short delay before retrying
+            print(f"Attempt {attempt}: Failed to extract valid rating. Retrying...")
+            request = _retry_prompt(prompt, rating_str,
+                                    "Reply with only a single integer between 1 and 5, without any other text.")
         except Exception as e:
+            # Rate limits and transient API errors are already retried by the API scheduler
             print(f"Error in attempt {attempt} evaluating {metric_name}: {e}")
-            time.sleep(1)  # Prevent immediate retries on errors
 
     print(f"All {max_retries} attempts failed. Defaulting to rating 3 (average).")
     return 3  # Default rating on repeated failure
 
 
+# "combined": one JSON call scores every rubric; "separate": one call per rubric
+EVALUATION_MODE = os.environ.get("SURGRAW_EVALUATION_MODE", "combined")
+# "always": always ask GPT for the rubric scores
+# "kg_short_circuit": skip GPT scoring when the knowledge-graph check fails
+#   (refinement happens anyway) or when it passes and both agents state an
+#   explicit option that matches the parsed names (accepted without scoring)
+SCORING_POLICY = os.environ.get("SURGRAW_SCORING_POLICY", "always")
+
+
+@traced("stage")
+def gpt_evaluate_metrics(rubrics: dict, instrument_agent, action_agent, max_retries=3) -> dict:
+    """
+    Asks GPT-3.5 to score every rubric in `rubrics` ({metric_name: rubric}) in a
+    single JSON call. Returns {metric_name: rating 1-5}; metrics that are still
+    missing after max_retries default to 3 (average).
+    """
+    rubric_text = "\n\n".join(f'Metric "{name}":\n{rubric}' for name, rubric in rubrics.items())
+    keys = ", ".join(f'"{name}": <integer 1-5>' for name in rubrics)
+    prompt = render_prompt("evaluate_metrics", rubric_text=rubric_text, keys=keys,
+                           instrument_agent=instrument_agent, action_agent=action_agent)
+    ratings = {}
+    request = prompt
+    for attempt in range(1, max_retries + 1):
+        response = None
+        try:
+            print(f"GPT combined rating attempt {attempt} for {list(rubrics)}...")
+            # Retries bypass the response cache, which may hold the unusable reply
+            response = call_gpt35Turbo_api(request, use_cache=attempt == 1, temperature=0,
+                                           response_format={"type": "json_object"}).strip()
+            print(f"Ratings extracted: {response}")
+            parsed = json.loads(response)
+            for name in rubrics:
+                match = re.search(r"\b([1-5])\b", str(parsed.get(name, "")))
+                if match and name not in ratings:
+                    ratings[name] = int(match.group(1))
+            if len(ratings) == len(rubrics):
+                return ratings
+            missing = [name for name in rubrics if name not in ratings]
+            print(f"Attempt {attempt}: Missing ratings for {missing}. Retrying...")
+            request = _retry_prompt(prompt, response,
+                                    f"It has no valid rating for {', '.join(missing)}. Return only the JSON object "
+                                    f"of the form {{{keys}}}, with every rating an integer between 1 and 5.")
+        except Exception as e:
+            if response is not None:
+                request = _retry_prompt(prompt, response,
+                                        f"It is not valid JSON. Return only the JSON object of the form {{{keys}}}.")
+            # Rate limits and transient API errors are already retried by the API scheduler
+            print(f"Error in attempt {attempt} evaluating {list(rubrics)}: {e}")
+
+    print(f"All {max_retries} attempts failed for some metrics. Defaulting them to rating 3 (average).")
+    return {name: ratings.get(name, 3) for name in rubrics}
+
+
+def _confident_agreement(instrument_name, action_name, instrument_answer, action_answer) -> bool:
+    """
+    True if both agents state an explicit final option that maps to the parsed names.
+    """
+    explicit_instrument = extract_answer(instrument_answer, "instrument")
+    explicit_action = extract_answer(action_answer, "action")
+    return (
+        explicit_instrument is not None and explicit_action is not None
+        and explicit_instrument.lower() == str(instrument_name).lower().strip()
+        and explicit_action.lower() == str(action_name).lower().strip()
+    )
+
+
+def meets_quality_thresholds(metrics: dict) -> bool:
+    """
+    The moderator's acceptance rule: knowledge-graph consistent and both rubric
+    scores above 3 (or scoring skipped because the agents agree confidently).
+    """
+    if not metrics["kg_consistency"]:
+        return False
+    if metrics.get("scoring") == "skipped_confident_agreement":
+        return True
+    return metrics["Coherence"] > 3 and metrics["Collaborative_Synergy"] > 3
+
+
+@traced("stage")
 def evaluate_consensus(instrument_name, action_name, 
                          instrument_answer, action_answer, question) -> dict:
     """
@@ -248,6 +397,7 @@ def evaluate_consensus(instrument_name, action_name,
       1. Knowledge graph consistency.
       2. Chain-of-Thought (CoT) Coherence (using GPT-generated evaluation).
       3. Answer Relevance (a new metric, also GPT-evaluated).
+    Rubric scores are None when SCORING_POLICY skipped them ("scoring" says why).
     """
     # 1) Check knowledge graph consistency
     kg_consistency = instrument_action_consistency_check(instrument_name, action_name)
@@ -281,55 +431,105 @@ def evaluate_consensus(instrument_name, action_name,
         " 5 = Excellent: Collaboration significantly elevates clarity and correctness"
     )
     # metric_name, instrument_agent, action_agent, rubric
-    Coherence_rating = gpt_evaluate_metric("Coherence of both answers", instrument_answer, action_answer, coherence_rubric)
-    Collaborative_Synergy_rating = gpt_evaluate_metric("Collaborative Synergy of both answers", instrument_answer, action_answer, Collaborative_Synergy_rubric)
+    scoring = "llm"
+    if SCORING_POLICY == "kg_short_circuit":
+        if not kg_consistency:
+            scoring = "skipped_kg_inconsistent"
+        elif _confident_agreement(instrument_name, action_name, instrument_answer, action_answer):
+            scoring = "skipped_confident_agreement"
+
+    if scoring != "llm":
+        print(f"[Evaluator] Rubric scoring {scoring.replace('_', ' ')}.")
+        Coherence_rating, Collaborative_Synergy_rating = None, None
+    elif EVALUATION_MODE == "combined":
+        ratings = gpt_evaluate_metrics(
+            {"Coherence": coherence_rubric, "Collaborative_Synergy": Collaborative_Synergy_rubric},
+            instrument_answer, action_answer,
+        )
+        Coherence_rating, Collaborative_Synergy_rating = ratings["Coherence"], ratings["Collaborative_Synergy"]
+    else:
+        # The two rubric calls are independent and run concurrently (log order is kept)
+        Coherence_rating, Collaborative_Synergy_rating = run_parallel(
+            lambda: gpt_evaluate_metric("Coherence of both answers", instrument_answer, action_answer, coherence_rubric),
+            lambda: gpt_evaluate_metric("Collaborative Synergy of both answers", instrument_answer, action_answer, Collaborative_Synergy_rubric),
+        )
     
     metrics = {
         "kg_consistency": kg_consistency,
         "Coherence": Coherence_rating,
-        "Collaborative_Synergy": Collaborative_Synergy_rating
+        "Collaborative_Synergy": Collaborative_Synergy_rating,
+        "scoring": scoring
     }
     print("Evaluation Metrics: ", metrics)
     return metrics
 
-def select_best_action_output(candidates: list) -> dict:
+# Candidate selection prompt budget. With COMPACT_CANDIDATES each candidate is
+# reduced to its final answer, the opening of each reasoning chain and its
+# metrics; the candidates then share SELECTION_CONTEXT_TOKENS equally.
+COMPACT_CANDIDATES = os.environ.get("SURGRAW_COMPACT_CANDIDATES", "1") != "0"
+SELECTION_CONTEXT_TOKENS = int(os.environ.get("SURGRAW_SELECTION_TOKENS", "3000"))
+CHAIN_SUMMARY_TOKENS = 60
+_CHAIN_HEADING = re.compile(r"^[\s*#>_\-]*chain\s*\d+\s*[:.)\-]", re.IGNORECASE | re.MULTILINE)
+
+
+def _key_chains(agent_response: str) -> list:
     """
-    Given a list of candidate refinement outputs (each a dict with an action answer),
-    use GPT-3.5 to select the candidate with the highest confidence.
+    Returns the first CHAIN_SUMMARY_TOKENS tokens of every "Chain N:" section.
     """
-    candidate_texts = ""
-    for idx, candidate in enumerate(candidates, 1):
-        candidate_texts += f"Candidate {idx}:\n"
-        candidate_texts += f"- Parsed Instrument Name: {candidate['parsed_instrument_name']}\n"
-        candidate_texts += f"- **Raw Action Recognition Agent Output:**\n{candidate['action_answer']}\n"
-        candidate_texts += f"- Evaluation Metrics: {candidate['metrics']}\n\n"
+    starts = [match.start() for match in _CHAIN_HEADING.finditer(agent_response or "")]
+    chains = []
+    for start, end in zip(starts, starts[1:] + [len(agent_response)]):
+        chain = " ".join(agent_response[start:end].replace("**", "").split()).strip("#>_- ")
+        chains.append(truncate_to_tokens(chain, CHAIN_SUMMARY_TOKENS, "gpt-3.5-turbo"))
+    return chains
 
-    # Ask GPT-3.5 to return the candidate number (as an integer) that exhibits the highest confidence.
-    prompt = f"""
-    You are an expert surgical AI evaluator. Your task is to analyze and select the best reasoning 
-    from multiple candidate responses generated by an Action Recognition Agent in a robotic surgery context.
 
-    The system consists of two collaborating agents:
-    - **Instrument Identification Agent:** Identifies the surgical instrument.
-    - **Action Recognition Agent:** Predicts the surgical action using chain-of-thought reasoning.
+def compact_candidate(index: int, candidate: dict) -> str:
+    """
+    Selection-prompt text of one candidate: final answer, metrics and key chains
+    instead of the full raw chain of thought. The reasoning comes last, so a
+    budget cut (which trims from the end) never removes the metrics.
+    """
+    action_answer = candidate["action_answer"]
+    letter = extract_option_letter(action_answer)
+    final_answer = f"Option ({letter}) {action_map.get(letter, '').title()}".strip() if letter else "not stated"
+    chains = _key_chains(action_answer)
+    if chains:
+        reasoning = "\n".join(f"  {chain}" for chain in chains)
+    else:
+        reasoning = "  " + truncate_to_tokens(" ".join(action_answer.split()), CHAIN_SUMMARY_TOKENS * 3, "gpt-3.5-turbo")
+    return (f"Candidate {index}:\n"
+            f"- Parsed Instrument Name: {candidate['parsed_instrument_name']}\n"
+            f"- Final Action Answer: {final_answer} (parsed: {candidate['parsed_action_name']})\n"
+            f"- Evaluation Metrics: {candidate['metrics']}\n"
+            f"- Key Reasoning Chains of the Action Recognition Agent:\n{reasoning}\n")
 
-    Each candidate response includes:
-    - The **parsed instrument name** (validated by the Instrument Identification Agent).
-    - The **full raw response** of the Action Recognition Agent.
-    - The evaluation metrics, including knowledge graph consistency and coherence.
 
-    **Task:**
-    Evaluate the candidates based on the following criteria:
-    1. **Chain-of-thought coherence:** Does the reasoning flow logically from observation to conclusion?
-    2. **Confidence and clarity:** Is the response well-structured, unambiguous, and supported by logical steps?
-    3. **Instrument-action alignment:** Does the predicted action align with the identified instrument?
-    4. **Overall reliability:** Which candidate provides the strongest evidence-based conclusion?
+def _raw_candidate(index: int, candidate: dict) -> str:
+    return (f"Candidate {index}:\n"
+            f"- Parsed Instrument Name: {candidate['parsed_instrument_name']}\n"
+            f"- Evaluation Metrics: {candidate['metrics']}\n"
+            f"- **Raw Action Recognition Agent Output:**\n{candidate['action_answer']}\n")
 
-    **Candidates:**
-    {candidate_texts}
 
-    Provide your decision by stating ONLY the best candidate number (as an integer).
+@traced("stage")
+def select_best_action_output(candidates: list) -> dict:
     """
+    Given a list of candidate refinement outputs (each a dict with an action answer),
+    use GPT-3.5 to select the candidate with the highest confidence.
+    """
+    blocks = [_raw_candidate(idx, candidate) for idx, candidate in enumerate(candidates, 1)]
+    if COMPACT_CANDIDATES:
+        raw_tokens = sum(count_tokens(block, "gpt-3.5-turbo") for block in blocks)
+        blocks = [compact_candidate(idx, candidate) for idx, candidate in enumerate(candidates, 1)]
+        print(f"[Budget] candidates: compacted {len(blocks)} candidate(s) from {raw_tokens} to "
+              f"{sum(count_tokens(block, 'gpt-3.5-turbo') for block in blocks)} tokens")
+    # Every candidate must stay selectable, so each one gets an equal share of the budget
+    candidate_texts = "\n".join(fit_blocks_to_budget("candidates", blocks, SELECTION_CONTEXT_TOKENS,
+                                                     model="gpt-3.5-turbo", separator="\n", equal_share=True)) + "\n"
+
+    # Ask GPT-3.5 to return the candidate number (as an integer) that exhibits the highest confidence.
+    prompt = render_prompt("select_candidate", candidate_texts=candidate_texts)
     print("=====================================================================================================")
     print("######################################################################################################")
     print("GPT candidate selection prompt:", prompt)
@@ -348,9 +548,10 @@ def select_best_action_output(candidates: list) -> dict:
     print("Falling back to the first candidate.")
     return candidates[0]
 
-def save_candidates_to_file(candidates, filename="candidates_log.json"):
+def save_candidates_to_file(candidates, filename):
     """
     Save all candidate refinement outputs to a JSON file for later reference.
+    Each row needs its own file (concurrent rows would overwrite a shared one).
     """
     try:
         with open(filename, "w") as f:
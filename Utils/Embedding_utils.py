@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import threading
+from langchain_core.embeddings import Embeddings
+
+# =============================================================================
+# Embedding backends for the RAG module
+# =============================================================================
+# Every backend implements the LangChain Embeddings interface so it can be used
+# directly by FAISS. `backend_id` identifies the vector space: an index must be
+# queried with the same backend it was built with.
+
+EMBEDDING_BACKEND = os.environ.get("SURGRAW_EMBEDDING_BACKEND", "openai")
+SENTENCE_TRANSFORMER_MODEL = os.environ.get("SURGRAW_SENTENCE_TRANSFORMER_MODEL", "all-MiniLM-L6-v2")
+
+
+class OpenAIEmbeddingBackend(Embeddings):
+    """
+    Remote OpenAI embeddings (original behaviour).
+    """
+    default_score_threshold = 0.50
+
+    def __init__(self):
+        from langchain_community.embeddings import OpenAIEmbeddings
+        from Utils.API_utils import OPENAI_API_KEY, OPENAI_BASE_URL
+        self._embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, openai_api_base=OPENAI_BASE_URL)
+        self.backend_id = f"openai:{self._embeddings.model}"
+
+    def embed_documents(self, texts):
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._embeddings.embed_query(text)
+
+
+class HashingEmbeddingBackend(Embeddings):
+    """
+    CPU-only lexical embeddings: TF weighted, L2 normalised hashed n-grams
+    (scikit-learn HashingVectorizer). Stateless, so no fitting is needed and
+    queries can be embedded without the corpus.
+    """
+    # Lexical vectors of related passages are far less similar than dense ones
+    default_score_threshold = 0.15
+
+    def __init__(self, n_features=2 ** 12):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self._vectorizer = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            stop_words="english",
+            alternate_sign=False,
+            norm="l2",
+        )
+        self.backend_id = f"hashing:{n_features}"
+
+    def embed_documents(self, texts):
+        return self._vectorizer.transform(texts).toarray().tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class SentenceTransformerEmbeddingBackend(Embeddings):
+    """
+    Local sentence-transformers model (only if the package is installed).
+    """
+    default_score_threshold = 0.50
+
+    def __init__(self, model_name=SENTENCE_TRANSFORMER_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.backend_id = f"sentence-transformers:{model_name}"
+
+    def embed_documents(self, texts):
+        return self._model.encode(list(texts), normalize_embeddings=True).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def get_embedding_backend(name=None) -> Embeddings:
+    """
+    Returns an embedding backend by name ("openai", "hashing",
+    "sentence-transformers" or "local") or by a stored backend_id.
+    "local" uses sentence-transformers when available and hashing otherwise.
+    """
+    name = name or EMBEDDING_BACKEND
+    kind, _, option = name.partition(":")
+
+    if kind == "openai":
+        return OpenAIEmbeddingBackend()
+    if kind == "hashing":
+        return HashingEmbeddingBackend(int(option)) if option else HashingEmbeddingBackend()
+    if kind == "sentence-transformers":
+        return SentenceTransformerEmbeddingBackend(option or SENTENCE_TRANSFORMER_MODEL)
+    if kind == "local":
+        try:
+            return SentenceTransformerEmbeddingBackend()
+        except ImportError:
+            print("[Embeddings] sentence-transformers not installed; using hashing embeddings.")
+            return HashingEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a backend with an on-disk cache of chunk embeddings keyed by the
+    SHA-256 of the chunk text, so unchanged chunks are only embedded once
+    across ingestions. Queries are not cached.
+    """
+
+    def __init__(self, backend, cache_dir):
+        self.backend = backend
+        self.backend_id = backend.backend_id
+        self.default_score_threshold = getattr(backend, "default_score_threshold", 0.50)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_id = self.backend_id.replace(":", "_").replace("/", "_")
+        self._path = os.path.join(cache_dir, f"{safe_id}.jsonl")
+        self._vectors = {}
+        if os.path.exists(self._path):
+            with open(self._path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written last line
+                    self._vectors[record["sha256"]] = record["vector"]
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._vectors and key not in missing:
+                missing[key] = text
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.backend.embed_documents(list(missing.values()))
+            with self._lock, open(self._path, "a", encoding="utf-8") as f:
+                for key, vector in zip(missing, vectors):
+                    self._vectors[key] = vector
+                    f.write(json.dumps({"sha256": key, "vector": vector}) + "\n")
+
+        return [self._vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.backend.embed_query(text)
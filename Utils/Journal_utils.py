@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from Utils.Cache_utils import ResponseCache
+
+# =============================================================================
+# Append-only run journal
+# =============================================================================
+# With Main.py --journal/--resume, the lifecycle and every LLM response of a
+# row are appended to a JSONL journal (flushed and fsync'ed) as soon as they
+# exist. After a crash,
+# finished rows are skipped, and an unfinished row is replayed: its journaled
+# responses are returned again in order, so it fast-forwards to the first call
+# that never completed instead of paying for every call again.
+#
+# Record types ("stage"):
+#   started / done / failed      row lifecycle
+#   llm                          one response (id = request hash + occurrence)
+
+_active_row = ContextVar("active_journal_row", default=None)
+
+
+class JournalRow:
+    """
+    Journal state of one row: responses to replay and per-request occurrence
+    counters (a re-sampled request is journaled under a new occurrence).
+    """
+
+    def __init__(self, journal, row_id):
+        self.journal = journal
+        self.row_id = row_id
+        self.replayed = 0
+        self._responses = journal.responses(row_id)
+        self._occurrences = Counter()
+        self._lock = threading.Lock()
+
+    def _response_id(self, model, messages, params):
+        key = ResponseCache.make_key(model, messages, params)
+        with self._lock:
+            occurrence = self._occurrences[key]
+            self._occurrences[key] += 1
+        return f"{key[:24]}-{occurrence}"
+
+    def replay(self, model, messages, params):
+        """
+        Returns (response_id, texts); texts is None if this call was never journaled.
+        """
+        response_id = self._response_id(model, messages, params)
+        texts = self._responses.get(response_id)
+        if texts is not None:
+            with self._lock:
+                self.replayed += 1
+        return response_id, texts
+
+    def record_response(self, response_id, texts):
+        self.journal.append(self.row_id, "llm", {"id": response_id, "texts": texts})
+
+
+class RunJournal:
+    """
+    Reads and appends the journal file of a run.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses = defaultdict(dict)
+        self._status = {}
+        self._last_stage = {}
+
+        if os.path.exists(path):
+            if resume:
+                self._load()
+            else:
+                backup = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}.bak"
+                os.replace(path, backup)
+                print(f"[Journal] Previous journal moved to {backup}")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Line cut off by a crash
+                row_id, stage = record["row"], record["stage"]
+                if stage == "llm":
+                    self._responses[row_id][record["data"]["id"]] = record["data"]["texts"]
+                elif stage == "started":
+                    self._status[row_id] = "partial"
+                elif stage in ("done", "failed"):
+                    self._status[row_id] = stage
+                self._last_stage[row_id] = stage
+
+    def append(self, row_id, stage, data=None):
+        line = json.dumps({"row": row_id, "stage": stage, "time": time.time(), "data": data},
+                          ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            fileno = self._file.fileno()
+            if stage == "llm":
+                self._responses[row_id][data["id"]] = data["texts"]
+            elif stage in ("done", "failed"):
+                self._status[row_id] = stage
+            self._last_stage[row_id] = stage
+        # Synced outside the lock, so concurrent rows are not queued behind the disk
+        os.fsync(fileno)
+
+    def responses(self, row_id):
+        with self._lock:
+            return dict(self._responses.get(row_id, {}))
+
+    def status(self, row_id):
+        """
+        "done", "failed", "partial" or None (never started).
+        """
+        return self._status.get(row_id)
+
+    def should_skip(self, row_id, retry_failed=False):
+        status = self.status(row_id)
+        return status == "done" or (status == "failed" and not retry_failed)
+
+    def summary(self):
+        counts = Counter(self._status.values())
+        return {"done": counts["done"], "failed": counts["failed"], "partial": counts["partial"]}
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def get_active_journal_row():
+    return _active_row.get()
+
+
+@contextmanager
+def journal_row(journal, row_id):
+    """
+    Journals the LLM responses of the current context under `row_id`.
+    Yields the JournalRow (None when journal is None).
+    """
+    if journal is None:
+        yield None
+        return
+    row = JournalRow(journal, row_id)
+    token = _active_row.set(row)
+    try:
+        yield row
+    finally:
+        _active_row.reset(token)
+
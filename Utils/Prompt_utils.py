@@ -0,0 +1,273 @@
+import string
+from Utils.Token_utils import count_tokens, IMAGE_TOKENS
+
+# =============================================================================
+# Prompt template registry
+# =============================================================================
+# Every agent and Debate_utils prompt is registered here as a static prefix
+# followed by a suffix that holds the per-row fields ({question},
+# {retrieved_content}, agent answers, ...). The prefix is byte-identical across
+# calls, so providers that cache prompt prefixes (OpenAI caches prompts of at
+# least PREFIX_CACHE_MIN_TOKENS automatically) only process it once. For
+# vision prompts the image is placed between prefix and suffix (see
+# API_utils._vision_messages), so reruns on the same frame - refinements,
+# samples - reuse prefix + image as well.
+#
+#   python -m Utils.Prompt_utils      prints the token counts of every template
+
+# Shortest prompt prefix the OpenAI API caches
+PREFIX_CACHE_MIN_TOKENS = 1024
+
+
+class Prompt(str):
+    """
+    A rendered prompt (a plain string) that remembers its static prefix and template name.
+    """
+
+    def __new__(cls, prefix, suffix, name=None):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        prompt.name = name
+        return prompt
+
+
+class PrefixTemplate:
+    """
+    Static `prefix` + `suffix` format string with the per-call fields.
+    """
+
+    def __init__(self, name, prefix, suffix, model="gpt-4o-latest", vision=False):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self.model = model
+        self.vision = vision
+        self.fields = sorted({field for _, field, _, _ in string.Formatter().parse(suffix) if field})
+
+    def render(self, **fields) -> Prompt:
+        return Prompt(self.prefix, self.suffix.format(**fields), name=self.name)
+
+    def token_counts(self) -> dict:
+        prefix_tokens = count_tokens(self.prefix, self.model)
+        # Prefix + image is what a rerun on the same frame can reuse
+        cacheable_tokens = prefix_tokens + (IMAGE_TOKENS if self.vision else 0)
+        return {
+            "template": self.name,
+            "model": self.model,
+            "fields": self.fields,
+            "prefix_tokens": prefix_tokens,
+            "suffix_tokens": count_tokens(self.suffix.format(**{field: "" for field in self.fields}), self.model),
+            "cacheable_prefix_tokens": cacheable_tokens,
+            "prefix_cacheable": cacheable_tokens >= PREFIX_CACHE_MIN_TOKENS,
+        }
+
+
+PROMPTS = {}
+
+
+def register_prompt(name, prefix, suffix, model="gpt-4o-latest", vision=False):
+    PROMPTS[name] = PrefixTemplate(name, prefix, suffix, model=model, vision=vision)
+    return PROMPTS[name]
+
+
+def render_prompt(name, **fields) -> Prompt:
+    """
+    Renders a registered template; raises KeyError for unknown templates or missing fields.
+    """
+    return PROMPTS[name].render(**fields)
+
+
+def prompt_token_report() -> list:
+    return [template.token_counts() for template in PROMPTS.values()]
+
+
+def print_prompt_token_report(rows):
+    header = f"{'template':<26} {'model':<15} {'prefix tok':>10} {'suffix tok':>10} {'cacheable tok':>13} {'cached':>6}  fields"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['template']:<26} {row['model']:<15} {row['prefix_tokens']:>10} {row['suffix_tokens']:>10} "
+              f"{row['cacheable_prefix_tokens']:>13} {'yes' if row['prefix_cacheable'] else 'no':>6}  {', '.join(row['fields'])}")
+
+
+# =============================================================================
+# Agent prompts (Agents 1-6)
+# =============================================================================
+_AGENT_INTRO = """
+    You are an AI assistant specializing in surgical video analysis. You can also imagine yourself as a lecturer on surgery who explains surgeons' thought processes and other surgical rationales to new junior surgeons who ask you questions.
+"""
+
+_VISION_CONTEXT = """    You are provided with a text description of a frame of a surgical video clip from a recorded robotic surgery or surgical lecture. You also have contextual information on the surgical procedure.
+    Your task is to generate chain-of-thought answer for the question about the surgical procedure in the image frame.
+    The conversation should proceed as though both the User and Assistant are analyzing the image and its corresponding textual description without referring to the procedure's contextual information.
+"""
+
+_KNOWLEDGE_CONTEXT = """    Your task is to generate chain-of-thought answer for the question about the surgical procedure in the image frame.
+
+    Some relevant medical knowledge has been retrieved from reliable medical sources and literature. This information should be used as a guideline to support surgical reasoning but MUST NOT replace direct observations from the surgical image.
+    If the retrieved knowledge is highly relevant, integrate it into the reasoning process. If it is not directly applicable, you MUST prioritize COT-reasoning based on the image.
+    The retrieved knowledge is given after these instructions, just before the question.
+
+"""
+
+_REQUIREMENTS = """    Below are the requirements for generating the questions and answers in the conversation:
+        Focus on the visual aspects of the image that have been described in text and can be inferred without the additional contextual information.
+        - Do not use phrases like "mentioned", "title", "description" in the conversation. Instead, refer to the information as being "in the image."
+        - The answer should begin with a methodological analysis and thought process, systematically addressing all relevant sub-problems through different chains of thoughts
+        - Ultimately, the answer should conclude with a final statement starting with "The answer is: Option ()"
+        - The different chains of thought should be clearly listed out like "Chain 1:....", "Chain 2:...." and so on.
+        - When generating the answer, approach the question carefully, as a surgeon or lecturer would, and list the key considerations and reasoning required to arrive at a well-supported conclusion.
+        - The question has a chain-of-thought process that largely guide the generation of question-answer pairs:
+
+"""
+
+_CHAIN_TEMPLATE = """                {description}
+                Chain 1: ...
+                ...
+                Chain N: ...
+                The answer is: Option ()
+
+"""
+
+_CLOSING = """    Generate a logical COT answer given the question below.
+
+    However, in the chain of thought answer, do not use phrases like the description supports this by noting or the description mentioned or any other similar phrases.
+    All reasonings and justifications should be strictly derived from the content of the image and the multiple-choice question query only.
+    There can only be one correct answer option for every question.
+    Always think logically and step by step to generate high-quality and insightful COT answes that adhere strictly to the requirements listed above.
+    Follow the COT template closely and elaborate on relevant details.
+    In the above template, some chains of thought require the matching and cross-validation of the extracted visual features with textual features implied by the question. This means that an explicit knowledge graph link MUST be established between the extracted visual features and the textual features!
+    You have to arrive at a deterministic answer and select the option with the highest probability of being correct.
+    Even if you think that there is no correct option, you MUST still give your best guess and select any options with the highest probability of being correct.
+    Before immediately generating the COT QA Pairs, take your time to think logically and generate the COT answer step-by-step.
+    You need to choose one of the 4 options.
+    Clearly state the chain of though format used.
+
+"""
+
+_QUESTION_SUFFIX = """    The question is:
+    {question}
+    """
+
+_KNOWLEDGE_SUFFIX = """    The retrieved knowledge is as follows:
+    {retrieved_content}
+
+""" + _QUESTION_SUFFIX
+
+
+def _register_agent_prompt(name, description, knowledge=False):
+    context = _KNOWLEDGE_CONTEXT if knowledge else _VISION_CONTEXT
+    prefix = _AGENT_INTRO + context + _REQUIREMENTS + _CHAIN_TEMPLATE.format(description=description) + _CLOSING
+    register_prompt(name, prefix, _KNOWLEDGE_SUFFIX if knowledge else _QUESTION_SUFFIX, vision=True)
+
+
+_register_agent_prompt("action_recognition", "Action Recognition: asks about the surgical tool action or reason for a surgical action.")
+_register_agent_prompt("action_prediction", "Surgical plan: asks about a possible future step or procedural steps, predicting the next step after the completion of the current phase.", knowledge=True)
+_register_agent_prompt("anatomy_identification", "Anatomy Identification: asks for surrounding structures, organs or regions in which the procedure is taking place.")
+_register_agent_prompt("instrument_recognition", "Instrument Recognition: asks about the name or identity of a surgical tool.")
+_register_agent_prompt("surgical_outcome", "Surgical Outcome: asks about the surgical outcome or why is an action step or a procedure significant to the procedure.", knowledge=True)
+_register_agent_prompt("patient_detail", "Patient Detail: asks about the illness, status, age, gender, or any identity-related information of the patient.", knowledge=True)
+
+# Question passed to the Action Recognition Agent in refinement rounds
+register_prompt("guided_action_question", "", """
+    The Instrument Identification Agent has identified the instrument in question to be: {instrument_name}.
+    Validate and confirm if you agree that instrument in question is {instrument_name}.
+    If you agree with the Instrument Identification Agent and the identity of the instrument in question, determine the most appropriate ongoing surgical action using the Action Recognition Chain of Thought Process.
+
+    {question}
+    """)
+
+# =============================================================================
+# Debate prompts (Utils/Debate_utils.py)
+# =============================================================================
+_EVALUATOR_INTRO = """
+    You are an expert evaluator of a multi-agent collaboration in an agentic system called Surg-CoT, which is a Chain-of-Thought embedded knowledge-based surgical agent which provide chain-of-thought reasoning for surgical image analysis.
+    Surg-CoT is designed to be trustworthy, accurate, and explainable in high-stakes medical contexts.
+    The ultimate goal of the system is to correctly identify the surgical action.
+
+    To enhance the accuracy of action recognition, two agents collaborate:
+      1. The action recognition agent provides an initial prediction of the surgical action.
+      2. The instrument identification agent supplements this prediction by accurately identifying the surgical instrument,
+         thereby reinforcing the action prediction.
+
+"""
+
+register_prompt("evaluate_metric", _EVALUATOR_INTRO, """    Evaluate the following agent response based on the metric "{metric_name}".
+    {rubric}
+
+    Response from the instrument_identification_agent:
+    {instrument_agent}
+
+    Response from the action_recognition_agent:
+    {action_agent}
+
+    Please provide only an integer rating between 1 (Very Poor) and 5 (Excellent) as your output.
+    """, model="gpt-3.5-turbo")
+
+register_prompt("evaluate_metrics", _EVALUATOR_INTRO, """    Evaluate the following agent responses on each of the metrics below.
+    {rubric_text}
+
+    Response from the instrument_identification_agent:
+    {instrument_agent}
+
+    Response from the action_recognition_agent:
+    {action_agent}
+
+    Return only a JSON object of the form {{{keys}}}, with each rating between 1 (Very Poor) and 5 (Excellent).
+    """, model="gpt-3.5-turbo")
+
+register_prompt("select_candidate", """
+    You are an expert surgical AI evaluator. Your task is to analyze and select the best reasoning
+    from multiple candidate responses generated by an Action Recognition Agent in a robotic surgery context.
+
+    The system consists of two collaborating agents:
+    - **Instrument Identification Agent:** Identifies the surgical instrument.
+    - **Action Recognition Agent:** Predicts the surgical action using chain-of-thought reasoning.
+
+    Each candidate response includes:
+    - The **parsed instrument name** (validated by the Instrument Identification Agent).
+    - The evaluation metrics, including knowledge graph consistency and coherence.
+    - The **response** of the Action Recognition Agent: its final answer and key reasoning chains, or the full raw response.
+
+    **Task:**
+    Evaluate the candidates based on the following criteria:
+    1. **Chain-of-thought coherence:** Does the reasoning flow logically from observation to conclusion?
+    2. **Confidence and clarity:** Is the response well-structured, unambiguous, and supported by logical steps?
+    3. **Instrument-action alignment:** Does the predicted action align with the identified instrument?
+    4. **Overall reliability:** Which candidate provides the strongest evidence-based conclusion?
+
+""", """    **Candidates:**
+    {candidate_texts}
+
+    Provide your decision by stating ONLY the best candidate number (as an integer).
+    """, model="gpt-3.5-turbo")
+
+register_prompt("summarize_response", """
+    Please analyze the following response from a surgical AI agent and extract only its final prediction.
+    If the answer is unclear, return "unknown". If the response specifies an option (e.g., "Option (D)"), use the mapping below:
+
+""", """    {task_title} Mapping:
+    {mapping_text}
+
+    Response:
+    {response}
+
+    Return only the extracted {task} name as the output, without any extra text.
+    """, model="gpt-3.5-turbo")
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Token counts of the registered prompt templates.")
+    parser.add_argument("--json", type=str, default=None, help="Optional path to save the report as JSON.")
+    args = parser.parse_args()
+
+    report = prompt_token_report()
+    print_prompt_token_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"[Prompts] Report saved to {args.json}")
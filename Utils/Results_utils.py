@@ -0,0 +1,339 @@
+import os
+import re
+import json
+import glob
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# =============================================================================
+# Structured per-row results
+# =============================================================================
+# Main.py streams one record per finished row to a JSONL or Parquet file, so
+# accuracy and cost can be computed from one file instead of grepping logs.
+# While a row runs, its pipeline stages (see mark_stage) and
+# the token usage of its API calls are collected in a RowResult.
+
+# Records buffered per Parquet row group (JSONL is written record by record)
+RESULTS_ROW_GROUP_SIZE = int(os.environ.get("SURGRAW_RESULTS_ROW_GROUP", "64"))
+
+RESULT_COLUMNS = [
+    ("row", "int64"),
+    ("image_path", "string"),
+    ("cot_process", "string"),
+    ("question", "string"),
+    ("ground_truth", "string"),
+    ("ground_truth_option", "string"),
+    ("route", "string"),
+    ("department", "string"),
+    ("agent", "string"),
+    ("predicted_option", "string"),
+    ("correct", "bool"),
+    ("instrument_name", "string"),
+    ("action_name", "string"),
+    ("metrics", "string"),           # JSON
+    ("refinements", "int64"),
+    ("stage_latency_s", "string"),   # JSON {stage: seconds}
+    ("total_latency_s", "float64"),
+    ("llm_calls", "int64"),
+    ("prompt_tokens", "int64"),
+    ("completion_tokens", "int64"),
+    ("status", "string"),
+    ("error", "string"),
+]
+
+_active_result = ContextVar("active_row_result", default=None)
+
+
+class RowResult:
+    """
+    Stage timestamps and API usage of one row.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = []  # (stage, perf_counter, data)
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def mark_stage(self, stage, data=None):
+        with self._lock:
+            self.stages.append((stage, time.perf_counter(), data))
+
+    def record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def stage_data(self, stage):
+        for name, _, data in reversed(self.stages):
+            if name == stage:
+                return data
+        return None
+
+    def stage_latencies(self):
+        """
+        Seconds spent before each stage mark; the time after the last mark is "final".
+        """
+        latencies = {}
+        previous = self.started
+        for stage, timestamp, _ in self.stages:
+            latencies[stage] = round(latencies.get(stage, 0.0) + timestamp - previous, 3)
+            previous = timestamp
+        latencies["final"] = round((self.finished or time.perf_counter()) - previous, 3)
+        return latencies
+
+
+@contextmanager
+def row_result():
+    """
+    Collects the stages and API usage of the current context. Yields the RowResult.
+    """
+    result = RowResult()
+    token = _active_result.set(result)
+    try:
+        yield result
+    finally:
+        result.finished = time.perf_counter()
+        _active_result.reset(token)
+
+
+def mark_stage(stage, data=None):
+    result = _active_result.get()
+    if result is not None:
+        result.mark_stage(stage, data)
+
+
+def record_usage(response):
+    result = _active_result.get()
+    if result is not None:
+        result.record_usage(response)
+
+
+# =============================================================================
+# Records
+# =============================================================================
+_OPTION_LINE = re.compile(r"(?:^|\n)\s*\(?([A-G])[.):]\s*(.+)")
+_OPTION_ONLY = re.compile(r"^\s*(?:option\s*)?\(?\s*([A-G])\s*\)?\s*(?:[.:)\-]|$)", re.IGNORECASE)
+
+
+def ground_truth_option(ground_truth, question):
+    """
+    Returns the option letter of the ground truth, given either as a letter
+    ("C", "Option (C)", "C. Needle driver") or as the text of one of the
+    options listed in the question.
+    """
+    if ground_truth is None or (isinstance(ground_truth, float) and ground_truth != ground_truth):
+        return None
+    text = str(ground_truth).strip()
+    match = _OPTION_ONLY.match(text)
+    if match:
+        return match.group(1).upper()
+    wanted = text.lower().rstrip(".")
+    for letter, option in _OPTION_LINE.findall(str(question)):
+        if option.strip().lower().rstrip(".") == wanted:
+            return letter.upper()
+    return None
+
+
+def build_record(index, row, final_answer, error, result):
+    """
+    Builds the results record of a finished row.
+    """
+    from Utils.Debate_utils import extract_option_letter, extract_answer
+
+    route = result.stage_data("route") or {}
+    parsed = result.stage_data("parsed") or {}
+    candidates = result.stage_data("candidates")
+
+    if isinstance(final_answer, dict):
+        instrument_answer = final_answer.get("instrument_agent_answer")
+        action_answer = final_answer.get("action_agent_answer")
+        predicted = extract_option_letter(action_answer)
+        instrument_name = extract_answer(instrument_answer, "instrument") or parsed.get("instrument_name")
+        action_name = extract_answer(action_answer, "action") or parsed.get("action_name")
+        metrics = final_answer.get("metrics")
+    else:
+        predicted = extract_option_letter(final_answer) if isinstance(final_answer, str) else None
+        instrument_name = extract_answer(final_answer, "instrument") if route.get("route") == "instrument recognition" else None
+        action_name = None
+        metrics = None
+
+    ground_truth = row.get("ground_truth", None)
+    truth_option = ground_truth_option(ground_truth, row.get("question_mcq", ""))
+    has_truth = ground_truth is not None and str(ground_truth) not in ("", "nan")
+    return {
+        "row": int(index),
+        "image_path": str(row.get("image_path", "")),
+        "cot_process": str(row.get("COT_Process", "")),
+        "question": str(row.get("question_mcq", "")),
+        "ground_truth": str(ground_truth) if has_truth else None,
+        "ground_truth_option": truth_option,
+        "route": route.get("route"),
+        "department": route.get("department"),
+        "agent": route.get("agent"),
+        "predicted_option": predicted,
+        "correct": (predicted == truth_option) if truth_option else None,
+        "instrument_name": instrument_name,
+        "action_name": action_name,
+        "metrics": json.dumps(metrics, default=str) if metrics is not None else None,
+        "refinements": max(0, len(candidates) - 1) if candidates else 0,
+        "stage_latency_s": json.dumps(result.stage_latencies()),
+        "total_latency_s": round((result.finished or time.perf_counter()) - result.started, 3),
+        "llm_calls": result.llm_calls,
+        "prompt_tokens": result.prompt_tokens,
+        "completion_tokens": result.completion_tokens,
+        "status": "failed" if error is not None else "done",
+        "error": str(error) if error is not None else None,
+    }
+
+
+# =============================================================================
+# Sink
+# =============================================================================
+class ResultsSink:
+    """
+    Streams result records to a .jsonl file (one flushed line per row) or a
+    .parquet file (one row group per RESULTS_ROW_GROUP_SIZE records).
+    When resuming, an existing JSONL file is appended to, and an existing
+    Parquet file is kept with the new records going to the next free
+    "<name>.partN.parquet". Otherwise the previous results are moved aside, so
+    a new run never merges into an old run's summary.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._writer = None
+        self._file = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not resume:
+            self._move_previous_results()
+
+        if path.endswith(".parquet"):
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("Writing Parquet results needs pyarrow (pip install pyarrow); use a .jsonl path instead.")
+            stem = path[:-len(".parquet")]
+            part = 0
+            while os.path.exists(self.path):
+                part += 1
+                self.path = f"{stem}.part{part}.parquet"
+        else:
+            self._file = open(path, "a", encoding="utf-8")
+
+    def _move_previous_results(self):
+        paths = [self.path]
+        if self.path.endswith(".parquet"):
+            paths += sorted(glob.glob(f"{self.path[:-len('.parquet')]}.part*.parquet"))
+        suffix = time.strftime("%Y%m%d-%H%M%S")
+        for path in paths:
+            if os.path.exists(path):
+                backup = f"{path}.{suffix}.bak"
+                os.replace(path, backup)
+                print(f"[Results] Previous results moved to {backup}")
+
+    @staticmethod
+    def _schema():
+        import pyarrow as pa
+        types = {"int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(), "string": pa.string()}
+        return pa.schema([(name, types[kind]) for name, kind in RESULT_COLUMNS])
+
+    def _flush_row_group(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._buffer:
+            return
+        schema = self._schema()
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(pa.Table.from_pylist(self._buffer, schema=schema))
+        self._buffer = []
+
+    def write(self, record):
+        with self._lock:
+            self.records += 1
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+            else:
+                self._buffer.append(record)
+                if len(self._buffer) >= RESULTS_ROW_GROUP_SIZE:
+                    self._flush_row_group()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            else:
+                self._flush_row_group()
+                if self._writer is not None:
+                    self._writer.close()
+
+
+# =============================================================================
+# Summary
+# =============================================================================
+def load_results(path):
+    """
+    Loads a results file (and its Parquet parts) into a DataFrame, keeping the
+    last record of each row (rows may be recorded again after --retry_failed).
+    """
+    import pandas as pd
+    if path.endswith(".parquet"):
+        stem = path[:-len(".parquet")]
+        paths = [path] + sorted(glob.glob(f"{stem}.part*.parquet"))
+        df = pd.concat([pd.read_parquet(part) for part in paths if os.path.exists(part)], ignore_index=True)
+    else:
+        df = pd.read_json(path, lines=True)
+    return df.drop_duplicates(subset="row", keep="last")
+
+
+def summarize_results(df):
+    """
+    Accuracy, latency and token totals per COT_Process (plus an "overall" row).
+    Accuracy is computed over rows with a recognisable ground-truth option.
+    """
+    import pandas as pd
+
+    def summarize(group):
+        scored = group[group["correct"].notna()]
+        return pd.Series({
+            "rows": len(group),
+            "failed": int((group["status"] == "failed").sum()),
+            "scored": len(scored),
+            "correct": int(scored["correct"].astype(bool).sum()),
+            "accuracy": round(scored["correct"].astype(bool).mean(), 4) if len(scored) else None,
+            "mean_latency_s": round(group["total_latency_s"].mean(), 2),
+            "mean_refinements": round(group["refinements"].mean(), 2),
+            "prompt_tokens": int(group["prompt_tokens"].sum()),
+            "completion_tokens": int(group["completion_tokens"].sum()),
+        })
+
+    per_process = df.groupby("cot_process").apply(summarize, include_groups=False)
+    per_process.loc["overall"] = summarize(df)
+    return per_process
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a Main.py results file (accuracy per COT_Process).")
+    parser.add_argument("results", type=str, help="results.jsonl or results.parquet written by Main.py.")
+    parser.add_argument("--csv", type=str, default=None, help="Optional path to save the summary as CSV.")
+    args = parser.parse_args()
+
+    summary = summarize_results(load_results(args.results))
+    print(summary.to_string())
+    if args.csv:
+        summary.to_csv(args.csv)
+        print(f"[Results] Summary saved to {args.csv}")
@@ -0,0 +1,232 @@
+import os
+import re
+import pickle
+import threading
+from Utils.Trace_utils import traced
+
+# =============================================================================
+# Local question router
+# =============================================================================
+# SurgCoTBench questions follow a handful of templates, so most of them can be
+# routed to a leaf agent without any network call. Rules come first; an
+# optional TF-IDF + logistic regression model trained on labelled datasets
+# handles the rest. The orchestrator falls back to the GPT classifiers only
+# when neither is confident enough. The model is a pickle, so it is only loaded
+# from a path given explicitly (SURGRAW_ROUTER_MODEL or Main.py --router_model).
+
+LEAF_ROUTES = [
+    "instrument recognition",
+    "action recognition",
+    "action prediction",
+    "outcome",
+    "patient detail",
+]
+
+ROUTE_DEPARTMENT = {
+    "instrument recognition": "vision-based",
+    "action recognition": "vision-based",
+    "action prediction": "knowledge-based",
+    "outcome": "knowledge-based",
+    "patient detail": "knowledge-based",
+}
+
+ROUTER_MODEL_PATH = os.environ.get("SURGRAW_ROUTER_MODEL") or None
+ROUTER_CONFIDENCE_THRESHOLD = float(os.environ.get("SURGRAW_ROUTER_THRESHOLD", "0.8"))
+
+# (pattern, route, weight) - matched against the lower-cased question stem
+ROUTING_RULES = [
+    (r"ongoing action|action (of|being performed|performed by)|what is the .*instrument doing|surgical action", "action recognition", 3.0),
+    (r"\b(cutting|grasping|suturing|cauteri[sz]ation|retraction)\b", "action recognition", 0.5),
+    (r"most likely surgical instrument|which (surgical )?(instrument|tool)|identify the (surgical )?(instrument|tool)|name of the (instrument|tool)", "instrument recognition", 3.0),
+    (r"\b(instrument|tool)\b", "instrument recognition", 0.5),
+    (r"\bnext (step|phase|action|procedure)\b|\bwhat (will|should) .*\bnext\b|\bafter (this|the current)\b|\bsurgical plan\b|\bplan(ned)? to\b", "action prediction", 3.0),
+    (r"\bnext\b|\bsubsequent\b|\bfollowing step\b", "action prediction", 1.0),
+    (r"\boutcome\b|\bsignifican(t|ce)\b|\bpurpose of\b|\bwhy is\b|\bexpected (result|benefit)\b|\bprognosis\b|\bcomplication", "outcome", 3.0),
+    (r"\bpatient\b.*\b(age|gender|sex|illness|disease|diagnos|condition|status|history)|\b(age|gender|sex|illness|disease|diagnosis|condition|status|history) of the patient\b|\bpatient detail\b", "patient detail", 3.0),
+    (r"\bpatient\b", "patient detail", 1.0),
+]
+_COMPILED_RULES = [(re.compile(pattern), route, weight) for pattern, route, weight in ROUTING_RULES]
+
+# Aliases used in the COT_Process column of our datasets
+COT_PROCESS_ALIASES = {
+    "instrument recognition": "instrument recognition",
+    "instrument identification": "instrument recognition",
+    "action recognition": "action recognition",
+    "action prediction": "action prediction",
+    "surgical plan": "action prediction",
+    "outcome": "outcome",
+    "surgical outcome": "outcome",
+    "outcome assessment": "outcome",
+    "patient detail": "patient detail",
+    "patient details": "patient detail",
+    "patient data extraction": "patient detail",
+}
+
+_router_model = None
+_router_model_loaded = False
+_router_model_lock = threading.Lock()
+
+
+def _question_stem(question):
+    """
+    Returns the lower-cased question without its multiple-choice options, so
+    option words (e.g. "Grasping") do not dominate the rules.
+    """
+    stem = str(question).lower()
+    if "?" in stem:
+        stem = stem.split("?")[0]
+    return stem
+
+
+def normalize_route(label):
+    """
+    Maps a COT_Process label or classifier output to a leaf route, or None.
+    """
+    key = str(label).strip().lower().replace("_", " ")
+    return COT_PROCESS_ALIASES.get(key)
+
+
+def rule_route(question):
+    """
+    Returns (route, confidence) from the routing rules; confidence is the share
+    of the total rule weight won by the best route, scaled down when only weak
+    rules fire.
+    """
+    stem = _question_stem(question)
+    scores = {}
+    for pattern, route, weight in _COMPILED_RULES:
+        if pattern.search(stem):
+            scores[route] = scores.get(route, 0.0) + weight
+    if not scores:
+        return None, 0.0
+    best_route = max(scores, key=scores.get)
+    share = scores[best_route] / sum(scores.values())
+    strength = min(1.0, scores[best_route] / 3.0)
+    return best_route, round(share * strength, 3)
+
+
+# =============================================================================
+# Optional trained classifier
+# =============================================================================
+def load_training_examples(xlsx_files=(), results_files=()):
+    """
+    Collects (question, route) pairs labelled with the ground-truth COT_Process,
+    from datasets and from Main.py results files (their cot_process column).
+    The router's own past decisions are never used as labels.
+    """
+    examples = []
+    for xlsx_file in xlsx_files:
+        import pandas as pd
+        df = pd.read_excel(xlsx_file)
+        for _, row in df.iterrows():
+            route = normalize_route(row.get("COT_Process", ""))
+            if route:
+                examples.append((str(row["question_mcq"]), route))
+
+    for results_file in results_files:
+        from Utils.Results_utils import load_results
+        df = load_results(results_file)
+        for _, record in df.iterrows():
+            route = normalize_route(record.get("cot_process", ""))
+            if route:
+                examples.append((str(record["question"]), route))
+    return examples
+
+
+def train_router_model(examples, model_path="router_model.pkl"):
+    """
+    Trains a TF-IDF + logistic regression router and pickles it to model_path.
+    """
+    from sklearn.pipeline import make_pipeline
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    questions = [_question_stem(question) for question, _ in examples]
+    routes = [route for _, route in examples]
+    model = make_pipeline(
+        TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=1),
+        LogisticRegression(max_iter=1000, class_weight="balanced"),
+    )
+    model.fit(questions, routes)
+    with open(model_path, "wb") as f:
+        pickle.dump(model, f)
+    print(f"[Router] Trained on {len(examples)} questions, saved to {model_path}")
+    return model
+
+
+def _load_router_model(model_path):
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    print(f"[Router] Loaded the trained router from {model_path}")
+    return model
+
+
+def enable_router_model(model_path):
+    """
+    Loads the trained router model from model_path (a pickle: only load files
+    you trust) and uses it for every later local routing decision.
+    """
+    global _router_model, _router_model_loaded
+    model = _load_router_model(model_path)
+    with _router_model_lock:
+        _router_model, _router_model_loaded = model, True
+    return model
+
+
+def get_router_model():
+    """
+    Returns the trained router model, or None if no model path was given
+    (SURGRAW_ROUTER_MODEL or enable_router_model()).
+    """
+    global _router_model, _router_model_loaded
+    if not _router_model_loaded and ROUTER_MODEL_PATH is not None:
+        with _router_model_lock:
+            if not _router_model_loaded:
+                _router_model = _load_router_model(ROUTER_MODEL_PATH)
+                _router_model_loaded = True
+    return _router_model
+
+
+def model_route(question):
+    model = get_router_model()
+    if model is None:
+        return None, 0.0
+    probabilities = model.predict_proba([_question_stem(question)])[0]
+    best = probabilities.argmax()
+    return model.classes_[best], round(float(probabilities[best]), 3)
+
+
+@traced("stage")
+def route_question_locally(question, threshold=ROUTER_CONFIDENCE_THRESHOLD):
+    """
+    Routes a question to a leaf agent without network I/O.
+    Returns (route, confidence, method); route is None when neither the rules
+    nor the trained model reach `threshold`.
+    """
+    route, confidence = rule_route(question)
+    if route is not None and confidence >= threshold:
+        return route, confidence, "rules"
+
+    learned_route, learned_confidence = model_route(question)
+    if learned_route is not None and learned_confidence >= threshold:
+        return learned_route, learned_confidence, "model"
+
+    # Not confident: report the best guess so callers can log it
+    if learned_confidence > confidence:
+        return None, learned_confidence, "model"
+    return None, confidence, "rules"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the local question router.")
+    parser.add_argument("--xlsx_files", type=str, nargs="*", default=[], help="Datasets with question_mcq and COT_Process columns.")
+    parser.add_argument("--results_files", type=str, nargs="*", default=[], help="Main.py results files (.jsonl/.parquet); labelled by their cot_process column.")
+    parser.add_argument("--model_path", type=str, default="router_model.pkl", help="Where to save the model.")
+    args = parser.parse_args()
+
+    training_examples = load_training_examples(args.xlsx_files, args.results_files)
+    if not training_examples:
+        raise SystemExit("[Router] No training examples found.")
+    train_router_model(training_examples, args.model_path)
@@ -0,0 +1,151 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# =============================================================================
+# Streaming events
+# =============================================================================
+# Inside a `stream_events(on_event)` block, vision calls (gpt4_vision_caption)
+# stream their completion and report it to `on_event` as plain dicts:
+#   {"type": "token",  "source": "action_recognition", "text": "<delta>"}
+#   {"type": "answer", "source": "action_recognition", "option": "D", "text": "<text so far>"}
+#   {"type": "done",   "source": "action_recognition", "text": "<full answer>"}
+# The source is the prompt template name of the call (see Utils/Prompt_utils.py).
+# Listeners nest: events reach the outer listener first, then the inner one,
+# which may react with events of its own (e.g. the debate's "consensus"). The
+# context is propagated into run_parallel() workers, so callbacks may run on
+# several threads (calls to one listener are serialized).
+#
+# SURGRAW_STREAM=1 streams vision calls even without a listener (e.g. to let
+# the debate react to early answers in batch runs).
+
+STREAM_VISION = os.environ.get("SURGRAW_STREAM", "0") != "0"
+
+_listener = ContextVar("stream_listener", default=None)
+
+# An answer is confirmed mid-stream only by a completed line that states the
+# final answer: the "The answer is: ..." statement the agent prompts end with,
+# or "Final answer: ...". Anything else (e.g. "one could argue the answer is
+# (B)" inside a reasoning chain) waits for the end of the stream, where the
+# last answer in the text wins as in Utils.Debate_utils.extract_option_letter.
+_FINAL_STATEMENT = re.compile(r"^[\s*_#>\-]*(?:the\s+answer\s+is|final\s+answer)\b", re.IGNORECASE)
+
+
+class StreamListener:
+    """
+    Forwards stream events to the enclosing listener, then to `on_event`.
+    """
+
+    def __init__(self, on_event, parent=None):
+        self.on_event = on_event
+        self.parent = parent
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        if self.parent is not None:
+            self.parent.emit(event)
+        with self._lock:
+            self.on_event(event)
+
+
+@contextmanager
+def stream_events(on_event):
+    """
+    Streams the vision calls made inside this block, reporting token, answer and
+    done events to `on_event(event)`. Yields the listener.
+    """
+    listener = StreamListener(on_event, parent=_listener.get())
+    token = _listener.set(listener)
+    try:
+        yield listener
+    finally:
+        _listener.reset(token)
+
+
+def get_stream_listener():
+    return _listener.get()
+
+
+def streaming_enabled() -> bool:
+    return STREAM_VISION or _listener.get() is not None
+
+
+class AnswerDetector:
+    """
+    Accumulates streamed text and calls on_answer(option, text) once: as soon as
+    a line stating the final answer is complete, or at close() from the last
+    answer in the full text.
+    """
+
+    def __init__(self, on_answer=None):
+        self.on_answer = on_answer
+        self.option = None
+        self._parts = []
+        self._line = ""
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def feed(self, delta):
+        self._parts.append(delta)
+        if self.option is not None:
+            return
+        *lines, self._line = (self._line + delta).split("\n")
+        for line in lines:
+            if _FINAL_STATEMENT.match(line) and self._confirm(line):
+                return
+
+    def close(self):
+        """
+        Marks the end of the stream; confirms the answer from the full text if no
+        final statement was seen.
+        """
+        if self.option is None:
+            self._confirm(self.text)
+
+    def _confirm(self, text):
+        from Utils.Debate_utils import extract_option_letter
+        option = extract_option_letter(text)
+        if option is None:
+            return False
+        self.option = option
+        if self.on_answer is not None:
+            self.on_answer(self.option, self.text)
+        return True
+
+
+def stream_handlers(source, on_token=None, on_answer=None):
+    """
+    Returns (on_delta, finish) for one streamed call: on_delta(text) reports the
+    delta to `on_token` and the active listener and watches for the answer;
+    finish(full_text) confirms a pending answer and sends the done event. Both are
+    safe to call without a listener.
+    """
+    listener = _listener.get()
+
+    def answered(option, text):
+        if on_answer is not None:
+            on_answer(option, text)
+        if listener is not None:
+            listener.emit({"type": "answer", "source": source, "option": option, "text": text})
+
+    detector = AnswerDetector(answered)
+
+    def on_delta(delta):
+        if not delta:
+            return
+        if on_token is not None:
+            on_token(delta)
+        if listener is not None:
+            listener.emit({"type": "token", "source": source, "text": delta})
+        detector.feed(delta)
+
+    def finish(text):
+        detector.close()
+        if listener is not None:
+            listener.emit({"type": "done", "source": source, "text": text})
+
+    return on_delta, finish
@@ -0,0 +1,177 @@
+import threading
+from collections import defaultdict
+from Utils.Trace_utils import set_span_attributes
+
+# =============================================================================
+# Token estimation
+# =============================================================================
+# Used to reserve tokens-per-minute budget before a request is sent. Counts
+# come from tiktoken when it is installed; otherwise we fall back to the usual
+# ~4 characters per token heuristic, which is close enough for budgeting.
+
+# Approximate cost of one image part (high detail, 512px tiles)
+IMAGE_TOKENS = 765
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Completion length assumed when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _get_encoding(model):
+    """
+    Returns the tiktoken encoding for `model` (o200k_base for unknown models),
+    or None when tiktoken is not installed.
+    """
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+            except ImportError:
+                _encodings[model] = None
+            else:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("o200k_base")
+        return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o") -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_message_tokens(messages, model="gpt-4o") -> int:
+    """
+    Estimates the prompt tokens of a chat request; image parts count as IMAGE_TOKENS.
+    """
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    total += IMAGE_TOKENS
+                else:
+                    total += count_tokens(part.get("text", ""), model)
+        else:
+            total += count_tokens(content or "", model)
+    return total
+
+
+def estimate_request_tokens(model, messages, params=None) -> int:
+    """
+    Estimates the total (prompt + completion) tokens a request will consume.
+    """
+    params = params or {}
+    completion = params.get("max_tokens") or params.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+    return estimate_message_tokens(messages, model) + completion * params.get("n", 1)
+
+
+# =============================================================================
+# Prompt budgets
+# =============================================================================
+# Variable-length prompt sections (RAG context, candidate answers) are fit into
+# a token budget before they are pasted into a prompt. Every cut is printed
+# with a [Budget] tag (so it lands in the row's log), attached to the current
+# trace span and counted in get_budget_stats(), so its quality impact can be
+# audited afterwards.
+
+# A block is only truncated (rather than dropped) if at least this many tokens remain
+MIN_TRUNCATED_BLOCK_TOKENS = 32
+TRUNCATION_MARKER = " [...]"
+
+_budget_lock = threading.Lock()
+_budget_stats = defaultdict(lambda: {"calls": 0, "cut": 0, "truncated_blocks": 0, "dropped_blocks": 0,
+                                     "tokens_before": 0, "tokens_after": 0})
+
+
+def truncate_to_tokens(text, max_tokens, model="gpt-4o") -> str:
+    """
+    Returns `text` cut to at most `max_tokens` tokens (TRUNCATION_MARKER included).
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARKER, model))
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:keep * 4] + TRUNCATION_MARKER
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:keep]) + TRUNCATION_MARKER
+
+
+def fit_blocks_to_budget(name, blocks, max_tokens, model="gpt-4o", separator="\n\n", equal_share=False) -> list:
+    """
+    Fits `blocks` (ranked best first) into `max_tokens`, counting `separator`
+    between blocks. By default whole blocks are kept while they fit, the next
+    one is truncated to the remaining budget and the rest are dropped. With
+    equal_share, no block is dropped: each one is truncated to an equal share.
+    Returns the kept blocks; a max_tokens of None or 0 disables the budget.
+    """
+    blocks = list(blocks)
+    separator_tokens = count_tokens(separator, model)
+    sizes = [count_tokens(block, model) for block in blocks]
+    before = sum(sizes) + separator_tokens * max(0, len(blocks) - 1)
+    if not max_tokens or before <= max_tokens:
+        _record_budget(name, max_tokens, len(blocks), before, before, 0, 0)
+        return blocks
+
+    kept, truncated, dropped = [], 0, 0
+    if equal_share:
+        share = max(1, (max_tokens - separator_tokens * (len(blocks) - 1)) // len(blocks))
+        for block, size in zip(blocks, sizes):
+            kept.append(truncate_to_tokens(block, share, model) if size > share else block)
+            truncated += size > share
+    else:
+        used = 0
+        for block, size in zip(blocks, sizes):
+            cost = size + (separator_tokens if kept else 0)
+            if used + cost <= max_tokens:
+                kept.append(block)
+                used += cost
+                continue
+            remaining = max_tokens - used - (separator_tokens if kept else 0)
+            if remaining >= MIN_TRUNCATED_BLOCK_TOKENS:
+                kept.append(truncate_to_tokens(block, remaining, model))
+                used = max_tokens
+                truncated += 1
+            else:
+                dropped += 1
+
+    after = sum(count_tokens(block, model) for block in kept) + separator_tokens * max(0, len(kept) - 1)
+    _record_budget(name, max_tokens, len(blocks), before, after, truncated, dropped)
+    return kept
+
+
+def _record_budget(name, max_tokens, blocks, before, after, truncated, dropped):
+    with _budget_lock:
+        stats = _budget_stats[name]
+        stats["calls"] += 1
+        stats["tokens_before"] += before
+        stats["tokens_after"] += after
+        if truncated or dropped:
+            stats["cut"] += 1
+            stats["truncated_blocks"] += truncated
+            stats["dropped_blocks"] += dropped
+    if truncated or dropped:
+        print(f"[Budget] {name}: {before} -> {after} tokens (budget {max_tokens}); "
+              f"truncated {truncated}, dropped {dropped} of {blocks} block(s)")
+        set_span_attributes(**{f"{name}_budget": {
+            "budget": max_tokens, "tokens_before": before, "tokens_after": after,
+            "blocks": blocks, "truncated": truncated, "dropped": dropped,
+        }})
+
+
+def get_budget_stats() -> dict:
+    """
+    Per budget name: calls, calls with a cut, truncated/dropped blocks and token totals.
+    """
+    with _budget_lock:
+        return {name: dict(stats) for name, stats in _budget_stats.items()}
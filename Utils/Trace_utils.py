@@ -0,0 +1,223 @@
+import os
+import json
+import math
+import time
+import functools
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# =============================================================================
+# Lightweight span tracing
+# =============================================================================
+# A span is written for every row, orchestrator stage, agent function and LLM
+# call, as one JSON line in a local trace file:
+#   {"trace_id", "span_id", "parent_id", "name", "kind", "start", "duration_s", "attrs"}
+# LLM spans carry model, prompt/completion tokens (and prompt tokens served from
+# the provider's prefix cache), bytes uploaded, retries and cache status.
+# Tracing is off unless a trace file is set (Main.py --trace or
+# SURGRAW_TRACE_FILE); spans then cost one ContextVar lookup.
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "attrs")
+
+    def __init__(self, name, kind, parent, attrs):
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.attrs = attrs
+
+
+class Tracer:
+    """
+    Appends finished spans to a JSONL trace file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.spans = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, span, duration):
+        line = json.dumps({
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "kind": span.kind,
+            "start": span.start,
+            "duration_s": round(duration, 6),
+            "attrs": span.attrs,
+        }, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.spans += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_tracer = None
+
+
+def enable_tracing(path):
+    global _tracer
+    _tracer = Tracer(path)
+    print(f"[Trace] Writing spans to {path}")
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+@contextmanager
+def span(name, kind="stage", **attrs):
+    """
+    Records a span around the block. Yields the Span (None when tracing is off).
+    Exceptions are recorded in attrs["error"] and re-raised.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    current = Span(name, kind, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.write(current, time.perf_counter() - started)
+
+
+def traced(kind="stage", name=None):
+    """
+    Decorator that records a span around every call of the function.
+    """
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with span(span_name, kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_span_attributes(**attrs):
+    """
+    Adds attributes to the innermost active span (no-op when tracing is off).
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+# =============================================================================
+# Summary
+# =============================================================================
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def load_spans(path):
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+
+def summarize_spans(spans):
+    """
+    Per (kind, name): count, p50/p95/total latency, tokens, bytes uploaded,
+    retries and cache hits. LLM calls are grouped per model and calling span
+    (e.g. "llm gpt-3.5-turbo <- evaluate_consensus"). Returns rows sorted by
+    total time, slowest first.
+    """
+    names = {record["span_id"]: record["name"] for record in spans}
+    groups = defaultdict(list)
+    for record in spans:
+        name = record["name"]
+        if record["kind"] == "llm" and record.get("parent_id") in names:
+            name = f"{name} <- {names[record['parent_id']]}"
+        groups[(record["kind"], name)].append(record)
+
+    rows = []
+    for (kind, name), records in groups.items():
+        durations = sorted(record["duration_s"] for record in records)
+        attrs = [record.get("attrs") or {} for record in records]
+        rows.append({
+            "kind": kind,
+            "name": name,
+            "count": len(records),
+            "p50_s": round(percentile(durations, 0.50), 3),
+            "p95_s": round(percentile(durations, 0.95), 3),
+            "total_s": round(sum(durations), 3),
+            "prompt_tokens": sum(a.get("prompt_tokens", 0) for a in attrs),
+            "cached_prompt_tokens": sum(a.get("cached_tokens", 0) for a in attrs),
+            "completion_tokens": sum(a.get("completion_tokens", 0) for a in attrs),
+            "bytes_uploaded": sum(a.get("bytes_uploaded", 0) for a in attrs),
+            "retries": sum(a.get("retries", 0) for a in attrs),
+            "cache_hits": sum(1 for a in attrs if a.get("cache") in ("hit", "journal")),
+            "errors": sum(1 for a in attrs if a.get("error")),
+        })
+    rows.sort(key=lambda row: row["total_s"], reverse=True)
+    return rows
+
+
+def print_span_summary(rows):
+    header = f"{'kind':<6} {'name':<56} {'count':>6} {'p50 s':>8} {'p95 s':>8} {'total s':>9} {'prompt tok':>11} {'compl tok':>10} {'MB up':>8} {'retries':>7} {'cached':>6}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['kind']:<6} {row['name'][:56]:<56} {row['count']:>6} {row['p50_s']:>8.3f} {row['p95_s']:>8.3f} "
+              f"{row['total_s']:>9.2f} {row['prompt_tokens']:>11} {row['completion_tokens']:>10} "
+              f"{row['bytes_uploaded'] / 1e6:>8.2f} {row['retries']:>7} {row['cache_hits']:>6}")
+
+
+if os.environ.get("SURGRAW_TRACE_FILE"):
+    enable_tracing(os.environ["SURGRAW_TRACE_FILE"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a trace file: p50/p95 latency, tokens and bytes per stage.")
+    parser.add_argument("trace_file", type=str, help="Trace JSONL written with Main.py --trace.")
+    parser.add_argument("--json", type=str, default=None, help="Optional path to save the summary as JSON.")
+    args = parser.parse_args()
+
+    summary = summarize_spans(load_spans(args.trace_file))
+    print_span_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=4)
+        print(f"[Trace] Summary saved to {args.json}")
@@ -0,0 +1,84 @@
+import pytest
+
+import Utils.Debate_utils as Debate_utils
+from Utils.Debate_utils import extract_option_letter, extract_answer, select_best_action_output
+
+
+@pytest.mark.parametrize("response, letter", [
+    ("Chain 1: ...\nThe answer is: Option (D)", "D"),
+    ("**The answer is: Option D**", "D"),
+    ("the answer is option (c).", "C"),
+    ("The answer is: (B)", "B"),
+    ("The answer is: A.", "A"),
+    ("Final answer: Option (G)", "G"),
+    ("Final Answer: (e)", "E"),
+])
+def test_extracts_option_letter(response, letter):
+    assert extract_option_letter(response) == letter
+
+
+@pytest.mark.parametrize("response", [
+    "",
+    None,
+    "Chain 1: the instrument is unclear.",
+    "The answer is: Option ()",
+])
+def test_no_option_letter(response):
+    assert extract_option_letter(response) is None
+
+
+def test_last_match_wins_within_a_pattern():
+    response = (
+        "Chain 1: at first glance the answer is: Option (A).\n"
+        "Chain 2: on closer inspection ...\n"
+        "The answer is: Option (C)"
+    )
+    assert extract_option_letter(response) == "C"
+
+
+def test_last_match_wins_across_patterns():
+    # An early "answer is (B)" must not beat a later final line in another format
+    response = (
+        "Chain 1: one could argue the answer is (B) because of the jaws.\n"
+        "Chain 2: the tip is a hook, which rules that out.\n"
+        "Final answer: Option (E)"
+    )
+    assert extract_option_letter(response) == "E"
+
+
+def test_earlier_option_phrase_does_not_beat_later_plain_letter():
+    response = (
+        "Chain 1: the answer is option (A) only if the jaws are closed.\n"
+        "Chain 2: the jaws are open.\n"
+        "The answer is: D."
+    )
+    assert extract_option_letter(response) == "D"
+
+
+def test_extract_answer_maps_letter_to_name():
+    assert extract_answer("The answer is: Option (C)", "instrument") == "Needle Driver"
+    assert extract_answer("The answer is: Option (C)", "action") == "Cauterization"
+
+
+def test_extract_answer_reads_name_without_letter():
+    assert extract_answer("The answer is: the needle driver", "instrument") == "Needle Driver"
+    assert extract_answer("The answer is: applying clip", "action") == "Applying Clip"
+
+
+def test_extract_answer_returns_none_when_unstated():
+    assert extract_answer("Chain 1: the tissue is retracted.", "action") is None
+
+
+def test_selection_budget_never_cuts_the_metrics(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(Debate_utils, "call_gpt35Turbo_api", lambda prompt, **params: prompts.append(prompt) or "2")
+    monkeypatch.setattr(Debate_utils, "SELECTION_CONTEXT_TOKENS", 200)
+    long_chain = "Chain 1: " + "the jaws close on the tissue " * 200 + "\nThe answer is: Option (C)"
+    candidates = [{"parsed_instrument_name": "Forceps", "parsed_action_name": "Grasping", "action_answer": long_chain,
+                   "metrics": {"kg_consistency": True, "Coherence": score, "Collaborative_Synergy": score}}
+                  for score in (3, 5)]
+
+    for compact in (True, False):
+        monkeypatch.setattr(Debate_utils, "COMPACT_CANDIDATES", compact)
+        assert select_best_action_output(candidates) is candidates[1]
+        assert "'Coherence': 3" in prompts[-1] and "'Coherence': 5" in prompts[-1]
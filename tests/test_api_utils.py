@@ -0,0 +1,180 @@
+import threading
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import BadRequestError, InternalServerError, RateLimitError
+
+import Utils.API_utils as API_utils
+from Utils.Cache_utils import ResponseCache
+from Utils.Prompt_utils import render_prompt
+
+
+def test_one_client_is_shared_across_threads(monkeypatch):
+    monkeypatch.setattr(API_utils, "_client", None)
+    clients = []
+    workers = [threading.Thread(target=lambda: clients.append(API_utils.get_openai_client())) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len({id(client) for client in clients}) == 1
+    client = clients[0]
+    assert client.max_retries == API_utils.OPENAI_MAX_RETRIES
+    assert client.timeout == API_utils.OPENAI_TIMEOUT
+
+
+def test_async_client_is_created_once(monkeypatch):
+    monkeypatch.setattr(API_utils, "_async_client", None)
+    assert API_utils.get_async_openai_client() is API_utils.get_async_openai_client()
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+def test_mime_type_comes_from_the_file_content(tmp_path):
+    # A PNG saved with a .jpg extension is still sent as PNG
+    path = tmp_path / "frame.jpg"
+    path.write_bytes(PNG_BYTES)
+    assert API_utils.encode_image_data_url(str(path)).startswith("data:image/png;base64,")
+
+    unknown = tmp_path / "frame.gif"
+    unknown.write_bytes(b"not an image header")
+    assert API_utils.get_image_mime_type(str(unknown)) == "image/gif"
+
+
+def test_encoded_image_is_memoized_until_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "frame.png"
+    path.write_bytes(PNG_BYTES)
+    reads = []
+    real_open = open
+
+    def counting_open(file, mode="r", *args, **kwargs):
+        if str(file) == str(path):
+            reads.append(mode)
+        return real_open(file, mode, *args, **kwargs)
+    monkeypatch.setattr("builtins.open", counting_open)
+
+    first = API_utils.encode_image(str(path))
+    assert API_utils.encode_image(str(path)) == first
+    assert len(reads) == 1
+
+    path.write_bytes(PNG_BYTES + b"\x01")
+    assert API_utils.encode_image(str(path)) != first
+    assert len(reads) == 2
+
+
+def test_image_cache_stays_under_its_byte_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(API_utils, "_image_cache", API_utils.OrderedDict())
+    monkeypatch.setattr(API_utils, "_image_cache_bytes", 0)
+    monkeypatch.setattr(API_utils, "IMAGE_CACHE_MAX_BYTES", 200)
+    for number in range(5):
+        path = tmp_path / f"frame_{number}.png"
+        path.write_bytes(PNG_BYTES + bytes([number]) * 60)
+        API_utils.encode_image(str(path))
+    assert API_utils._image_cache_bytes <= 200
+    assert API_utils._image_cache_bytes == sum(len(data) for _, data in API_utils._image_cache.values())
+
+
+def _completion(*texts):
+    # Choices may come back out of order; their index says where they belong
+    choices = [SimpleNamespace(index=index, message=SimpleNamespace(content=text))
+               for index, text in reversed(list(enumerate(texts)))]
+    return SimpleNamespace(choices=choices)
+
+
+def test_samples_come_from_one_request_and_are_cached_together(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+    monkeypatch.setattr(API_utils, "get_response_cache", lambda: cache)
+    requests = []
+
+    def fake_create(model, messages, timeout, params):
+        requests.append(params)
+        return _completion("first", "second", "third")
+    monkeypatch.setattr(API_utils, "_create_chat_completion", fake_create)
+
+    messages = [{"role": "user", "content": "describe"}]
+    assert API_utils.chat_completion_samples("gpt-4o-latest", messages, 3) == ["first", "second", "third"]
+    assert API_utils.chat_completion_samples("gpt-4o-latest", messages, 3) == ["first", "second", "third"]
+    assert requests == [{"n": 3}]
+
+
+def _status_error(error_class, status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return error_class("error", response=response, body=None)
+
+
+def test_scheduler_waits_for_the_request_budget():
+    scheduler = API_utils.RateLimitScheduler(rpm_limits={"*": 2}, window_seconds=60.0)
+    assert scheduler.try_acquire("gpt-4o-latest", 10)[0] is not None
+    assert scheduler.try_acquire("gpt-4o-latest", 10)[0] is not None
+    reservation, wait = scheduler.try_acquire("gpt-4o-latest", 10)
+    assert reservation is None and 59 < wait <= 60
+    # Budgets are per model
+    assert scheduler.try_acquire("gpt-3.5-turbo", 10)[0] is not None
+
+
+def test_scheduler_waits_until_enough_tokens_are_freed():
+    scheduler = API_utils.RateLimitScheduler(tpm_limits={"gpt-4o-latest": 1000}, window_seconds=60.0)
+    first, _ = scheduler.try_acquire("gpt-4o-latest", 600)
+    reservation, wait = scheduler.try_acquire("gpt-4o-latest", 600)
+    assert reservation is None and wait > 59
+
+    # The API reported fewer tokens than estimated, so the request now fits
+    scheduler.settle(first, SimpleNamespace(usage=SimpleNamespace(total_tokens=300)))
+    assert scheduler.try_acquire("gpt-4o-latest", 600)[0] is not None
+
+
+@pytest.mark.parametrize("headers, seconds", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "7"}, 7.0),
+    ({}, None),
+])
+def test_retry_after_header(headers, seconds):
+    assert API_utils._retry_after_seconds(_status_error(RateLimitError, 429, headers)) == seconds
+
+
+def test_retry_after_http_date():
+    in_30s = formatdate(time.time() + 30, usegmt=True)
+    seconds = API_utils._retry_after_seconds(_status_error(RateLimitError, 429, {"retry-after": in_30s}))
+    assert 28 <= seconds <= 31
+
+
+def test_retry_delay_honours_retry_after(monkeypatch):
+    scheduler = API_utils.RateLimitScheduler()
+    monkeypatch.setattr(API_utils, "_scheduler", scheduler)
+    monkeypatch.setattr(API_utils, "BACKOFF_MAX_SECONDS", 1.0)
+
+    delay = API_utils._retry_delay("gpt-4o-latest", _status_error(RateLimitError, 429, {"retry-after": "20"}), 0)
+    assert delay == 20.0
+    assert scheduler.stats()["gpt-4o-latest"]["rate_limited"] == 1
+    # The cooldown holds back the next request
+    assert scheduler.try_acquire("gpt-4o-latest", 10)[1] > 19
+
+
+def test_errors_that_are_not_retried(monkeypatch):
+    monkeypatch.setattr(API_utils, "_scheduler", API_utils.RateLimitScheduler())
+    assert API_utils._retry_delay("gpt-4o-latest", _status_error(BadRequestError, 400), 0) is None
+    assert API_utils._retry_delay("gpt-4o-latest", ValueError("bad"), 0) is None
+    server_error = _status_error(InternalServerError, 500)
+    assert API_utils._retry_delay("gpt-4o-latest", server_error, 0) is not None
+    assert API_utils._retry_delay("gpt-4o-latest", server_error, API_utils.RATE_LIMIT_MAX_RETRIES) is None
+
+
+def test_vision_prompt_puts_the_image_between_prefix_and_suffix(tmp_path):
+    path = tmp_path / "frame.png"
+    path.write_bytes(PNG_BYTES)
+    prompt = render_prompt("instrument_recognition", question="Which tool is shown?")
+
+    [message] = API_utils._vision_messages(str(path), prompt)
+    text, image, suffix = message["content"]
+    assert (text["text"], suffix["text"]) == (prompt.prefix, prompt.suffix)
+    assert image["image_url"]["url"].startswith("data:image/png;base64,")
+
+    # Plain strings keep the original text + image layout
+    [message] = API_utils._vision_messages(str(path), "Describe the frame.")
+    assert [part["type"] for part in message["content"]] == ["text", "image_url"]
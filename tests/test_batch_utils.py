@@ -0,0 +1,104 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import Utils.API_utils as API_utils
+import Utils.Batch_utils as Batch_utils
+from Utils.API_utils import chat_completion
+from Utils.Batch_utils import BatchSession, batch_row, complete_batches_locally, poll_openai_batches
+
+
+def _responder(body):
+    """
+    Local stand-in for the Batch API: echoes the last message.
+    """
+    prompt = body["messages"][-1]["content"]
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": f"echo: {prompt}"}}]}
+
+
+def _pipeline():
+    # Two dependent calls, so the row needs two batch stages
+    first = chat_completion("gpt-3.5-turbo", [{"role": "user", "content": "first"}])
+    second = chat_completion("gpt-3.5-turbo", [{"role": "user", "content": f"second after {first}"}])
+    return first, second
+
+
+def _run_pass(session, row_id=0):
+    result = None
+    with batch_row(session, row_id) as row:
+        result = _pipeline()
+    return result, row.pending
+
+
+def test_row_is_staged_until_its_responses_arrive(tmp_path):
+    session = BatchSession(str(tmp_path))
+    result, pending = _run_pass(session)
+    assert result is None and pending == 1
+
+    stage_dir = session.write_stage()
+    with open(os.path.join(stage_dir, "requests_000.jsonl")) as f:
+        requests = [json.loads(line) for line in f]
+    assert len(requests) == 1
+    assert requests[0]["body"]["messages"] == [{"role": "user", "content": "first"}]
+    assert session.outstanding() == [os.path.join(stage_dir, "requests_000.jsonl")]
+
+
+def test_local_completion_resumes_to_the_synchronous_result(tmp_path):
+    expected_first = "echo: first"
+    expected = (expected_first, f"echo: second after {expected_first}")
+
+    session = BatchSession(str(tmp_path))
+    for _ in range(2):
+        result, pending = _run_pass(session)
+        assert pending == 1
+        session.write_stage()
+        complete_batches_locally(session, _responder)
+
+    # A fresh session (e.g. after a restart) resumes from the files on disk
+    resumed = BatchSession(str(tmp_path))
+    result, pending = _run_pass(resumed)
+    assert pending == 0
+    assert result == expected
+    assert resumed.write_stage() is None
+    assert resumed.outstanding() == []
+
+
+def test_completed_rows_survive_a_restart(tmp_path):
+    session = BatchSession(str(tmp_path))
+    session.mark_completed(3)
+    assert BatchSession(str(tmp_path)).completed_rows == {3}
+
+
+class _FakeBatches:
+    def __init__(self, batch):
+        self.batch = batch
+
+    def retrieve(self, batch_id):
+        return self.batch
+
+
+def _expired_batch():
+    error = SimpleNamespace(code="batch_expired", message="not completed within 24h")
+    return SimpleNamespace(id="batch_1", status="expired", output_file_id=None, error_file_id=None,
+                           errors=SimpleNamespace(data=[error]))
+
+
+def test_requests_of_a_job_without_output_count_as_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(Batch_utils, "BATCH_MAX_ATTEMPTS", 2)
+    client = SimpleNamespace(batches=_FakeBatches(_expired_batch()), files=None)
+    monkeypatch.setattr(API_utils, "get_openai_client", lambda: client)
+
+    session = BatchSession(str(tmp_path))
+    for attempt in (1, 2):
+        _, pending = _run_pass(session)
+        assert pending == 1
+        stage_dir = session.write_stage()
+        Batch_utils._save_batches(stage_dir, {"requests_000.jsonl": {"batch_id": "batch_1", "status": "validating"}})
+        poll_openai_batches(session)
+        assert session.outstanding() == []
+
+    # The second failure reaches BATCH_MAX_ATTEMPTS, so the row fails instead of re-submitting forever
+    with pytest.raises(RuntimeError, match="batch_expired"):
+        _run_pass(session)
@@ -0,0 +1,42 @@
+from Utils.BM25_utils import BM25Index, tokenize
+
+# Default SURGRAW_RAG_LEXICAL_THRESHOLD (Agents/RAG_module.py)
+LEXICAL_THRESHOLD = 0.35
+
+DOCS = [
+    "Radical prostatectomy removes the prostate gland; patients may need a catheter after surgery.",
+    "Lung cancer incidence is highest in patients over 65 and most cases are diagnosed at a late stage.",
+    "Bipolar forceps coagulate small vessels; the grasper retracts tissue during dissection.",
+]
+
+
+def test_tokenize_drops_stopwords_and_single_characters():
+    assert tokenize("What is the most likely stage of a T2 lung-cancer?") == ["stage", "t2", "lung-cancer"]
+
+
+def test_matching_document_ranks_first():
+    hits = BM25Index(DOCS).search("prostate gland catheter")
+    assert hits[0][0] == 0
+    assert hits[0][1] >= LEXICAL_THRESHOLD
+
+
+def test_off_topic_query_stays_below_the_threshold():
+    # "patients" occurs in two documents, every other query term in none
+    hits = BM25Index(DOCS).search("weather forecast tomorrow in paris patients")
+    assert hits
+    assert all(relevance < LEXICAL_THRESHOLD for _, relevance in hits)
+
+
+def test_query_without_indexed_terms_has_no_hits():
+    assert BM25Index(DOCS).search("weather forecast") == []
+    assert BM25Index(DOCS).search("the of and") == []
+
+
+def test_candidates_restrict_the_search():
+    hits = BM25Index(DOCS).search("patients", candidates={1})
+    assert [doc_index for doc_index, _ in hits] == [1]
+
+
+def test_relevance_is_capped_at_one():
+    hits = BM25Index(DOCS).search("forceps forceps grasper")
+    assert 0 < hits[0][1] <= 1.0
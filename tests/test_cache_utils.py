@@ -0,0 +1,58 @@
+import os
+
+from Utils.Cache_utils import ResponseCache
+
+
+def _image_message(data):
+    return [{"role": "user", "content": [
+        {"type": "text", "text": "Describe the frame."},
+        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}},
+    ]}]
+
+
+def _cache_bytes(cache_dir):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(cache_dir) for name in files if name.endswith(".json"))
+
+
+def test_put_then_get(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    key = cache.make_key("gpt-3.5-turbo", [{"role": "user", "content": "hi"}], {"temperature": 0})
+    assert cache.get(key) is None
+    cache.put(key, "hello", model="gpt-3.5-turbo")
+    assert cache.get(key) == "hello"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_key_depends_on_model_messages_and_params():
+    messages = [{"role": "user", "content": "hi"}]
+    key = ResponseCache.make_key("gpt-3.5-turbo", messages, {"temperature": 0})
+    assert key == ResponseCache.make_key("gpt-3.5-turbo", messages, {"temperature": 0})
+    assert key != ResponseCache.make_key("gpt-4o-latest", messages, {"temperature": 0})
+    assert key != ResponseCache.make_key("gpt-3.5-turbo", messages, {"temperature": 1})
+    assert key != ResponseCache.make_key("gpt-3.5-turbo", [{"role": "user", "content": "hello"}], {"temperature": 0})
+
+
+def test_key_hashes_inline_images_by_content():
+    assert ResponseCache.make_key("gpt-4o-latest", _image_message("AAAA")) == \
+        ResponseCache.make_key("gpt-4o-latest", _image_message("AAAA"))
+    assert ResponseCache.make_key("gpt-4o-latest", _image_message("AAAA")) != \
+        ResponseCache.make_key("gpt-4o-latest", _image_message("BBBB"))
+
+
+def test_overwriting_an_entry_keeps_the_size_exact(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    key = cache.make_key("gpt-3.5-turbo", [{"role": "user", "content": "hi"}])
+    for _ in range(5):
+        cache.put(key, "x" * 100)
+    assert cache.stats()["bytes"] == _cache_bytes(str(tmp_path))
+    assert cache.stats()["evictions"] == 0
+
+
+def test_eviction_keeps_the_cache_under_max_bytes(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=1000)
+    for number in range(20):
+        cache.put(cache.make_key("gpt-3.5-turbo", [{"role": "user", "content": str(number)}]), "y" * 100)
+    assert cache.stats()["evictions"] > 0
+    assert _cache_bytes(str(tmp_path)) <= 1000
+    assert cache.stats()["bytes"] == _cache_bytes(str(tmp_path))
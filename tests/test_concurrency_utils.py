@@ -0,0 +1,74 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+from Utils.Batch_utils import BatchPending
+from Utils.Concurrency_utils import capture_output, run_parallel
+
+mode = contextvars.ContextVar("mode", default="default")
+
+
+def _slow(name, delay):
+    def call():
+        time.sleep(delay)
+        print(f"{name} {mode.get()}")
+        return name
+    return call
+
+
+def test_results_and_logs_follow_call_order(capsys):
+    token = mode.set("bypass")
+    try:
+        # The first call finishes last
+        assert run_parallel(_slow("first", 0.2), _slow("second", 0.0)) == ["first", "second"]
+    finally:
+        mode.reset(token)
+    assert capsys.readouterr().out == "first bypass\nsecond bypass\n"
+
+
+def test_calls_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    # Would deadlock (BrokenBarrierError) if the calls ran one after the other
+    assert run_parallel(barrier.wait, barrier.wait) is not None
+
+
+def test_error_is_raised_after_all_output_is_replayed(capsys):
+    def failing():
+        print("failing")
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        run_parallel(failing, _slow("second", 0.0))
+    assert capsys.readouterr().out == "failing\nsecond default\n"
+
+
+def test_batch_pending_wins_over_ordinary_errors():
+    def failing():
+        raise ValueError("boom")
+
+    def pending():
+        raise BatchPending("queued")
+
+    with pytest.raises(BatchPending):
+        run_parallel(failing, pending)
+
+
+def test_capture_is_per_thread(capsys):
+    captured = []
+
+    def worker():
+        with capture_output() as buffer:
+            print("inside")
+            time.sleep(0.1)
+        captured.append(buffer.getvalue())
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.05)
+    print("outside")
+    thread.join()
+
+    assert captured == ["inside\n"]
+    assert capsys.readouterr().out == "outside\n"
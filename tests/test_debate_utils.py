@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import Utils.Debate_utils as Debate_utils
+from Utils.Debate_utils import evaluate_consensus, gpt_evaluate_metrics, meets_quality_thresholds
+
+RUBRICS = {"Coherence": "coherence rubric", "Collaborative_Synergy": "synergy rubric"}
+
+
+def _replying(monkeypatch, replies):
+    calls = []
+
+    def fake_call(prompt, **params):
+        calls.append((prompt, params))
+        return replies.pop(0)
+    monkeypatch.setattr(Debate_utils, "call_gpt35Turbo_api", fake_call)
+    return calls
+
+
+def test_all_rubrics_are_scored_in_one_call(monkeypatch):
+    calls = _replying(monkeypatch, [json.dumps({"Coherence": 4, "Collaborative_Synergy": "5"})])
+    assert gpt_evaluate_metrics(RUBRICS, "instrument answer", "action answer") == {
+        "Coherence": 4, "Collaborative_Synergy": 5}
+    [(prompt, params)] = calls
+    assert "coherence rubric" in prompt and "synergy rubric" in prompt
+    assert params["response_format"] == {"type": "json_object"}
+
+
+def test_retries_ask_for_the_missing_ratings_without_the_cache(monkeypatch):
+    calls = _replying(monkeypatch, ['{"Coherence": 4}', '{"Coherence": 1, "Collaborative_Synergy": 2}'])
+    # A rating that was already valid is kept
+    assert gpt_evaluate_metrics(RUBRICS, "a", "b") == {"Coherence": 4, "Collaborative_Synergy": 2}
+    assert [params["use_cache"] for _, params in calls] == [True, False]
+    assert "no valid rating for Collaborative_Synergy" in calls[1][0]
+
+
+def test_unusable_replies_default_to_average(monkeypatch):
+    calls = _replying(monkeypatch, ["not json", None, '{"Coherence": 9}'])
+    assert gpt_evaluate_metrics(RUBRICS, "a", "b") == {"Coherence": 3, "Collaborative_Synergy": 3}
+    assert "It is not valid JSON" in calls[1][0]
+
+
+@pytest.fixture
+def short_circuit(monkeypatch):
+    monkeypatch.setattr(Debate_utils, "SCORING_POLICY", "kg_short_circuit")
+    monkeypatch.setattr(Debate_utils, "EVALUATION_MODE", "combined")
+
+
+def test_inconsistent_pair_is_not_scored(monkeypatch, short_circuit):
+    calls = _replying(monkeypatch, [])
+    metrics = evaluate_consensus("Needle Driver", "Cutting", "answer", "answer", "question")
+    assert calls == []
+    assert metrics["scoring"] == "skipped_kg_inconsistent"
+    assert not meets_quality_thresholds(metrics)
+
+
+def test_confident_agreement_is_accepted_without_scoring(monkeypatch, short_circuit):
+    calls = _replying(monkeypatch, [])
+    metrics = evaluate_consensus("Forceps", "Grasping", "The answer is forceps.", "The answer is grasping.", "question")
+    assert calls == []
+    assert metrics["scoring"] == "skipped_confident_agreement"
+    assert meets_quality_thresholds(metrics)
+
+
+def test_unconfident_consistent_pair_is_still_scored(monkeypatch, short_circuit):
+    calls = _replying(monkeypatch, [json.dumps({"Coherence": 4, "Collaborative_Synergy": 3})])
+    metrics = evaluate_consensus("Forceps", "Grasping", "Probably forceps.", "The answer is grasping.", "question")
+    assert len(calls) == 1
+    assert (metrics["scoring"], metrics["Coherence"], metrics["Collaborative_Synergy"]) == ("llm", 4, 3)
+    assert not meets_quality_thresholds(metrics)
@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("sklearn")
+
+from Utils.Embedding_utils import CachedEmbeddings, HashingEmbeddingBackend, get_embedding_backend
+
+
+class CountingBackend(HashingEmbeddingBackend):
+    def __init__(self):
+        super().__init__(n_features=64)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.mark.parametrize("name, backend_id", [
+    ("hashing", "hashing:4096"),
+    ("hashing:256", "hashing:256"),
+])
+def test_backend_is_chosen_by_name_or_backend_id(name, backend_id):
+    assert get_embedding_backend(name).backend_id == backend_id
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="Unknown embedding backend"):
+        get_embedding_backend("word2vec")
+
+
+def test_hashing_vectors_are_normalised_and_stateless():
+    backend = HashingEmbeddingBackend(n_features=64)
+    [vector] = backend.embed_documents(["prostate gland removal"])
+    assert sum(x * x for x in vector) == pytest.approx(1.0)
+    assert backend.embed_query("prostate gland removal") == vector
+
+
+def test_unchanged_chunks_are_embedded_once_across_runs(tmp_path):
+    backend = CountingBackend()
+    first = CachedEmbeddings(backend, str(tmp_path))
+    vectors = first.embed_documents(["chunk a", "chunk b", "chunk a"])
+    assert (first.hits, first.misses) == (1, 2)
+    assert backend.embedded == ["chunk a", "chunk b"]
+
+    # A new process reads the cache back from disk
+    backend.embedded.clear()
+    second = CachedEmbeddings(backend, str(tmp_path))
+    assert second.embed_documents(["chunk b", "chunk c"])[0] == vectors[1]
+    assert (second.hits, second.misses) == (1, 1)
+    assert backend.embedded == ["chunk c"]
+
+
+def test_partially_written_cache_line_is_ignored(tmp_path):
+    cache = CachedEmbeddings(CountingBackend(), str(tmp_path))
+    cache.embed_documents(["chunk a"])
+    with open(cache._path, "a", encoding="utf-8") as f:
+        f.write('{"sha256": "abc", "vec')
+
+    reloaded = CachedEmbeddings(CountingBackend(), str(tmp_path))
+    reloaded.embed_documents(["chunk a"])
+    assert (reloaded.hits, reloaded.misses) == (1, 0)
@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+import Agents.GP_Moderator as GP_Moderator
+
+
+def _answer_event(source, option):
+    return {"type": "answer", "source": source, "option": option, "text": f"The answer is: Option ({option})"}
+
+
+def test_early_consensus_fires_once_both_agents_have_answered():
+    results = []
+    on_event = GP_Moderator._early_consensus_listener(results.append)
+    on_event(_answer_event("instrument_recognition", "A"))
+    assert results == []
+    on_event(_answer_event("action_recognition", "A"))
+    on_event(_answer_event("action_recognition", "B"))  # Only the first answer per agent counts
+    assert len(results) == 1
+    assert set(results[0]) == {"instrument_name", "action_name", "kg_consistency"}
+
+
+def test_early_consensus_is_checked_against_the_final_parse(monkeypatch):
+    stages = []
+    monkeypatch.setattr(GP_Moderator, "mark_stage", lambda stage, data=None: stages.append((stage, data)))
+    early = {"instrument_name": "Forceps", "action_name": "Grasping", "kg_consistency": True}
+
+    assert GP_Moderator.check_early_consensus(early, "forceps", "Grasping ")
+    assert not GP_Moderator.check_early_consensus(early, "Forceps", "Cutting")
+    assert [data["matches_final"] for _, data in stages] == [True, False]
+
+
+def _candidate(iteration, passes):
+    metrics = {"kg_consistency": passes, "Coherence": 5, "Collaborative_Synergy": 5}
+    return {"iteration": iteration, "metrics": metrics}
+
+
+def test_first_accepted_candidate_cancels_the_others(monkeypatch, capsys):
+    started = threading.Barrier(3, timeout=5)
+
+    def fake_refine_once(iteration, question, instrument_question, image_path, cancel_event=None):
+        started.wait()  # Every round is running before one is accepted
+        print(f"iteration {iteration}")
+        if iteration == 2:
+            return _candidate(iteration, passes=True)
+        # The other rounds only stop when they are cancelled
+        assert cancel_event.wait(timeout=5)
+        return None
+    monkeypatch.setattr(GP_Moderator, "refine_once", fake_refine_once)
+
+    candidates = GP_Moderator.refine_speculatively(3, "question", "instrument question", "frame.png")
+    assert [candidate["iteration"] for candidate in candidates] == [2]
+    out = capsys.readouterr().out
+    assert out.index("iteration 1") < out.index("iteration 2") < out.index("iteration 3")
+    assert "finished 1/3 candidates" in out
+
+
+def test_batch_pending_cancels_the_others_and_propagates(monkeypatch):
+    from Utils.Batch_utils import BatchPending
+    cancelled = []
+    started = threading.Barrier(2, timeout=5)
+
+    def fake_refine_once(iteration, question, instrument_question, image_path, cancel_event=None):
+        started.wait()
+        if iteration == 1:
+            raise BatchPending("queued")
+        cancelled.append(cancel_event.wait(timeout=5))
+        return _candidate(iteration, passes=False)
+    monkeypatch.setattr(GP_Moderator, "refine_once", fake_refine_once)
+
+    with pytest.raises(BatchPending):
+        GP_Moderator.refine_speculatively(2, "question", "instrument question", "frame.png")
+    assert cancelled == [True]
+
+
+def test_action_samples_are_paired_with_the_consensus_instrument(monkeypatch):
+    requests = []
+    instrument_samples = ["The answer is: Option (C)", "The answer is: Option (D)", "The answer is: Option (D)"]
+    action_samples = ["The answer is: Option (E)", "The answer is: Option (D)", "The answer is: Option (D)"]
+
+    def fake_instrument_agent(question, image_path, num_samples=1):
+        requests.append(("instrument", question, num_samples))
+        return instrument_samples
+
+    def fake_action_agent(question, image_path, num_samples=1):
+        requests.append(("action", question, num_samples))
+        return action_samples
+
+    def fake_evaluate(instrument_name, action_name, instrument_answer, action_answer, question):
+        return {"kg_consistency": action_name == "Grasping", "Coherence": 5, "Collaborative_Synergy": 5}
+    monkeypatch.setattr(GP_Moderator, "Instrument_Recognition_Agent", fake_instrument_agent)
+    monkeypatch.setattr(GP_Moderator, "Action_Recognition_Agent", fake_action_agent)
+    monkeypatch.setattr(GP_Moderator, "evaluate_consensus", fake_evaluate)
+
+    candidates = GP_Moderator.refine_with_samples(3, "question", "instrument question", "frame.png")
+
+    # One request per agent; the action request is guided by the majority instrument
+    assert [(agent, num_samples) for agent, _, num_samples in requests] == [("instrument", 3), ("action", 3)]
+    assert "Forceps" in requests[1][1]
+    # The second sample is accepted, so the third is never evaluated
+    assert [candidate["parsed_action_name"] for candidate in candidates] == ["Cutting", "Grasping"]
+    assert all(candidate["parsed_instrument_name"] == "Forceps" for candidate in candidates)
+    assert all(candidate["instrument_answer"] == "The answer is: Option (D)" for candidate in candidates)
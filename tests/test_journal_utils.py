@@ -0,0 +1,82 @@
+import Utils.API_utils as API_utils
+from Utils.API_utils import chat_completion
+from Utils.Journal_utils import RunJournal, journal_row
+
+
+def _messages(content):
+    return [{"role": "user", "content": content}]
+
+
+def _fake_api(monkeypatch, calls):
+    def fake_cached_chat_completion(model, messages, timeout, use_cache, params):
+        calls.append(messages[-1]["content"])
+        return f"answer to {messages[-1]['content']}"
+    monkeypatch.setattr(API_utils, "_cached_chat_completion", fake_cached_chat_completion)
+
+
+def test_interrupted_row_replays_its_journaled_responses(tmp_path, monkeypatch):
+    path = str(tmp_path / "run_journal.jsonl")
+    calls = []
+    _fake_api(monkeypatch, calls)
+
+    journal = RunJournal(path)
+    journal.append(0, "started")
+    with journal_row(journal, 0):
+        chat_completion("gpt-3.5-turbo", _messages("first"))
+    journal.close()  # The run dies before the second call
+
+    resumed = RunJournal(path, resume=True)
+    assert resumed.status(0) == "partial"
+    with journal_row(resumed, 0) as row:
+        first = chat_completion("gpt-3.5-turbo", _messages("first"))
+        second = chat_completion("gpt-3.5-turbo", _messages("second"))
+    resumed.close()
+
+    assert (first, second) == ("answer to first", "answer to second")
+    assert row.replayed == 1
+    assert calls == ["first", "second"]
+
+
+def test_repeated_requests_are_journaled_per_occurrence(tmp_path, monkeypatch):
+    path = str(tmp_path / "run_journal.jsonl")
+    calls = []
+    _fake_api(monkeypatch, calls)
+
+    journal = RunJournal(path)
+    with journal_row(journal, 0):
+        chat_completion("gpt-3.5-turbo", _messages("same"))
+    journal.close()
+
+    resumed = RunJournal(path, resume=True)
+    with journal_row(resumed, 0) as row:
+        chat_completion("gpt-3.5-turbo", _messages("same"))
+        chat_completion("gpt-3.5-turbo", _messages("same"))
+    resumed.close()
+
+    # The second occurrence was never journaled, so it is sent again
+    assert row.replayed == 1
+    assert calls == ["same", "same"]
+
+
+def test_finished_and_failed_rows_are_skipped(tmp_path):
+    path = str(tmp_path / "run_journal.jsonl")
+    journal = RunJournal(path)
+    for row_id, status in ((0, "done"), (1, "failed")):
+        journal.append(row_id, "started")
+        journal.append(row_id, status)
+    journal.append(2, "started")
+    journal.close()
+
+    resumed = RunJournal(path, resume=True)
+    assert resumed.summary() == {"done": 1, "failed": 1, "partial": 1}
+    assert resumed.should_skip(0) and resumed.should_skip(1)
+    assert not resumed.should_skip(1, retry_failed=True)
+    assert not resumed.should_skip(2)
+    resumed.close()
+
+
+def test_without_resume_the_previous_journal_is_moved_aside(tmp_path):
+    path = str(tmp_path / "run_journal.jsonl")
+    RunJournal(path).close()
+    RunJournal(path).close()
+    assert len(list(tmp_path.glob("run_journal.jsonl.*.bak"))) == 1
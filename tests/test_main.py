@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+import Main
+from Utils.Results_utils import mark_stage
+
+
+def _row(image_path):
+    return {"image_path": image_path, "COT_Process": "Action Recognition", "question_mcq": "What is happening?"}
+
+
+def test_each_row_saves_its_own_candidates(tmp_path, monkeypatch):
+    def fake_orchestrator(question, image_path, route=None):
+        mark_stage("candidates", [{"image_path": image_path}])
+        return {"answer": image_path}
+    monkeypatch.setattr(Main, "final_orchestrator", fake_orchestrator)
+
+    for index, image_path in enumerate(("frames/a.png", "frames/b.png")):
+        Main.process_row(index, _row(image_path), str(tmp_path), echo=lambda *_: None)
+
+    for name in ("a", "b"):
+        with open(tmp_path / f"{name}_Action_Recognition_candidates.json") as f:
+            assert json.load(f) == [{"image_path": f"frames/{name}.png"}]
+    assert (tmp_path / "a_Action_Recognition_SurgCOT.txt").exists()
+
+
+def test_rows_without_refinement_write_no_candidates(tmp_path, monkeypatch):
+    monkeypatch.setattr(Main, "final_orchestrator", lambda question, image_path, route=None: "A")
+    Main.process_row(0, _row("frames/a.png"), str(tmp_path), echo=lambda *_: None)
+    assert not list(tmp_path.glob("*_candidates.json"))
+
+
+def _planned(routes):
+    pd = pytest.importorskip("pandas")
+    return pd.DataFrame({"route": routes}, index=[10, 11, 12, 13])
+
+
+def test_summarize_plan_estimates_calls_per_route(monkeypatch):
+    monkeypatch.setattr(Main, "CLASSIFIER_BATCH_SIZE", 20)
+    summary = Main.summarize_plan(_planned(["action recognition", "outcome", "outcome", None]))
+
+    assert summary["rows"] == 4
+    assert summary["routes"]["action recognition"]["estimated_llm_calls"] == {"min": 3, "max": 13}
+    assert summary["routes"]["outcome"] == {"rows": 2, "estimated_llm_calls": {"min": 2, "max": 4}}
+    # One classification call on top of the cheapest/most expensive route
+    assert summary["routes"]["unrouted"]["estimated_llm_calls"] == {"min": 2, "max": 15}
+    assert summary["estimated_llm_calls"] == {"min": 7, "max": 32}
+    assert summary["batched_classification_calls_if_preclassified"] == 1
+
+
+def test_group_by_agent_keeps_the_original_index():
+    grouped = Main.group_by_agent(_planned(["outcome", None, "instrument recognition", "outcome"]))
+    assert list(grouped.index) == [12, 10, 13, 11]
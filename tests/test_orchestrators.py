@@ -0,0 +1,81 @@
+import json
+import time
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+import Orchestrators
+from Utils.Results_utils import row_result
+
+
+def _replying(monkeypatch, replies):
+    prompts = []
+
+    def fake_call(prompt, **params):
+        prompts.append(prompt)
+        return replies.pop(0)
+    monkeypatch.setattr(Orchestrators, "call_gpt35Turbo_api", fake_call)
+    return prompts
+
+
+@pytest.mark.parametrize("reply, route", [
+    ('{"category": "Action Recognition"}', "action recognition"),
+    ('{"category": "vision-based"}', None),
+    ("not json", None),
+    ('["outcome"]', None),
+    (None, None),  # Refusal or empty completion
+])
+def test_classify_leaf_question(monkeypatch, reply, route):
+    _replying(monkeypatch, [reply])
+    assert Orchestrators.classify_leaf_question("What is happening?") == route
+
+
+def test_classify_questions_batch_splits_into_calls(monkeypatch):
+    replies = [json.dumps({"1": "outcome", "2": "bogus"}), json.dumps({"1": "patient detail"})]
+    prompts = _replying(monkeypatch, replies)
+    routes = Orchestrators.classify_questions_batch(["q1", "q2", "q3"], batch_size=2)
+    assert routes == ["outcome", None, "patient detail"]
+    assert len(prompts) == 2
+
+
+@pytest.mark.parametrize("reply", [None, "not json", '["outcome"]'])
+def test_classify_questions_batch_survives_bad_replies(monkeypatch, reply):
+    _replying(monkeypatch, [reply])
+    assert Orchestrators.classify_questions_batch(["q1", "q2"]) == [None, None]
+
+
+
+def test_route_stage_excludes_rag_retrieval(monkeypatch):
+    def slow_rag(question, max_tokens=None):
+        time.sleep(0.2)
+        return "https://a:\nRelevant knowledge."
+
+    def Surgical_Outcome_Agent(question, image_path, retrieved_content):
+        return "The answer is: Option (A)"
+
+    monkeypatch.setattr(Orchestrators, "query_rag", slow_rag)
+    monkeypatch.setattr(Orchestrators, "Surgical_Outcome_Agent", Surgical_Outcome_Agent)
+    with row_result() as result:
+        Orchestrators.final_orchestrator("What is the expected outcome?", "frame.png", route="outcome")
+
+    latencies = result.stage_latencies()
+    assert list(latencies) == ["route", "rag", "final"]
+    assert latencies["route"] < 0.1 <= latencies["rag"]
+    assert result.stage_data("route")["agent"] == "Surgical_Outcome_Agent"
+
+
+
+
+def test_plan_routes_classifies_only_unresolved_questions(monkeypatch):
+    monkeypatch.setattr(Orchestrators, "ROUTER_MODE", "local")
+    monkeypatch.setattr(Orchestrators, "route_question_locally",
+                        lambda question: ("outcome", 1.0, "rules") if "outcome" in question else (None, 0.2, "rules"))
+    prompts = _replying(monkeypatch, [json.dumps({"1": "patient detail"})])
+
+    plan = Orchestrators.plan_routes(["what is the outcome?", "how old?"])
+    assert plan == [{"route": "outcome", "confidence": 1.0, "method": "rules"},
+                    {"route": "patient detail", "confidence": None, "method": "llm-batch"}]
+    assert len(prompts) == 1 and "how old?" in prompts[0] and "outcome?" not in prompts[0]
+
+    assert Orchestrators.plan_routes(["how old?"], use_llm=False)[0]["route"] is None
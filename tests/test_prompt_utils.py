@@ -0,0 +1,33 @@
+import pytest
+
+from Utils.Prompt_utils import PROMPTS, Prompt, render_prompt
+
+
+def test_rendered_prompt_keeps_its_static_prefix():
+    first = render_prompt("action_recognition", question="What is the forceps doing?")
+    second = render_prompt("action_recognition", question="Which step comes next?")
+
+    assert isinstance(first, Prompt) and isinstance(first, str)
+    assert first == first.prefix + first.suffix
+    assert first.prefix == second.prefix
+    assert "What is the forceps doing?" in first.suffix and "What is the forceps doing?" not in first.prefix
+    assert first.name == "action_recognition"
+
+
+def test_retrieved_knowledge_goes_after_the_prefix():
+    prompt = render_prompt("surgical_outcome", retrieved_content="RETRIEVED", question="QUESTION")
+    assert prompt.suffix.index("RETRIEVED") < prompt.suffix.index("QUESTION")
+    assert "RETRIEVED" not in prompt.prefix
+
+
+@pytest.mark.parametrize("name", sorted(PROMPTS))
+def test_prefixes_hold_no_per_row_fields(name):
+    template = PROMPTS[name]
+    assert not any("{" + field + "}" in template.prefix for field in template.fields)
+
+
+def test_unknown_template_or_missing_field_raises():
+    with pytest.raises(KeyError):
+        render_prompt("no_such_prompt")
+    with pytest.raises(KeyError):
+        render_prompt("surgical_outcome", question="QUESTION")
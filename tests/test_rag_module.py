@@ -0,0 +1,145 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("langchain_community")
+pytest.importorskip("faiss")
+
+from langchain.schema import Document
+
+import Agents.RAG_module as RAG_module
+from Utils.BM25_utils import BM25Index
+
+DOCS = [
+    Document(page_content="Radical prostatectomy removes the prostate gland.", metadata={"source": "https://a"}),
+    Document(page_content="Lung cancer is often diagnosed at a late stage.", metadata={"source": "https://b"}),
+    Document(page_content="Bipolar forceps coagulate small vessels.", metadata={"source": "https://b"}),
+]
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return [0.0]
+
+
+class FakeStore:
+    embedding_function = FakeEmbeddings()
+
+
+@pytest.fixture
+def fake_index(monkeypatch):
+    dense_hits = []
+    monkeypatch.setattr(RAG_module, "get_rag_store", lambda *args, **kwargs: FakeStore())
+    monkeypatch.setattr(RAG_module, "get_rag_sources", lambda: ["https://a", "https://b"])
+    monkeypatch.setattr(RAG_module, "get_lexical_index",
+                        lambda: (BM25Index([doc.page_content for doc in DOCS]), DOCS))
+    monkeypatch.setattr(RAG_module, "_search", lambda store, embedding, k, filter=None: list(dense_hits))
+    monkeypatch.setattr(RAG_module, "RAG_HYBRID", True)
+    return dense_hits
+
+
+def test_hybrid_search_fuses_dense_and_lexical_hits(fake_index):
+    fake_index.extend([(DOCS[1], 0.8), (DOCS[0], 0.6)])
+    retrieved = RAG_module.hybrid_search("prostate gland prostatectomy", k=3)
+
+    # DOCS[0] is found by both signals, so reciprocal rank fusion puts it first
+    assert [doc for doc, _ in retrieved] == [DOCS[0], DOCS[1]]
+    assert retrieved[0][1]["dense"] == 0.6 and retrieved[0][1]["lexical"] >= RAG_module.LEXICAL_THRESHOLD
+    assert retrieved[1][1] == {"dense": 0.8, "lexical": None}
+
+
+def test_hybrid_search_finds_lexical_only_hits(fake_index):
+    retrieved = RAG_module.hybrid_search("bipolar forceps", k=3)
+    assert [doc for doc, _ in retrieved] == [DOCS[2]]
+    assert retrieved[0][1]["dense"] is None
+
+
+def test_off_topic_query_skips_the_llm_call(fake_index, monkeypatch):
+    def unexpected_call(*args, **kwargs):
+        raise AssertionError("the LLM must not be called without relevant chunks")
+    monkeypatch.setattr(RAG_module, "call_gpt35Turbo_api", unexpected_call)
+
+    assert RAG_module.hybrid_search("weather forecast tomorrow in paris", k=3) == []
+    assert RAG_module.NO_RELEVANT_DATA in RAG_module.query_rag_merged("weather forecast tomorrow in paris")
+
+
+def test_sources_come_from_the_index(tmp_path):
+    assert RAG_module.load_rag_sources(str(tmp_path)) is None
+    with open(tmp_path / "sources.json", "w") as f:
+        json.dump({"sources": [{"url": "https://a"}, {"url": "https://b"}]}, f)
+    assert RAG_module.load_rag_sources(str(tmp_path)) == ["https://a", "https://b"]
+
+
+def test_merged_answers_are_labelled_with_the_index_sources(fake_index, monkeypatch):
+    fake_index.extend([(DOCS[0], 0.9), (DOCS[1], 0.7)])
+    monkeypatch.setattr(RAG_module, "call_gpt35Turbo_api",
+                        lambda prompt, **params: '{"S1": "Removes the gland.", "S2": "Late diagnosis."}')
+    context = RAG_module.query_rag_merged("prostate and lung")
+    assert context == "https://a:\nRemoves the gland.\n\nhttps://b:\nLate diagnosis."
+
+
+def test_empty_llm_reply_means_no_relevant_data(fake_index, monkeypatch):
+    fake_index.extend([(DOCS[0], 0.9)])
+    monkeypatch.setattr(RAG_module, "call_gpt35Turbo_api", lambda prompt, **params: None)
+    expected = f"https://a:\n{RAG_module.NO_RELEVANT_DATA}\n\nhttps://b:\n{RAG_module.NO_RELEVANT_DATA}"
+    assert RAG_module.query_rag_merged("prostate") == expected
+    assert RAG_module.query_rag_per_source("prostate") == expected
+
+
+def test_dense_relevance_matches_langchain(monkeypatch):
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from langchain_community.vectorstores import FAISS
+
+    embeddings = DeterministicFakeEmbedding(size=8)
+    store = FAISS.from_documents(DOCS, embeddings)
+    monkeypatch.setattr(RAG_module, "SCORE_THRESHOLD", float("-inf"))
+
+    query = "prostate gland"
+    ours = RAG_module._search(store, embeddings.embed_query(query), k=3)
+    reference = store.similarity_search_with_relevance_scores(query, k=3)
+    assert [doc.page_content for doc, _ in ours] == [doc.page_content for doc, _ in reference]
+    assert [relevance for _, relevance in ours] == pytest.approx([relevance for _, relevance in reference])
+
+
+PAGES = {
+    "https://a": "Radical prostatectomy removes the prostate gland and nearby tissue. " * 20,
+    "https://b": "Lung cancer is most often diagnosed at a late stage in older patients. " * 20,
+}
+
+
+@pytest.fixture
+def built_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(RAG_module, "fetch_raw_text", PAGES.get)
+    index_dir = str(tmp_path / "rag_index")
+    RAG_module.build_rag_index(index_dir, list(PAGES), backend="hashing")
+    return index_dir
+
+
+def test_index_is_saved_with_its_sources(built_index):
+    with open(f"{built_index}/sources.json") as f:
+        metadata = json.load(f)
+    assert metadata["embedding_backend"].startswith("hashing")
+    assert [source["url"] for source in metadata["sources"]] == list(PAGES)
+    assert all(source["chunks"] > 0 and len(source["sha256"]) == 64 for source in metadata["sources"])
+
+
+def test_saved_index_is_loaded_once_per_process(built_index, monkeypatch):
+    monkeypatch.setattr(RAG_module, "_rag_store", None)
+    monkeypatch.setattr(RAG_module, "_rag_sources", None)
+    loads = []
+    load_rag_index = RAG_module.load_rag_index
+    monkeypatch.setattr(RAG_module, "load_rag_index", lambda index_dir: loads.append(index_dir) or load_rag_index(index_dir))
+
+    stores = []
+    workers = [threading.Thread(target=lambda: stores.append(RAG_module.get_rag_store(built_index))) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert loads == [built_index]
+    assert len({id(store) for store in stores}) == 1
+    assert RAG_module.get_rag_sources() == list(PAGES)
+    [doc] = stores[0].similarity_search("prostate gland", k=1)
+    assert doc.metadata["source"] == "https://a"
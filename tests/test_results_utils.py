@@ -0,0 +1,93 @@
+import pytest
+
+from Utils.Results_utils import (
+    RESULT_COLUMNS,
+    ResultsSink,
+    ground_truth_option,
+    load_results,
+    mark_stage,
+    row_result,
+    summarize_results,
+)
+
+QUESTION = "Which action is shown?\nA. Cutting\nB. Grasping\nC. Suturing"
+
+
+def _record(row, cot_process, correct, status="done"):
+    record = {name: None for name, _ in RESULT_COLUMNS}
+    record.update({"row": row, "cot_process": cot_process, "correct": correct, "status": status,
+                   "total_latency_s": 2.0, "refinements": 0, "prompt_tokens": 10, "completion_tokens": 5,
+                   "llm_calls": 1})
+    return record
+
+
+@pytest.mark.parametrize("ground_truth, option", [
+    ("B", "B"),
+    ("Option (c)", "C"),
+    ("A. Cutting", "A"),
+    ("Grasping", "B"),
+    ("Stapling", None),
+    (None, None),
+    (float("nan"), None),
+])
+def test_ground_truth_option(ground_truth, option):
+    assert ground_truth_option(ground_truth, QUESTION) == option
+
+
+def test_stage_latencies_are_collected_per_row():
+    with row_result() as result:
+        mark_stage("route", {"route": "outcome"})
+        mark_stage("rag")
+    assert result.stage_data("route") == {"route": "outcome"}
+    assert list(result.stage_latencies()) == ["route", "rag", "final"]
+    mark_stage("outside")  # No active row: ignored
+
+
+@pytest.mark.parametrize("suffix", ["jsonl", "parquet"])
+def test_new_run_moves_previous_results_aside(tmp_path, suffix):
+    if suffix == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"results.{suffix}")
+    for row in range(2):
+        sink = ResultsSink(path)
+        sink.write(_record(row, "Outcome", True))
+        sink.close()
+
+    assert list(load_results(path)["row"]) == [1]
+    assert len(list(tmp_path.glob(f"results.{suffix}.*.bak"))) == 1
+
+
+@pytest.mark.parametrize("suffix", ["jsonl", "parquet"])
+def test_resumed_run_adds_to_the_results(tmp_path, suffix):
+    if suffix == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"results.{suffix}")
+    sink = ResultsSink(path)
+    sink.write(_record(0, "Outcome", False, status="failed"))
+    sink.close()
+    sink = ResultsSink(path, resume=True)
+    sink.write(_record(0, "Outcome", True))  # e.g. --retry_failed
+    sink.write(_record(1, "Outcome", True))
+    sink.close()
+
+    df = load_results(path)
+    assert sorted(df["row"]) == [0, 1]
+    assert df["status"].tolist() == ["done", "done"]
+
+
+def test_summarize_results_per_cot_process():
+    pd = pytest.importorskip("pandas")
+    df = pd.DataFrame([
+        _record(0, "Outcome", True),
+        _record(1, "Outcome", False),
+        _record(2, "Action Recognition", True),
+        _record(3, "Action Recognition", None, status="failed"),
+    ])
+    summary = summarize_results(df)
+
+    assert summary.loc["Outcome", "accuracy"] == 0.5
+    assert summary.loc["Action Recognition", "scored"] == 1
+    assert summary.loc["Action Recognition", "failed"] == 1
+    assert summary.loc["overall", "rows"] == 4
+    assert summary.loc["overall", "correct"] == 2
+    assert summary.loc["overall", "prompt_tokens"] == 40
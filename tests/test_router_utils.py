@@ -0,0 +1,74 @@
+import pytest
+
+import Utils.Router_utils as Router_utils
+from Utils.Router_utils import normalize_route, rule_route, route_question_locally
+
+
+@pytest.fixture(autouse=True)
+def no_trained_model(monkeypatch):
+    # Only the rules are tested, whatever SURGRAW_ROUTER_MODEL says
+    monkeypatch.setattr(Router_utils, "get_router_model", lambda *args, **kwargs: None)
+
+
+@pytest.mark.parametrize("question, route", [
+    ("What is the ongoing action of the instrument in the image? A. Retraction B. Suturing", "action recognition"),
+    ("Which surgical instrument is shown in the image? A. Stapler B. Forceps", "instrument recognition"),
+    ("What is the next step after the current phase of the procedure? A. Suturing B. Closure", "action prediction"),
+    ("What is the significance of this step to the procedure? A. Hemostasis B. Exposure", "outcome"),
+    ("What is the median age of the patient at diagnosis? A. 45 B. 67", "patient detail"),
+])
+def test_template_questions_are_routed_by_the_rules(question, route):
+    routed, confidence, method = route_question_locally(question)
+    assert (routed, method) == (route, "rules")
+    assert confidence >= Router_utils.ROUTER_CONFIDENCE_THRESHOLD
+
+
+def test_option_words_do_not_decide_the_route():
+    # "Grasping" and "Cutting" only appear in the options, after the "?"
+    route, _ = rule_route("Which surgical tool is visible? A. Grasping B. Cutting")
+    assert route == "instrument recognition"
+
+
+def test_unconfident_question_is_left_for_the_classifiers():
+    route, confidence, method = route_question_locally("Describe the image. A. One B. Two")
+    assert route is None
+    assert confidence < Router_utils.ROUTER_CONFIDENCE_THRESHOLD
+    assert method == "rules"
+
+
+@pytest.mark.parametrize("label, route", [
+    ("Instrument_Identification", "instrument recognition"),
+    ("Surgical Plan", "action prediction"),
+    ("patient data extraction", "patient detail"),
+    ("unknown process", None),
+])
+def test_normalize_route(label, route):
+    assert normalize_route(label) == route
+
+
+def test_no_model_is_loaded_without_an_explicit_path(tmp_path, monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "router_model.pkl").write_bytes(b"not a pickle")
+    monkeypatch.setattr(Router_utils, "ROUTER_MODEL_PATH", None)
+    monkeypatch.setattr(Router_utils, "_router_model", None)
+    monkeypatch.setattr(Router_utils, "_router_model_loaded", False)
+    assert Router_utils.get_router_model() is None
+
+
+def test_training_examples_are_labelled_with_the_ground_truth(tmp_path):
+    pd = pytest.importorskip("pandas")
+    records = [
+        # The router sent this one to instrument recognition; the label says otherwise
+        {"row": 0, "question": "Which tool performs the action?", "cot_process": "Action Recognition",
+         "route": "instrument recognition"},
+        {"row": 1, "question": "How old is the patient?", "cot_process": "Patient Data Extraction",
+         "route": "patient detail"},
+        {"row": 2, "question": "Unlabelled", "cot_process": "", "route": "outcome"},
+    ]
+    path = tmp_path / "results.jsonl"
+    pd.DataFrame(records).to_json(path, orient="records", lines=True)
+
+    examples = Router_utils.load_training_examples(results_files=[str(path)])
+    assert examples == [("Which tool performs the action?", "action recognition"),
+                        ("How old is the patient?", "patient detail")]
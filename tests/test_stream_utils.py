@@ -0,0 +1,62 @@
+from Utils.Stream_utils import AnswerDetector, stream_events, stream_handlers
+
+
+def _feed(text, size=7):
+    answers = []
+    detector = AnswerDetector(lambda option, text_so_far: answers.append((option, text_so_far)))
+    for start in range(0, len(text), size):
+        detector.feed(text[start:start + size])
+    return detector, answers
+
+
+def test_final_statement_is_confirmed_once_its_line_is_complete():
+    text = "Chain 1: the jaws are closed.\nThe answer is: Option (D)\nThis matches the knowledge graph."
+    detector, answers = _feed(text)
+    assert [option for option, _ in answers] == ["D"]
+    # Confirmed mid-stream, before the trailing line arrived
+    assert "knowledge graph" not in answers[0][1]
+    detector.close()
+    assert len(answers) == 1
+
+
+def test_reasoning_mentions_do_not_fire_early():
+    text = ("Chain 1: one could argue the answer is (B) because of the jaws.\n"
+            "Chain 2: the tip is a hook, which rules that out.\n"
+            "Final answer: Option (E)")
+    detector, answers = _feed(text)
+    assert answers == []  # The final line has not ended yet
+    detector.close()
+    assert [option for option, _ in answers] == ["E"]
+
+
+def test_answer_without_parentheses_is_found_at_the_end():
+    detector, answers = _feed("Chain 1: ...\n**The answer is: Option D**")
+    detector.close()
+    assert detector.option == "D" and answers[0][0] == "D"
+
+
+def test_no_answer_never_fires():
+    detector, answers = _feed("Chain 1: the instrument is unclear.\n")
+    detector.close()
+    assert detector.option is None and answers == []
+
+
+def test_stream_handlers_send_answer_before_done():
+    events = []
+    with stream_events(events.append):
+        on_delta, finish = stream_handlers("action_recognition")
+        for piece in ("Chain 1: ...\n", "The answer is: ", "Option (C)"):
+            on_delta(piece)
+        finish("Chain 1: ...\nThe answer is: Option (C)")
+
+    assert [event["type"] for event in events] == ["token", "token", "token", "answer", "done"]
+    assert events[3]["option"] == "C" and events[3]["source"] == "action_recognition"
+
+
+def test_nested_listeners_see_events_outer_first():
+    seen = []
+    with stream_events(lambda event: seen.append(("outer", event["type"]))):
+        with stream_events(lambda event: seen.append(("inner", event["type"]))):
+            on_delta, _ = stream_handlers("vision")
+            on_delta("x")
+    assert seen == [("outer", "token"), ("inner", "token")]
@@ -0,0 +1,40 @@
+from Utils.Token_utils import TRUNCATION_MARKER, count_tokens, fit_blocks_to_budget, truncate_to_tokens
+
+
+def _block(word, tokens):
+    return " ".join([word] * tokens)
+
+
+def test_truncate_to_tokens():
+    text = _block("cell", 200)
+    assert truncate_to_tokens(text, 500) == text
+    cut = truncate_to_tokens(text, 50)
+    assert cut.endswith(TRUNCATION_MARKER)
+    assert count_tokens(cut) <= 50
+
+
+def test_blocks_within_budget_are_kept():
+    blocks = ["first block", "second block"]
+    assert fit_blocks_to_budget("test", blocks, 1000) == blocks
+    assert fit_blocks_to_budget("test", blocks, None) == blocks
+
+
+def test_ranked_blocks_are_truncated_then_dropped():
+    blocks = [_block("alpha", 100), _block("beta", 100), _block("gamma", 100)]
+    kept = fit_blocks_to_budget("test", blocks, count_tokens(blocks[0]) + 60)
+    assert len(kept) == 2
+    assert kept[0] == blocks[0]
+    assert kept[1].startswith("beta") and kept[1].endswith(TRUNCATION_MARKER)
+
+
+def test_too_small_remainder_drops_the_block():
+    blocks = [_block("alpha", 100), _block("beta", 100)]
+    assert fit_blocks_to_budget("test", blocks, count_tokens(blocks[0]) + 10) == [blocks[0]]
+
+
+def test_equal_share_keeps_every_block():
+    blocks = [_block("alpha", 300), _block("beta", 20), _block("gamma", 300)]
+    kept = fit_blocks_to_budget("test", blocks, 300, separator="\n", equal_share=True)
+    assert len(kept) == 3
+    assert kept[1] == blocks[1]
+    assert all(count_tokens(block) <= 100 for block in kept)
@@ -0,0 +1,69 @@
+import pytest
+
+import Utils.Trace_utils as Trace_utils
+from Utils.Trace_utils import load_spans, percentile, set_span_attributes, span, summarize_spans, traced
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "trace.jsonl"
+    tracer = Trace_utils.Tracer(str(path))
+    monkeypatch.setattr(Trace_utils, "_tracer", tracer)
+    yield path
+    tracer.close()
+
+
+@pytest.mark.parametrize("values, fraction, expected", [
+    ([], 0.5, None),
+    ([1.0], 0.95, 1.0),
+    ([1.0, 2.0, 3.0, 4.0], 0.50, 2.0),
+    ([1.0, 2.0, 3.0, 4.0], 0.95, 4.0),
+    ([1.0, 2.0, 3.0, 4.0], 0.0, 1.0),
+])
+def test_nearest_rank_percentile(values, fraction, expected):
+    assert percentile(values, fraction) == expected
+
+
+def test_nested_spans_share_the_trace(trace_file):
+    @traced("agent")
+    def agent():
+        with span("llm gpt-4o-latest", "llm", model="gpt-4o-latest"):
+            set_span_attributes(prompt_tokens=12, cache="hit")
+
+    with span("row", "row"):
+        agent()
+
+    llm, agent_span, row = load_spans(str(trace_file))
+    assert (row["parent_id"], agent_span["parent_id"], llm["parent_id"]) == (None, row["span_id"], agent_span["span_id"])
+    assert {llm["trace_id"], agent_span["trace_id"]} == {row["trace_id"]}
+    assert llm["attrs"] == {"model": "gpt-4o-latest", "prompt_tokens": 12, "cache": "hit"}
+
+
+def test_errors_are_recorded_and_reraised(trace_file):
+    with pytest.raises(KeyError):
+        with span("stage"):
+            raise KeyError("missing")
+    [record] = load_spans(str(trace_file))
+    assert record["attrs"]["error"] == "KeyError"
+
+
+def test_tracing_is_off_without_a_trace_file(monkeypatch):
+    monkeypatch.setattr(Trace_utils, "_tracer", None)
+    with span("stage") as current:
+        set_span_attributes(ignored=True)
+    assert current is None
+
+
+def test_llm_calls_are_summarized_per_calling_span():
+    spans = [
+        {"span_id": "a", "parent_id": None, "name": "evaluate_consensus", "kind": "stage", "duration_s": 3.0},
+        {"span_id": "b", "parent_id": "a", "name": "llm gpt-3.5-turbo", "kind": "llm", "duration_s": 1.0,
+         "attrs": {"prompt_tokens": 100, "cache": "hit"}},
+        {"span_id": "c", "parent_id": "a", "name": "llm gpt-3.5-turbo", "kind": "llm", "duration_s": 2.0,
+         "attrs": {"prompt_tokens": 50, "retries": 1}},
+    ]
+    stage, llm = summarize_spans(spans)
+    assert stage["name"] == "evaluate_consensus"
+    assert llm["name"] == "llm gpt-3.5-turbo <- evaluate_consensus"
+    assert (llm["count"], llm["p50_s"], llm["p95_s"], llm["total_s"]) == (2, 1.0, 2.0, 3.0)
+    assert (llm["prompt_tokens"], llm["retries"], llm["cache_hits"]) == (150, 1, 1)